@@ -0,0 +1,13 @@
+"""
+Pytest configuration
+"""
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Start each test with an empty cache since the database is rolled back between tests"""
+    from django.core.cache import cache
+    from portal.ccxcon_api import TOKEN_CACHE
+    cache.clear()
+    TOKEN_CACHE.clear()
@@ -1,8 +1,11 @@
 """Async Tasks"""
 import logging
+from django.conf import settings
 from edx_api.client import EdxApi
 
 from teachersportal.celery import async
+from portal.circuit_breaker import CircuitOpen
+from portal.http_pool import SESSIONS, deadline
 from portal.oauth import get_access_token
 from portal.tasks import get_backoff
 from .models import PurchaseOrder
@@ -10,21 +13,33 @@ from .models import PurchaseOrder
 log = logging.getLogger(__name__)
 
 
+class PooledEdxApi(EdxApi):
+    """
+    An EdxApi client whose requests go through the pooled adapter for its
+    host, so they get its timeouts and circuit breaker.
+    """
+    def get_requester(self):
+        return SESSIONS.mount(super(PooledEdxApi, self).get_requester(), self.base_url)
+
+
 @async.task(bind=True, max_retries=5)
 def create_ccx(self, purchase_order_id):
     """Create a backing CCX from a PurchaseOrder"""
     order = PurchaseOrder.objects.get(pk=purchase_order_id)  # pylint: disable=no-member
     url = order.course.instance.instance_url
-    access_token = get_access_token(order.course.instance)
-    api = EdxApi({'access_token': access_token}, base_url=url)
-
-    ccx_id = api.ccx.create(
-        order.course.edx_course_id,
-        order.coach_email,
-        order.seat_count,
-        order.title,
-        None
-    )
+    try:
+        with deadline(settings.EDX_DEADLINE):
+            access_token = get_access_token(order.course.instance)
+        api = PooledEdxApi({'access_token': access_token}, base_url=url)
+        ccx_id = api.ccx.create(
+            order.course.edx_course_id,
+            order.coach_email,
+            order.seat_count,
+            order.title,
+            None
+        )
+    except CircuitOpen as exc:
+        self.retry(exc=exc, countdown=get_backoff(self.request.retries))
 
     if not ccx_id:
         self.retry(countdown=get_backoff(self.request.retries))
@@ -6,14 +6,18 @@ from celery.exceptions import Retry
 from django.test import TestCase
 from django.db.models.signals import post_save
 from factory.django import mute_signals
+from requests import Response
+from requests.adapters import HTTPAdapter
+
+from portal.http_pool import SESSIONS
 
 from .factories import PurchaseOrderFactory
 from .models import PurchaseOrder
-from .tasks import create_ccx
+from .tasks import PooledEdxApi, create_ccx
 
 
 @patch('manual_fulfillment.tasks.get_access_token')
-@patch('manual_fulfillment.tasks.EdxApi')
+@patch('manual_fulfillment.tasks.PooledEdxApi')
 class CreateCCXTests(TestCase):
     """
     Test that ccx's are created on purchase order save.
@@ -61,3 +65,24 @@ class CreateCCXTests(TestCase):
                 create_ccx(order.pk)  # pylint: disable=no-value-for-parameter
 
         assert PurchaseOrder.objects.get(pk=order.pk).ccx_id is None
+
+
+class PooledEdxApiTests(TestCase):
+    """
+    Tests for the edX client used to create CCXs
+    """
+    def test_timeout(self):
+        """
+        Requests go through the pooled adapter, so they get its timeout.
+        """
+        url = 'https://edx.example.com/'
+        requester = PooledEdxApi({'access_token': 'token'}, base_url=url).get_requester()
+        assert requester.get_adapter(url) is SESSIONS.adapter(url)
+
+        response = Response()
+        response.status_code = 201
+        response._content = b''  # pylint: disable=protected-access
+        with patch.object(HTTPAdapter, 'send', autospec=True, return_value=response) as send:
+            requester.post(url + 'api/ccx/v0/ccx/')
+        assert send.call_args[1]['timeout'] == SESSIONS.timeout
+        assert requester.headers['Authorization'] == 'Bearer token'
@@ -0,0 +1,2 @@
+# pylint: disable=missing-docstring,invalid-name
+default_app_config = 'portal.apps.PortalConfig'
@@ -6,7 +6,7 @@ from __future__ import unicode_literals
 
 from django.contrib import admin
 
-from portal.models import Course, Module, BackingInstance
+from portal.models import Course, Fulfillment, Module, BackingInstance
 
 
 class ModuleInline(admin.TabularInline):
@@ -26,3 +26,4 @@ class CourseAdmin(admin.ModelAdmin):
 admin.site.register(Course, CourseAdmin)
 admin.site.register(Module)
 admin.site.register(BackingInstance)
+admin.site.register(Fulfillment)
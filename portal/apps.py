@@ -0,0 +1,35 @@
+"""
+AppConfig
+"""
+from django.apps import AppConfig
+
+
+class PortalConfig(AppConfig):
+    """
+    App config for this app
+    """
+    name = "portal"
+
+    def ready(self):
+        """
+        Ready handler. Import signals and configure outbound HTTP.
+        """
+        import portal.signals  # pylint: disable=unused-variable,unused-import
+        from django.conf import settings
+        from django.core.cache import cache
+        from portal.ccxcon_api import TOKEN_CACHE
+        from portal.http_pool import SESSIONS
+
+        if settings.CCXCON_TOKEN_CACHE_SHARED:
+            TOKEN_CACHE.shared_cache = cache
+        SESSIONS.configure(
+            pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+            connect_timeout=settings.HTTP_CONNECT_TIMEOUT,
+            read_timeout=settings.HTTP_READ_TIMEOUT,
+            max_retries=settings.HTTP_MAX_RETRIES,
+            backoff_factor=settings.HTTP_RETRY_BACKOFF,
+            failure_threshold=settings.HTTP_CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=settings.HTTP_CIRCUIT_RESET_TIMEOUT,
+            state_cache=cache,
+            stats_interval=settings.HTTP_POOL_STATS_INTERVAL,
+        )
@@ -0,0 +1,84 @@
+"""
+Cache of rendered course catalog responses shown to anonymous users.
+
+Every entry is stored alongside the catalog generation it was rendered in.
+Invalidating the catalog just replaces the generation, so stale entries are
+ignored without having to know which keys exist.
+"""
+from __future__ import unicode_literals
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+GENERATION_KEY = 'portal:catalog:generation'
+COURSE_LIST_KEY = 'portal:catalog:list'
+COURSE_DETAIL_KEY = 'portal:catalog:detail:{uuid}'
+
+
+def course_detail_key(course_uuid):
+    """
+    Cache key for an anonymous course detail response.
+
+    Args:
+        course_uuid (str): A course UUID
+    Returns:
+        str: The cache key
+    """
+    return COURSE_DETAIL_KEY.format(uuid=course_uuid)
+
+
+def get_rendered(key):
+    """
+    Look up rendered content and the current catalog generation in one round trip.
+
+    Args:
+        key (str): The cache key
+    Returns:
+        tuple: (bytes or None, str) The cached content, or None if missing or
+            stale, and the generation to pass to set_rendered
+    """
+    values = cache.get_many([GENERATION_KEY, key])
+    generation = values.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, uuid4().hex, None)
+        return None, cache.get(GENERATION_KEY)
+
+    entry = values.get(key)
+    if entry is None:
+        return None, generation
+    entry_generation, content = entry
+    if entry_generation != generation:
+        return None, generation
+    return content, generation
+
+
+def set_rendered(key, content, generation):
+    """
+    Store rendered content.
+
+    Args:
+        key (str): The cache key
+        content (bytes): The rendered response body
+        generation (str): The generation returned by get_rendered before the
+            content was rendered. If the catalog changed while rendering the
+            entry will already be stale.
+    """
+    cache.set(key, (generation, content), settings.CATALOG_CACHE_TIMEOUT)
+
+
+def _replace_generation():
+    """Start a new catalog generation, making every existing entry stale."""
+    cache.set(GENERATION_KEY, uuid4().hex, None)
+
+
+def invalidate_catalog():
+    """
+    Invalidate all cached catalog responses.
+    """
+    _replace_generation()
+    # A request may render from data read before the current transaction commits,
+    # so start another generation once it has.
+    transaction.on_commit(_replace_generation)
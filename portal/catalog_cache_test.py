@@ -0,0 +1,74 @@
+"""
+Tests for the catalog cache
+"""
+# pylint: disable=no-self-use
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from portal.catalog_cache import (
+    COURSE_LIST_KEY,
+    course_detail_key,
+    get_rendered,
+    invalidate_catalog,
+    set_rendered,
+)
+from portal.factories import CourseFactory, ModuleFactory
+
+
+class CatalogCacheTests(TestCase):
+    """
+    Tests for the catalog cache
+    """
+
+    def test_miss_then_hit(self):
+        """
+        A missing entry returns None and a generation which can be used to store it.
+        """
+        content, generation = get_rendered(COURSE_LIST_KEY)
+        assert content is None
+        assert generation is not None
+
+        set_rendered(COURSE_LIST_KEY, b'[]', generation)
+        assert get_rendered(COURSE_LIST_KEY) == (b'[]', generation)
+
+    def test_keys_are_separate(self):
+        """
+        Details for different courses don't share an entry.
+        """
+        _, generation = get_rendered(course_detail_key('a'))
+        set_rendered(course_detail_key('a'), b'a', generation)
+        assert get_rendered(course_detail_key('b'))[0] is None
+        assert get_rendered(course_detail_key('a'))[0] == b'a'
+
+    def test_invalidate(self):
+        """
+        Invalidating the catalog makes existing entries stale.
+        """
+        _, generation = get_rendered(COURSE_LIST_KEY)
+        set_rendered(COURSE_LIST_KEY, b'[]', generation)
+        invalidate_catalog()
+        content, new_generation = get_rendered(COURSE_LIST_KEY)
+        assert content is None
+        assert new_generation != generation
+
+    def test_rendered_during_invalidation(self):
+        """
+        Content rendered before an invalidation but stored after it is stale.
+        """
+        _, generation = get_rendered(COURSE_LIST_KEY)
+        invalidate_catalog()
+        set_rendered(COURSE_LIST_KEY, b'[]', generation)
+        assert get_rendered(COURSE_LIST_KEY)[0] is None
+
+    def test_model_changes_invalidate(self):
+        """
+        Saving or deleting courses and modules invalidates the catalog.
+        """
+        course = CourseFactory.create()
+        module = ModuleFactory.create(course=course)
+        for change in (course.save, module.save, module.delete, course.delete):
+            _, generation = get_rendered(COURSE_LIST_KEY)
+            set_rendered(COURSE_LIST_KEY, b'[]', generation)
+            change()
+            assert get_rendered(COURSE_LIST_KEY)[0] is None
@@ -2,17 +2,147 @@
 Script to create a CCX using the CCXCon REST APIs
 """
 import argparse
+import csv
+import hashlib
+import json
+from multiprocessing.pool import ThreadPool
+import os
 import sys
+import threading
+import time
 
 from oauthlib.oauth2 import BackendApplicationClient
 from requests_oauthlib import OAuth2Session
 from six.moves.urllib.parse import urljoin  # pylint: disable=import-error
 
+try:
+    from portal.http_pool import SESSIONS
+except ImportError:  # Run as a standalone script without portal on the path
+    SESSIONS = None  # pylint: disable=invalid-name
+
 HTTP_201_CREATED = 201
+HTTP_401_UNAUTHORIZED = 401
 CCXCON_TOKEN_URL = '/o/token/'
 CCXCON_CREATE_CCX = '/api/v1/ccx/'
 
 
+def mount(session, url):
+    """
+    Use the pooled connections for a URL's host in a session, when they're available.
+
+    Args:
+        session (requests.Session): The session
+        url (str): Any URL on the host
+
+    Returns:
+        requests.Session: The session
+    """
+    if SESSIONS is None:
+        return session
+    return SESSIONS.mount(session, url)
+
+
+class TokenCache(object):
+    """
+    A thread-safe cache of client credentials tokens keyed by (ccxcon_url, client_id).
+    Tokens are refreshed refresh_margin seconds before they expire. If
+    shared_cache is set (anything with get, set and delete like a Django cache)
+    tokens are also shared between processes.
+    """
+
+    def __init__(self, refresh_margin=60, shared_cache=None):
+        """
+        Args:
+            refresh_margin (int): Seconds before expiry to fetch a new token
+            shared_cache (django.core.cache.BaseCache): An optional cache shared between processes
+        """
+        self.refresh_margin = refresh_margin
+        self.shared_cache = shared_cache
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _shared_key(key):
+        """
+        Returns:
+            str: The key for a token in the shared cache
+        """
+        return 'ccxcon-token:{}'.format(
+            hashlib.md5('\n'.join(key).encode('utf-8')).hexdigest()
+        )
+
+    def _is_fresh(self, token):
+        """
+        Returns:
+            bool: True if the token can be used without refreshing it
+        """
+        return token is not None and token['expires_at'] - self.refresh_margin > time.time()
+
+    def get(self, key, fetch):
+        """
+        Get a token, fetching a new one if there isn't one which is fresh.
+        The lock is held while fetching so concurrent callers share one fetch.
+
+        Args:
+            key (tuple): (ccxcon_url, client_id)
+            fetch (callable): Returns a new token dict with expires_in
+
+        Returns:
+            dict: The token
+        """
+        with self._lock:
+            token = self._tokens.get(key)
+            if not self._is_fresh(token) and self.shared_cache is not None:
+                token = self.shared_cache.get(self._shared_key(key))
+            if self._is_fresh(token):
+                self._tokens[key] = token
+                return token
+
+            token = fetch()
+            if 'expires_in' not in token:
+                # Without an expiry we can't know how long the token is usable
+                self._tokens.pop(key, None)
+                return token
+            token['expires_at'] = time.time() + float(token['expires_in'])
+            self._tokens[key] = token
+            if self.shared_cache is not None:
+                self.shared_cache.set(
+                    self._shared_key(key), token,
+                    max(int(float(token['expires_in']) - self.refresh_margin), 1)
+                )
+            return token
+
+    def invalidate(self, key, access_token):
+        """
+        Forget a token CCXCon rejected, so the next get fetches a new one. A
+        newer token which another thread or process already fetched is kept.
+
+        Args:
+            key (tuple): (ccxcon_url, client_id)
+            access_token (str): The rejected access token
+        """
+        with self._lock:
+            token = self._tokens.get(key)
+            if token is not None and token.get('access_token') == access_token:
+                del self._tokens[key]
+            if self.shared_cache is not None:
+                shared_key = self._shared_key(key)
+                token = self.shared_cache.get(shared_key)
+                if token is not None and token.get('access_token') == access_token:
+                    self.shared_cache.delete(shared_key)
+
+    def clear(self):
+        """
+        Forget every token cached by this process.
+        """
+        with self._lock:
+            self._tokens.clear()
+
+
+# Tokens cached for the lifetime of the process
+TOKEN_CACHE = TokenCache()
+
+
 # pylint: disable=too-few-public-methods
 class CCXConAPI(object):
     """
@@ -20,7 +150,7 @@ class CCXConAPI(object):
     """
     # pylint: disable=too-many-arguments
     def __init__(self, ccxcon_url, client_id, client_secret, cert_verify=True,
-                 oauth_client=None):
+                 oauth_client=None, token_cache=None):
         """
         Args:
             ccxcon_url (str): URL of CCXCon
@@ -29,37 +159,73 @@ class CCXConAPI(object):
             cert_verify (bool): whether to validate TLS certificate
             oauth_client (reqeusts_oauthlib.OAuth2Session): Override for the
                 lazy-loaded oauth client.
+            token_cache (TokenCache): Where to keep tokens, defaults to TOKEN_CACHE
         """
         self.ccxcon_url = ccxcon_url
         self.client_id = client_id
         self.client_secret = client_secret
         self.cert_verify = cert_verify
         self.oauth_client = oauth_client
+        self.token_cache = token_cache if token_cache is not None else TOKEN_CACHE
+        # Only clients made with a cached token can get a new one after a 401
+        self._uses_token_cache = oauth_client is None
+        self._auth_lock = threading.Lock()
 
-    @staticmethod
-    def _get_oauth_client(ccxcon_url, client_id, client_secret, cert_verify):
+    def _fetch_token(self):
         """
-        Function that creates an oauth client and fetches a token.
+        Fetches a new client credentials token from CCXCon.
         """
-        client = BackendApplicationClient(client_id=client_id)
-        oauth_ccxcon = OAuth2Session(client=client)
-        oauth_ccxcon.fetch_token(
-            token_url=urljoin(ccxcon_url, CCXCON_TOKEN_URL),
-            client_id=client_id,
-            client_secret=client_secret,
-            verify=cert_verify
+        client = BackendApplicationClient(client_id=self.client_id)
+        session = mount(OAuth2Session(client=client), self.ccxcon_url)
+        return session.fetch_token(
+            token_url=urljoin(self.ccxcon_url, CCXCON_TOKEN_URL),
+            client_id=self.client_id,
+            client_secret=self.client_secret,
+            verify=self.cert_verify
         )
-        return oauth_ccxcon
 
-    def request(self, method, *args, **kwargs):
+    def authenticate(self):
         """
-        Generic interface for calling http methods on the oauth_client.
+        Creates the oauth_client with a cached token, if there isn't one already.
         """
         if self.oauth_client is None:
-            self.oauth_client = self._get_oauth_client(
-                self.ccxcon_url, self.client_id, self.client_secret,
-                self.cert_verify)
-        return getattr(self.oauth_client, method)(*args, **kwargs)
+            token = self.token_cache.get((self.ccxcon_url, self.client_id), self._fetch_token)
+            self.oauth_client = mount(OAuth2Session(
+                client=BackendApplicationClient(client_id=self.client_id),
+                token=token,
+            ), self.ccxcon_url)
+
+    def _reauthenticate(self, rejected_client):
+        """
+        Replace a client whose token CCXCon rejected with one using a new token,
+        unless another thread sharing this API already has.
+
+        Args:
+            rejected_client (requests_oauthlib.OAuth2Session): The client which got a 401
+
+        Returns:
+            requests_oauthlib.OAuth2Session: The client to retry with
+        """
+        with self._auth_lock:
+            if self.oauth_client is rejected_client:
+                self.token_cache.invalidate((self.ccxcon_url, self.client_id), rejected_client.access_token)
+                self.oauth_client = None
+                self.authenticate()
+            return self.oauth_client
+
+    def request(self, method, *args, **kwargs):
+        """
+        Generic interface for calling http methods on the oauth_client. A
+        cached token which CCXCon rejects, for example because it was revoked,
+        is replaced and the request retried once.
+        """
+        self.authenticate()
+        client = self.oauth_client
+        resp = getattr(client, method)(*args, **kwargs)
+        if resp.status_code == HTTP_401_UNAUTHORIZED and self._uses_token_cache:
+            client = self._reauthenticate(client)
+            resp = getattr(client, method)(*args, **kwargs)
+        return resp
 
     def post(self, *args, **kwargs):
         """
@@ -115,7 +281,125 @@ class CCXConAPI(object):
         )
 
 
-def parse_arguments():
+BATCH_FIELDS = ('master_course', 'user_email', 'seats', 'ccx_title', 'modules')
+RESULT_FIELDS = ('row', 'master_course', 'user_email', 'status_code', 'success', 'error')
+
+
+def read_batch(path):
+    """
+    Read the CCXs to create from a CSV file with a header row, or a JSON lines
+    file if path ends in .jsonl. Each row has the fields in BATCH_FIELDS. In a
+    CSV modules are separated by spaces.
+
+    Args:
+        path (str): Path of the batch file
+
+    Returns:
+        list: (row number, dict of fields) for each CCX, numbered from 1
+    """
+    with open(path) as batch_file:
+        if path.endswith('.jsonl'):
+            items = [json.loads(line) for line in batch_file if line.strip()]
+        else:
+            items = list(csv.DictReader(batch_file))
+
+    rows = []
+    for number, item in enumerate(items, 1):
+        missing = [field for field in BATCH_FIELDS[:-1] if not item.get(field)]
+        if missing:
+            raise ValueError("Row {} is missing {}".format(number, ", ".join(missing)))
+        modules = item.get('modules') or None
+        if modules is not None and not isinstance(modules, list):
+            modules = modules.split()
+        rows.append((number, {
+            'master_course': item['master_course'],
+            'user_email': item['user_email'],
+            'seats': int(item['seats']),
+            'ccx_title': item['ccx_title'],
+            'modules': modules,
+        }))
+    return rows
+
+
+def read_completed(path):
+    """
+    Args:
+        path (str): Path of a results file written by run_batch
+
+    Returns:
+        set: Row numbers which have already been created
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path) as results_file:
+        return {
+            int(result['row']) for result in csv.DictReader(results_file)
+            if result['success'] == 'True'
+        }
+
+
+def run_batch(api, rows, results_path, concurrency=4):
+    """
+    Create a CCX for each row, appending the outcome of each to a results CSV
+    as it finishes. Rows which the results file shows were already created are
+    skipped, so an interrupted or partly failed batch can be run again.
+
+    Args:
+        api (CCXConAPI): The client, shared by every request
+        rows (list): Rows from read_batch
+        results_path (str): Path of the results CSV
+        concurrency (int): Number of CCXs to create at once
+
+    Returns:
+        (int, int): The number of CCXs created and the number which failed
+    """
+    completed = read_completed(results_path)
+    rows = [(number, row) for number, row in rows if number not in completed]
+    if not rows:
+        return 0, 0
+
+    def create(numbered_row):
+        """Create one CCX, returning a result row"""
+        number, row = numbered_row
+        result = {
+            'row': number,
+            'master_course': row['master_course'],
+            'user_email': row['user_email'],
+        }
+        try:
+            worked, status, content = api.create_ccx(
+                row['master_course'], row['user_email'], row['seats'], row['ccx_title'], row['modules']
+            )
+        except Exception as exc:  # pylint: disable=broad-except
+            result.update(status_code='', success=False, error=str(exc))
+        else:
+            result.update(status_code=status, success=worked, error='' if worked else json.dumps(content))
+        return result
+
+    # Fetch the token once before the requests are spread across threads
+    api.authenticate()
+    write_header = not os.path.exists(results_path)
+    created = failed = 0
+    pool = ThreadPool(max(1, min(concurrency, len(rows))))
+    try:
+        with open(results_path, 'a') as results_file:
+            writer = csv.DictWriter(results_file, RESULT_FIELDS)
+            if write_header:
+                writer.writeheader()
+            for result in pool.imap_unordered(create, rows):
+                writer.writerow(result)
+                results_file.flush()
+                if result['success']:
+                    created += 1
+                else:
+                    failed += 1
+    finally:
+        pool.close()
+        pool.join()
+    return created, failed
+
+
+def parse_arguments(argv=None):
     """
     Parsing arguments necessary to create the CCX
     """
@@ -129,20 +413,44 @@ def parse_arguments():
                         help="The user's OAUTH SECRET", required=True)
     # Parameters for creating the CCX
     parser.add_argument('--master-course', dest='mastercourse',
-                        help="The master course UUID", required=True)
+                        help="The master course UUID")
     parser.add_argument('--user-email', dest='useremail',
-                        help="The coach email", required=True)
+                        help="The coach email")
     parser.add_argument('--seats', type=int, dest='seats',
-                        help="The number of seats for the CCX", required=True)
+                        help="The number of seats for the CCX")
     parser.add_argument('--ccx-title', dest='ccxtitle',
-                        help="The title for the CCX", required=True)
+                        help="The title for the CCX")
     parser.add_argument('--modules', dest='modules', nargs="*",
                         help="Course modules")
+    # Parameters for creating many CCXs
+    parser.add_argument('--batch', dest='batch',
+                        help="CSV or .jsonl file of CCXs to create instead of a single CCX. "
+                             "Fields are {}".format(", ".join(BATCH_FIELDS)))
+    parser.add_argument('--results', dest='results',
+                        help="CSV file to record batch results in, and to resume from. "
+                             "Defaults to the batch file name with .results.csv")
+    parser.add_argument('--concurrency', type=int, dest='concurrency', default=4,
+                        help="Number of CCXs to create at once in batch mode")
     # Parameters for the script
     parser.add_argument('--no-cert-verify', dest='certverify',
                         action='store_false', default=True,
                         help="No SSL certificate verification")
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+
+    if args.batch is None:
+        missing = [
+            flag for flag, value in (
+                ('--master-course', args.mastercourse),
+                ('--user-email', args.useremail),
+                ('--seats', args.seats),
+                ('--ccx-title', args.ccxtitle),
+            ) if value is None
+        ]
+        if missing:
+            parser.error("the following arguments are required: {}".format(", ".join(missing)))
+    elif args.results is None:
+        args.results = "{}.results.csv".format(os.path.splitext(args.batch)[0])
+    return args
 
 
 def main():
@@ -157,6 +465,14 @@ def main():
         args.clientsecret,
         args.certverify)
 
+    # pylint: disable=superfluous-parens
+    if args.batch is not None:
+        created, failed = run_batch(api, read_batch(args.batch), args.results, args.concurrency)
+        print('Created {} CCXs, {} failed. Results are in {}'.format(created, failed, args.results))
+        if failed:
+            sys.exit(1)
+        return
+
     worked, status, content = api.create_ccx(
         args.mastercourse,
         args.useremail,
@@ -165,7 +481,6 @@ def main():
         args.modules,
     )
 
-    # pylint: disable=superfluous-parens
     if not worked:
         print('Server returned unexpected status code {}'.format(status))
         sys.exit(1)
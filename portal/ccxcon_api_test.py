@@ -2,11 +2,26 @@
 Tests for CCXConAPI
 """
 # pylint: disable=no-self-use
+import csv
+import json
+import os
+import shutil
+import tempfile
+from threading import Thread
+import time
 from unittest import TestCase
+
+from django.core.cache.backends.locmem import LocMemCache
 from requests import Session
 import mock
 
-from .ccxcon_api import CCXConAPI
+from .ccxcon_api import (
+    CCXConAPI,
+    TokenCache,
+    parse_arguments,
+    read_batch,
+    run_batch,
+)
 
 
 class CCXConAPITest(TestCase):
@@ -96,3 +111,273 @@ class CCXConAPITest(TestCase):
 
         assert not works
         assert status != 201
+
+
+class TokenCacheTest(TestCase):
+    """
+    Tests for TokenCache
+    """
+    key = ('https://ccxcon.example.com/', 'id')
+
+    def setUp(self):
+        self.fetch = mock.Mock(side_effect=lambda: {'access_token': 'token', 'expires_in': 3600})
+
+    def test_reused_between_clients(self):
+        """
+        Clients for the same CCXCon and client id share a token.
+        """
+        token_cache = TokenCache()
+        with mock.patch.object(CCXConAPI, '_fetch_token', autospec=True) as fetch_token:
+            fetch_token.return_value = {'access_token': 'token', 'expires_in': 3600}
+            for _ in range(3):
+                api = CCXConAPI(self.key[0], self.key[1], 'secret', token_cache=token_cache)
+                api.authenticate()
+                assert api.oauth_client.access_token == 'token'
+            CCXConAPI('https://other.example.com/', 'id', 'secret', token_cache=token_cache).authenticate()
+        assert fetch_token.call_count == 2
+
+    def test_refreshes_early(self):
+        """
+        A token is refreshed refresh_margin seconds before it expires.
+        """
+        token_cache = TokenCache(refresh_margin=60)
+        token_cache.get(self.key, self.fetch)
+        with mock.patch('portal.ccxcon_api.time.time', return_value=time.time() + 3500):
+            token_cache.get(self.key, self.fetch)
+        assert self.fetch.call_count == 1
+        with mock.patch('portal.ccxcon_api.time.time', return_value=time.time() + 3550):
+            token_cache.get(self.key, self.fetch)
+        assert self.fetch.call_count == 2
+
+    def test_no_expiry_not_cached(self):
+        """
+        Tokens without expires_in are used once.
+        """
+        self.fetch.side_effect = lambda: {'access_token': 'token'}
+        token_cache = TokenCache()
+        token_cache.get(self.key, self.fetch)
+        token_cache.get(self.key, self.fetch)
+        assert self.fetch.call_count == 2
+
+    def test_shared_cache(self):
+        """
+        Processes sharing a cache share tokens.
+        """
+        shared_cache = LocMemCache('ccxcon-tokens', {})
+        first = TokenCache(shared_cache=shared_cache)
+        second = TokenCache(shared_cache=shared_cache)
+        assert first.get(self.key, self.fetch) == second.get(self.key, self.fetch)
+        assert self.fetch.call_count == 1
+
+    def test_invalidate(self):
+        """
+        Invalidating a token removes it from the process and the shared cache,
+        but not a newer token fetched since.
+        """
+        shared_cache = LocMemCache('ccxcon-tokens', {})
+        token_cache = TokenCache(shared_cache=shared_cache)
+        token_cache.get(self.key, self.fetch)
+        token_cache.invalidate(self.key, 'other')
+        token_cache.get(self.key, self.fetch)
+        assert self.fetch.call_count == 1
+
+        token_cache.invalidate(self.key, 'token')
+        token_cache.get(self.key, self.fetch)
+        assert self.fetch.call_count == 2
+        assert TokenCache(shared_cache=shared_cache).get(self.key, self.fetch)['access_token'] == 'token'
+        assert self.fetch.call_count == 2
+
+    def test_unauthorized_refetches(self):
+        """
+        A 401 from CCXCon throws away the cached token and retries once with a new one.
+        """
+        token_cache = TokenCache()
+        tokens = iter(['revoked', 'new'])
+        api = CCXConAPI(self.key[0], self.key[1], 'secret', token_cache=token_cache)
+        with mock.patch.object(CCXConAPI, '_fetch_token', autospec=True) as fetch_token:
+            fetch_token.side_effect = lambda _: {'access_token': next(tokens), 'expires_in': 3600}
+            with mock.patch('requests_oauthlib.OAuth2Session.post', autospec=True) as post:
+                def _post(session, *args, **kwargs):  # pylint: disable=unused-argument
+                    """CCXCon rejects the revoked token"""
+                    return mock.Mock(status_code=401 if session.access_token == 'revoked' else 201)
+                post.side_effect = _post
+                resp = api.post(url='https://ccxcon.example.com/api/v1/ccx/')
+
+        assert resp.status_code == 201
+        assert post.call_count == 2
+        assert fetch_token.call_count == 2
+        assert token_cache.get(self.key, self.fetch)['access_token'] == 'new'
+
+    def test_unauthorized_retried_once(self):
+        """
+        A second 401 is returned rather than retried again.
+        """
+        api = CCXConAPI(self.key[0], self.key[1], 'secret', token_cache=TokenCache())
+        with mock.patch.object(CCXConAPI, '_fetch_token', autospec=True) as fetch_token:
+            fetch_token.return_value = {'access_token': 'token', 'expires_in': 3600}
+            with mock.patch('requests_oauthlib.OAuth2Session.post', autospec=True) as post:
+                post.return_value.status_code = 401
+                resp = api.post(url='https://ccxcon.example.com/api/v1/ccx/')
+        assert resp.status_code == 401
+        assert post.call_count == 2
+
+    def test_without_pool(self):
+        """
+        Run as a standalone script without the pooled sessions, clients use plain sessions.
+        """
+        with mock.patch('portal.ccxcon_api.SESSIONS', None):
+            with mock.patch.object(CCXConAPI, '_fetch_token', autospec=True) as fetch_token:
+                fetch_token.return_value = {'access_token': 'token', 'expires_in': 3600}
+                api = CCXConAPI(self.key[0], self.key[1], 'secret', token_cache=TokenCache())
+                api.authenticate()
+        assert api.oauth_client.access_token == 'token'
+
+    def test_concurrent_fetch_once(self):
+        """
+        Threads asking for a token at the same time only fetch it once.
+        """
+        def _fetch():
+            """Slow token fetch"""
+            time.sleep(.1)
+            return {'access_token': 'token', 'expires_in': 3600}
+        self.fetch.side_effect = _fetch
+        token_cache = TokenCache()
+
+        threads = [Thread(target=token_cache.get, args=(self.key, self.fetch)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert self.fetch.call_count == 1
+
+
+class BatchTest(TestCase):
+    """
+    Tests for creating CCXs in batches
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.results_path = os.path.join(self.directory, 'results.csv')
+        self.api = mock.Mock()
+        self.api.create_ccx.return_value = (True, 201, {'ccx_id': 1})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        """Write a file in the temporary directory"""
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as batch_file:
+            batch_file.write(content)
+        return path
+
+    def read_results(self):
+        """Read the results file"""
+        with open(self.results_path) as results_file:
+            return sorted(csv.DictReader(results_file), key=lambda result: int(result['row']))
+
+    def test_read_csv(self):
+        """
+        CSV rows have space separated modules.
+        """
+        path = self.write('batch.csv', (
+            "master_course,user_email,seats,ccx_title,modules\n"
+            "course-1,coach@example.com,20,First,module-1 module-2\n"
+            "course-2,coach@example.com,5,Second,\n"
+        ))
+        assert read_batch(path) == [
+            (1, {
+                'master_course': 'course-1',
+                'user_email': 'coach@example.com',
+                'seats': 20,
+                'ccx_title': 'First',
+                'modules': ['module-1', 'module-2'],
+            }),
+            (2, {
+                'master_course': 'course-2',
+                'user_email': 'coach@example.com',
+                'seats': 5,
+                'ccx_title': 'Second',
+                'modules': None,
+            }),
+        ]
+
+    def test_read_jsonl(self):
+        """
+        JSON lines rows have a list of modules.
+        """
+        path = self.write('batch.jsonl', json.dumps({
+            'master_course': 'course-1',
+            'user_email': 'coach@example.com',
+            'seats': 20,
+            'ccx_title': 'First',
+            'modules': ['module-1'],
+        }) + "\n")
+        assert read_batch(path)[0][1]['modules'] == ['module-1']
+
+    def test_missing_fields(self):
+        """
+        Rows missing fields are reported before anything is created.
+        """
+        path = self.write('batch.csv', "master_course,user_email,seats,ccx_title\ncourse-1,,20,First\n")
+        with self.assertRaises(ValueError):
+            read_batch(path)
+
+    def test_run_batch(self):
+        """
+        Every row is created with one client and its status recorded.
+        """
+        rows = [
+            (number, {
+                'master_course': 'course-{}'.format(number),
+                'user_email': 'coach@example.com',
+                'seats': 10,
+                'ccx_title': 'Title',
+                'modules': None,
+            }) for number in range(1, 4)
+        ]
+        self.api.create_ccx.side_effect = [
+            (True, 201, {}),
+            (False, 400, {'error': 'bad'}),
+            Exception("Connection refused"),
+        ]
+        assert run_batch(self.api, rows, self.results_path, concurrency=1) == (1, 2)
+        assert self.api.authenticate.call_count == 1
+
+        results = self.read_results()
+        assert [(result['status_code'], result['success']) for result in results] == [
+            ('201', 'True'), ('400', 'False'), ('', 'False'),
+        ]
+        assert results[2]['error'] == "Connection refused"
+
+    def test_resume(self):
+        """
+        Running a batch again only retries the rows which weren't created.
+        """
+        rows = [
+            (number, {
+                'master_course': 'course-{}'.format(number),
+                'user_email': 'coach@example.com',
+                'seats': 10,
+                'ccx_title': 'Title',
+                'modules': None,
+            }) for number in range(1, 3)
+        ]
+        self.api.create_ccx.side_effect = [(True, 201, {}), (False, 500, {})]
+        run_batch(self.api, rows, self.results_path, concurrency=1)
+
+        self.api.create_ccx.side_effect = None
+        assert run_batch(self.api, rows, self.results_path) == (1, 0)
+        self.api.create_ccx.assert_called_with('course-2', 'coach@example.com', 10, 'Title', None)
+        assert run_batch(self.api, rows, self.results_path) == (0, 0)
+        assert self.api.create_ccx.call_count == 3
+
+    def test_arguments(self):
+        """
+        Single CCX arguments are only required without a batch file.
+        """
+        credentials = ['--ccxcon-url', 'https://ccxcon', '--client-id', 'id', '--client-secret', 'secret']
+        args = parse_arguments(credentials + ['--batch', 'ccxs.csv'])
+        assert args.results == 'ccxs.results.csv'
+        with self.assertRaises(SystemExit):
+            parse_arguments(credentials)
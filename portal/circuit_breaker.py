@@ -0,0 +1,149 @@
+"""
+Circuit breaker for calls to remote services.
+
+After failure_threshold consecutive failures the circuit opens and calls
+fail immediately instead of waiting on a service which is down. Once
+reset_timeout seconds pass the circuit is half-open and a single trial call
+is let through: if it succeeds the circuit closes, otherwise it opens again.
+
+State is kept in a cache (anything with get, set, add and delete like a
+Django cache) so every process talking to a host shares one circuit.
+"""
+import hashlib
+import threading
+import time
+
+from requests.exceptions import RequestException
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpen(RequestException):
+    """
+    Raised instead of making a call while a circuit is open.
+    """
+
+
+class LocalCache(object):
+    """
+    A minimal thread-safe in-process cache, used when no shared cache is configured.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        """
+        Returns:
+            The value for key if it hasn't expired, else None
+        """
+        value, expires_at = self._values.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self._values[key]
+            return None
+        return value
+
+    def get(self, key):
+        """Get a value"""
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value, timeout=None):
+        """Set a value which expires after timeout seconds, or never if timeout is None"""
+        with self._lock:
+            self._values[key] = (value, time.time() + timeout if timeout is not None else None)
+
+    def add(self, key, value, timeout=None):
+        """Set a value only if there isn't one. Returns True if it was set."""
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._values[key] = (value, time.time() + timeout if timeout is not None else None)
+            return True
+
+    def delete(self, key):
+        """Delete a value"""
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class CircuitBreaker(object):
+    """
+    A circuit breaker for one remote service.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, failure_window=60, cache=None):
+        """
+        Args:
+            name (str): Identifies the remote service, usually its scheme and host
+            failure_threshold (int): Consecutive failures which open the circuit
+            reset_timeout (int): Seconds the circuit stays open before a trial call
+            failure_window (int): Seconds after the last failure when the failure count is forgotten
+            cache (django.core.cache.BaseCache): Where to keep state, defaults to a LocalCache
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_window = failure_window
+        self.cache = cache if cache is not None else LocalCache()
+        digest = hashlib.md5(name.encode('utf-8')).hexdigest()
+        self.key = 'circuit:{}'.format(digest)
+        self.probe_key = 'circuit-probe:{}'.format(digest)
+
+    def _get_state(self):
+        """
+        Returns:
+            dict: The failure count and when the circuit opened, if it's open
+        """
+        return self.cache.get(self.key) or {'failures': 0, 'opened_at': None}
+
+    @property
+    def state(self):
+        """
+        Returns:
+            str: CLOSED, OPEN or HALF_OPEN
+        """
+        opened_at = self._get_state()['opened_at']
+        if opened_at is None:
+            return CLOSED
+        if time.time() - opened_at < self.reset_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def allow_request(self):
+        """
+        Returns:
+            bool: True if a call may be made. While half-open only one caller gets True.
+        """
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+        return self.cache.add(self.probe_key, True, self.reset_timeout)
+
+    def record_success(self):
+        """
+        Close the circuit after a successful call.
+        """
+        if self.cache.get(self.key) is not None:
+            self.cache.delete(self.key)
+            self.cache.delete(self.probe_key)
+
+    def record_failure(self):
+        """
+        Count a failed call, opening the circuit if there have been too many
+        or if it was a trial call.
+        """
+        state = self._get_state()
+        state['failures'] += 1
+        if state['opened_at'] is not None or state['failures'] >= self.failure_threshold:
+            state['opened_at'] = time.time()
+            self.cache.delete(self.probe_key)
+            self.cache.set(self.key, state, None)
+        else:
+            self.cache.set(self.key, state, self.failure_window)
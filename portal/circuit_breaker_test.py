@@ -0,0 +1,112 @@
+"""
+Tests for the circuit breaker
+"""
+import time
+from unittest import TestCase
+
+from django.core.cache.backends.locmem import LocMemCache
+import mock
+
+from .circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, LocalCache
+
+
+class CircuitBreakerTest(TestCase):
+    """
+    Tests for CircuitBreaker
+    """
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('https://edx.example.com/', failure_threshold=3, reset_timeout=30)
+
+    def open_circuit(self):
+        """Fail enough times to open the circuit"""
+        for _ in range(3):
+            self.breaker.record_failure()
+
+    def test_opens_after_threshold(self):
+        """
+        The circuit opens after failure_threshold consecutive failures.
+        """
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        assert self.breaker.state == CLOSED
+        assert self.breaker.allow_request()
+
+        self.breaker.record_failure()
+        assert self.breaker.state == OPEN
+        assert not self.breaker.allow_request()
+
+    def test_success_resets_failures(self):
+        """
+        Failures have to be consecutive.
+        """
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        assert self.breaker.state == CLOSED
+
+    def test_half_open_single_trial(self):
+        """
+        After reset_timeout one trial request is allowed.
+        """
+        self.open_circuit()
+        with mock.patch('portal.circuit_breaker.time.time', return_value=time.time() + 31):
+            assert self.breaker.state == HALF_OPEN
+            assert self.breaker.allow_request()
+            assert not self.breaker.allow_request()
+
+    def test_trial_success_closes(self):
+        """
+        A successful trial request closes the circuit.
+        """
+        self.open_circuit()
+        with mock.patch('portal.circuit_breaker.time.time', return_value=time.time() + 31):
+            assert self.breaker.allow_request()
+            self.breaker.record_success()
+            assert self.breaker.state == CLOSED
+            assert self.breaker.allow_request()
+
+    def test_trial_failure_reopens(self):
+        """
+        A failed trial request opens the circuit for another reset_timeout.
+        """
+        self.open_circuit()
+        later = time.time() + 31
+        with mock.patch('portal.circuit_breaker.time.time', return_value=later):
+            assert self.breaker.allow_request()
+            self.breaker.record_failure()
+            assert self.breaker.state == OPEN
+        with mock.patch('portal.circuit_breaker.time.time', return_value=later + 31):
+            assert self.breaker.allow_request()
+
+    def test_shared_state(self):
+        """
+        Breakers for the same host sharing a cache share a circuit.
+        """
+        cache = LocMemCache('circuits', {})
+        first = CircuitBreaker('https://edx.example.com/', failure_threshold=1, cache=cache)
+        second = CircuitBreaker('https://edx.example.com/', failure_threshold=1, cache=cache)
+        other = CircuitBreaker('https://ccxcon.example.com/', failure_threshold=1, cache=cache)
+        first.record_failure()
+        assert second.state == OPEN
+        assert other.state == CLOSED
+
+
+class LocalCacheTest(TestCase):
+    """
+    Tests for LocalCache
+    """
+
+    def test_expiry(self):
+        """
+        Values expire after their timeout.
+        """
+        cache = LocalCache()
+        cache.set('key', 'value', 10)
+        assert cache.get('key') == 'value'
+        assert not cache.add('key', 'other', 10)
+        with mock.patch('portal.circuit_breaker.time.time', return_value=time.time() + 11):
+            assert cache.get('key') is None
+            assert cache.add('key', 'other', 10)
+            assert cache.get('key') == 'other'
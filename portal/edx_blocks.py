@@ -0,0 +1,153 @@
+"""
+Streaming parser for responses from the edX course blocks API.
+
+A course's block tree is megabytes of JSON for real courses, but syncing
+modules only needs the root and its chapters. This reads the response a
+chunk at a time, decoding one block at a time and keeping only the ones
+needed, so memory use depends on the number of chapters rather than the
+size of the course.
+"""
+import codecs
+import json
+import re
+
+# Bytes read from the response at a time
+CHUNK_SIZE = 64 * 1024
+
+# Fields kept from chapter blocks
+CHAPTER_FIELDS = ('id', 'display_name', 'type', 'visible_to_staff_only')
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'\s*')
+
+
+class _Reader(object):
+    """
+    Reads JSON values one at a time from an iterable of byte chunks.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+
+    def _fill(self):
+        """
+        Add the next chunk to the buffer, dropping what's already been read.
+
+        Returns:
+            bool: False if there are no more chunks
+        """
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self._buffer = self._buffer[self._pos:] + text
+                self._pos = 0
+                return True
+        return False
+
+    def peek(self):
+        """
+        Returns:
+            str: The next character which isn't whitespace, without reading it
+        """
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON")
+
+    def take(self, expected):
+        """
+        Read the next character which isn't whitespace.
+
+        Args:
+            expected (str): The characters allowed
+
+        Returns:
+            str: The character read
+        """
+        char = self.peek()
+        if char not in expected:
+            raise ValueError("Expected one of {!r} but found {!r}".format(expected, char))
+        self._pos += 1
+        return char
+
+    def value(self):
+        """
+        Returns:
+            The next complete JSON value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            if end == len(self._buffer) and isinstance(value, (int, float)) and self._fill():
+                # The number may continue in the next chunk
+                continue
+            self._pos = end
+            return value
+
+
+def _iter_keys(reader):
+    """
+    Yields each key of the JSON object at the reader. The caller must read the
+    key's value before asking for the next key.
+    """
+    reader.take('{')
+    if reader.peek() == '}':
+        reader.take('}')
+        return
+    while True:
+        key = reader.value()
+        reader.take(':')
+        yield key
+        if reader.take(',}') == '}':
+            return
+
+
+def parse_course_blocks(chunks):
+    """
+    Parse a blocks API response, keeping only the root block and chapters.
+
+    Args:
+        chunks (iterable): The response body as bytes, for example from response.iter_content
+
+    Returns:
+        dict: The response in the same shape as the API's, with 'root' and 'blocks',
+            but with only the children of the root and the CHAPTER_FIELDS of chapters
+    """
+    reader = _Reader(chunks)
+    root = None
+    blocks = {}
+    # The root may come after the blocks, so keep every course block until it's known
+    course_children = {}
+
+    for key in _iter_keys(reader):
+        if key == 'root':
+            root = reader.value()
+        elif key == 'blocks':
+            for block_id in _iter_keys(reader):
+                block = reader.value()
+                block_type = block.get('type')
+                if block_type == 'chapter':
+                    blocks[block_id] = {
+                        field: block[field] for field in CHAPTER_FIELDS if field in block
+                    }
+                elif block_id == root or (root is None and block_type == 'course'):
+                    course_children[block_id] = block.get('children', [])
+        else:
+            reader.value()
+
+    if root is None:
+        raise ValueError("Missing root")
+    if root not in course_children:
+        raise ValueError("Missing root block {}".format(root))
+    blocks[root] = {'children': course_children[root]}
+    return {'root': root, 'blocks': blocks}
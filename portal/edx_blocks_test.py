@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the streaming blocks API parser
+"""
+# pylint: disable=no-self-use
+from __future__ import unicode_literals
+import json
+import os
+from unittest import TestCase
+
+import pytest
+
+from .edx_blocks import CHAPTER_FIELDS, parse_course_blocks
+
+
+def chunked(body, size):
+    """Split a body into chunks of size bytes"""
+    return [body[start:start + size] for start in range(0, len(body), size)]
+
+
+class ParseCourseBlocksTest(TestCase):
+    """
+    Tests for parse_course_blocks
+    """
+
+    def setUp(self):
+        filename = os.path.join(os.path.dirname(__file__), 'fixtures/course_structure.json')
+        with open(filename, 'rb') as file_obj:
+            self.body = file_obj.read()
+        self.structure = json.loads(self.body.decode('utf-8'))
+
+    def test_matches_full_parse(self):
+        """
+        The root's children and chapters match parsing the whole response, whatever the chunk size.
+        """
+        root = self.structure['root']
+        chapters = self.structure['blocks'][root]['children']
+        for size in (1, 7, 1000, len(self.body)):
+            parsed = parse_course_blocks(chunked(self.body, size))
+            assert parsed['root'] == root
+            assert parsed['blocks'][root]['children'] == chapters
+            assert set(parsed['blocks']) == set(chapters) | {root}
+            for chapter in chapters:
+                assert parsed['blocks'][chapter] == {
+                    field: value for field, value in self.structure['blocks'][chapter].items()
+                    if field in CHAPTER_FIELDS
+                }
+
+    def test_root_first(self):
+        """
+        Only the root is kept when it comes before the blocks, even if there are other course blocks.
+        """
+        body = (
+            '{"root": "a", "blocks": {'
+            '"b": {"type": "course", "children": ["c"]},'
+            '"a": {"children": ["c"], "type": "course"},'
+            '"c": {"id": "c", "display_name": "Café", "type": "chapter", "children": ["d"]},'
+            '"d": {"type": "sequential", "display_name": "D", "children": []}'
+            '}, "count": 12345}'
+        ).encode('utf-8')
+        assert parse_course_blocks(chunked(body, 3)) == {
+            'root': 'a',
+            'blocks': {
+                'a': {'children': ['c']},
+                'c': {'id': 'c', 'display_name': 'Café', 'type': 'chapter'},
+            },
+        }
+
+    def test_invalid(self):
+        """
+        Truncated or incomplete responses are errors.
+        """
+        with pytest.raises(ValueError):
+            parse_course_blocks(chunked(self.body[:-10], 100))
+        with pytest.raises(ValueError):
+            parse_course_blocks([b'{"blocks": {}}'])
+        with pytest.raises(ValueError):
+            parse_course_blocks([b'{"root": "a", "blocks": {}}'])
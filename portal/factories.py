@@ -10,6 +10,7 @@ import faker
 from portal.models import (
     BackingInstance,
     Course,
+    Fulfillment,
     Module,
     Order,
     OrderLine,
@@ -91,3 +92,13 @@ class OrderLineFactory(DjangoModelFactory):
 
     class Meta:  # pylint: disable=missing-docstring,no-init,too-few-public-methods,old-style-class
         model = OrderLine
+
+
+class FulfillmentFactory(DjangoModelFactory):
+    """Factory for Fulfillments"""
+    order = factory.SubFactory(OrderFactory, status=Order.CHARGED)
+    course = factory.SubFactory(CourseFactory)
+    seats = fuzzy.FuzzyInteger(2, 60)
+
+    class Meta:  # pylint: disable=missing-docstring,no-init,too-few-public-methods,old-style-class
+        model = Fulfillment
@@ -0,0 +1,327 @@
+"""
+Pooled HTTP connections for outbound requests to edX and CCXCon.
+
+Each remote host gets one HTTPAdapter whose connection pool is shared by
+every session made for that host, so connections are kept alive and reused
+across requests instead of doing a new TCP and TLS handshake each time.
+Each host also gets a circuit breaker, and requests made inside a deadline
+block have their timeouts cut to the time left. Connection reuse for each
+host is logged every stats_interval seconds.
+"""
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError, HTTPError, Timeout
+from requests.packages.urllib3.util.retry import Retry  # pylint: disable=import-error
+from six.moves.urllib.parse import urlparse  # pylint: disable=import-error
+
+from portal.circuit_breaker import CircuitBreaker, CircuitOpen, OPEN
+
+log = logging.getLogger(__name__)
+_deadlines = threading.local()  # pylint: disable=invalid-name
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Limit the total time spent on requests made by this thread inside the
+    block. Nested deadlines can only shorten the time left.
+
+    Args:
+        seconds (float): The time budget
+    """
+    previous = getattr(_deadlines, 'expires_at', None)
+    expires_at = time.time() + seconds
+    _deadlines.expires_at = expires_at if previous is None else min(previous, expires_at)
+    try:
+        yield
+    finally:
+        _deadlines.expires_at = previous
+
+
+def time_left():
+    """
+    Returns:
+        float: Seconds left before the current deadline, or None outside of a deadline block
+    """
+    expires_at = getattr(_deadlines, 'expires_at', None)
+    if expires_at is None:
+        return None
+    return expires_at - time.time()
+
+
+def _limit_timeout(timeout):
+    """
+    Cut a timeout down to the time left before the current deadline.
+
+    Args:
+        timeout (tuple or float): A requests timeout
+
+    Returns:
+        tuple or float: The timeout to use
+    """
+    remaining = time_left()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise Timeout("Deadline exceeded")
+    if timeout is None:
+        return remaining
+    if isinstance(timeout, tuple):
+        return tuple(remaining if part is None else min(part, remaining) for part in timeout)
+    return min(timeout, remaining)
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter which applies a default timeout to requests without one
+    and tracks failures with a circuit breaker.
+    """
+
+    def __init__(self, timeout=None, breaker=None, **kwargs):
+        """
+        Args:
+            timeout (tuple): Default (connect, read) timeout in seconds
+            breaker (portal.circuit_breaker.CircuitBreaker): The host's circuit breaker
+        """
+        self.timeout = timeout
+        self.breaker = breaker
+        super(PooledAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        kwargs['timeout'] = _limit_timeout(kwargs['timeout'])
+
+        if self.breaker is None:
+            return super(PooledAdapter, self).send(request, **kwargs)
+
+        if not self.breaker.allow_request():
+            raise CircuitOpen("Circuit open for {}".format(self.breaker.name), request=request)
+        try:
+            response = super(PooledAdapter, self).send(request, **kwargs)
+        except (RequestsConnectionError, Timeout):
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+
+class SessionRegistry(object):
+    """
+    Keeps a pooled adapter and a circuit breaker per scheme and host.
+    """
+    defaults = {
+        # Connections kept open per host
+        'pool_maxsize': 10,
+        # Seconds to wait for a connection
+        'connect_timeout': 5,
+        # Seconds to wait between bytes of the response
+        'read_timeout': 30,
+        # Times to retry failed connections. Requests which reached the server are never retried.
+        'max_retries': 3,
+        # Backoff between connection retries
+        'backoff_factor': 0.1,
+        # Consecutive failures which open a host's circuit
+        'failure_threshold': 5,
+        # Seconds a circuit stays open before a trial request
+        'reset_timeout': 30,
+        # Where circuit state is kept, for example a Django cache. Defaults to the process.
+        'state_cache': None,
+        # Seconds between logging the stats of this process's pools, or None not to log them
+        'stats_interval': None,
+    }
+
+    def __init__(self, **options):
+        """
+        Args:
+            options: Overrides for SessionRegistry.defaults
+        """
+        self._adapters = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._stats_logged_at = time.time()
+        self.options = dict(self.defaults)
+        self.configure(**options)
+
+    def configure(self, **options):
+        """
+        Change any of the settings in SessionRegistry.defaults. Existing pools are closed.
+        """
+        unknown = set(options) - set(self.defaults)
+        if unknown:
+            raise TypeError("Unknown options: {}".format(", ".join(sorted(unknown))))
+        with self._lock:
+            self.options.update(options)
+            self.timeout = (self.options['connect_timeout'], self.options['read_timeout'])
+            for adapter in self._adapters.values():
+                adapter.close()
+            self._adapters = {}
+            self._breakers = {}
+
+    @staticmethod
+    def _prefix(url):
+        """
+        Returns:
+            str: The scheme and host of a URL, which adapters are mounted on
+        """
+        parsed = urlparse(url)
+        return "{scheme}://{netloc}/".format(scheme=parsed.scheme, netloc=parsed.netloc)
+
+    def adapter(self, url):
+        """
+        Get the adapter for a URL's host, creating it if necessary.
+
+        Args:
+            url (str): Any URL on the host
+
+        Returns:
+            PooledAdapter: The adapter for the host
+        """
+        prefix = self._prefix(url)
+        with self._lock:
+            if prefix not in self._adapters:
+                self._adapters[prefix] = PooledAdapter(
+                    timeout=self.timeout,
+                    breaker=self._breaker(prefix),
+                    pool_connections=1,
+                    pool_maxsize=self.options['pool_maxsize'],
+                    max_retries=Retry(
+                        total=self.options['max_retries'],
+                        connect=self.options['max_retries'],
+                        read=False,
+                        redirect=False,
+                        backoff_factor=self.options['backoff_factor'],
+                    ),
+                )
+            return self._adapters[prefix]
+
+    def _breaker(self, prefix):
+        """
+        Get or create the circuit breaker for a prefix. Must be called with the lock held.
+        """
+        if prefix not in self._breakers:
+            self._breakers[prefix] = CircuitBreaker(
+                prefix,
+                failure_threshold=self.options['failure_threshold'],
+                reset_timeout=self.options['reset_timeout'],
+                cache=self.options['state_cache'],
+            )
+        return self._breakers[prefix]
+
+    def breaker(self, url):
+        """
+        Get the circuit breaker for a URL's host.
+
+        Args:
+            url (str): Any URL on the host
+
+        Returns:
+            portal.circuit_breaker.CircuitBreaker: The host's circuit breaker
+        """
+        with self._lock:
+            return self._breaker(self._prefix(url))
+
+    @contextmanager
+    def track(self, url):
+        """
+        Apply a host's circuit breaker to requests made inside the block by a
+        client which doesn't use these adapters.
+
+        Args:
+            url (str): Any URL on the host
+        """
+        breaker = self.breaker(url)
+        if breaker.state == OPEN:
+            raise CircuitOpen("Circuit open for {}".format(breaker.name))
+        try:
+            yield
+        except (RequestsConnectionError, Timeout):
+            breaker.record_failure()
+            raise
+        except HTTPError as exc:
+            if exc.response is not None and exc.response.status_code >= 500:
+                breaker.record_failure()
+            raise
+        breaker.record_success()
+
+    def mount(self, session, url):
+        """
+        Use the pooled adapter for a URL's host in an existing session,
+        for example an OAuth2Session.
+
+        Args:
+            session (requests.Session): The session
+            url (str): Any URL on the host
+
+        Returns:
+            requests.Session: The session
+        """
+        session.mount(self._prefix(url), self.adapter(url))
+        self._log_stats()
+        return session
+
+    def session(self, url):
+        """
+        Make a session which uses the pooled adapter for a URL's host. Sessions
+        are cheap since the pool lives in the adapter, and using a new one for
+        each task keeps cookies from leaking between them.
+
+        Args:
+            url (str): Any URL on the host
+
+        Returns:
+            requests.Session: A new session
+        """
+        return self.mount(requests.Session(), url)
+
+    def _log_stats(self):
+        """
+        Log the stats if stats_interval seconds have passed since they were last logged.
+        """
+        interval = self.options['stats_interval']
+        if interval is None:
+            return
+        with self._lock:
+            current = time.time()
+            if current - self._stats_logged_at < interval:
+                return
+            self._stats_logged_at = current
+        log.info("HTTP connection pool stats: %s", self.stats())
+
+    def stats(self):
+        """
+        Connection reuse for each host.
+
+        Returns:
+            dict: Maps scheme and host to the number of requests made, connections
+                opened and the fraction of requests which reused a connection
+        """
+        with self._lock:
+            adapters = list(self._adapters.items())
+
+        stats = {}
+        for prefix, adapter in adapters:
+            pools = adapter.poolmanager.pools
+            pools = [pools[key] for key in pools.keys()]
+            request_count = sum(pool.num_requests for pool in pools)
+            connection_count = sum(pool.num_connections for pool in pools)
+            stats[prefix] = {
+                'requests': request_count,
+                'connections': connection_count,
+                'reuse_rate': (
+                    float(request_count - connection_count) / request_count if request_count else 0.0
+                ),
+            }
+        return stats
+
+
+# Adapters shared by the whole process
+SESSIONS = SessionRegistry()
@@ -0,0 +1,196 @@
+"""
+Tests for pooled HTTP sessions
+"""
+# pylint: disable=no-self-use
+from threading import Thread
+from unittest import TestCase
+
+import mock
+import pytest
+from requests import Request
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError, HTTPError, Timeout
+from six.moves.BaseHTTPServer import (  # pylint: disable=import-error
+    BaseHTTPRequestHandler,
+    HTTPServer,
+)
+
+from .circuit_breaker import CLOSED, OPEN, CircuitOpen
+from .http_pool import SessionRegistry, deadline
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """
+    Answers every GET with an empty 200 and keeps the connection open.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Respond with an empty body"""
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Keep test output quiet"""
+
+
+class SessionRegistryTest(TestCase):
+    """
+    Tests for SessionRegistry
+    """
+
+    def test_adapter_per_host(self):
+        """
+        URLs on the same host share an adapter.
+        """
+        registry = SessionRegistry()
+        adapter = registry.adapter('https://edx.example.com/api/courses/v1/blocks/')
+        assert registry.adapter('https://edx.example.com/oauth2/access_token/') is adapter
+        assert registry.adapter('https://ccxcon.example.com/') is not adapter
+        assert registry.adapter('http://edx.example.com/') is not adapter
+
+        session = registry.session('https://edx.example.com/')
+        assert session.get_adapter('https://edx.example.com/anything') is adapter
+
+    def test_default_timeout(self):
+        """
+        Requests without a timeout get the configured one.
+        """
+        registry = SessionRegistry(connect_timeout=2, read_timeout=7)
+        adapter = registry.adapter('https://edx.example.com/')
+        request = Request('GET', 'https://edx.example.com/').prepare()
+        with mock.patch.object(HTTPAdapter, 'send', autospec=True) as send:
+            send.return_value.status_code = 200
+            adapter.send(request, timeout=None)
+            assert send.call_args[1]['timeout'] == (2, 7)
+
+            adapter.send(request, timeout=1)
+            assert send.call_args[1]['timeout'] == 1
+
+    def test_connection_retries(self):
+        """
+        Connection errors are retried but reads aren't.
+        """
+        registry = SessionRegistry(max_retries=4)
+        retries = registry.adapter('https://edx.example.com/').max_retries
+        assert retries.connect == 4
+        assert retries.read is False
+
+    def test_configure_resets_pools(self):
+        """
+        Changing settings replaces existing adapters.
+        """
+        registry = SessionRegistry()
+        adapter = registry.adapter('https://edx.example.com/')
+        registry.configure(
+            pool_maxsize=2, connect_timeout=1, read_timeout=1, max_retries=0, backoff_factor=0
+        )
+        assert registry.adapter('https://edx.example.com/') is not adapter
+        assert registry.adapter('https://edx.example.com/').timeout == (1, 1)
+
+    def test_reuse_stats(self):
+        """
+        Connections are kept alive between sessions and stats report the reuse.
+        """
+        server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://127.0.0.1:{}/'.format(server.server_port)
+        try:
+            registry = SessionRegistry()
+            for _ in range(4):
+                assert registry.session(url).get(url).status_code == 200
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert registry.stats() == {
+            url: {
+                'requests': 4,
+                'connections': 1,
+                'reuse_rate': 0.75,
+            }
+        }
+
+    def test_stats_logged(self):
+        """
+        Stats are logged from time to time if stats_interval is set.
+        """
+        with mock.patch('portal.http_pool.log') as log:
+            SessionRegistry().session('https://edx.example.com/')
+            assert not log.info.called
+
+            registry = SessionRegistry(stats_interval=60)
+            registry.session('https://edx.example.com/')
+            assert not log.info.called
+            logged_at = registry._stats_logged_at  # pylint: disable=protected-access
+            with mock.patch('portal.http_pool.time.time', return_value=logged_at + 61):
+                registry.session('https://edx.example.com/')
+                registry.session('https://edx.example.com/')
+            assert log.info.call_count == 1
+            assert log.info.call_args[0][1] == registry.stats()
+
+    def test_circuit_opens(self):
+        """
+        Connection errors and 5xx responses open the host's circuit, after which requests fail fast.
+        """
+        registry = SessionRegistry(failure_threshold=2)
+        adapter = registry.adapter('https://edx.example.com/')
+        request = Request('GET', 'https://edx.example.com/').prepare()
+        with mock.patch.object(HTTPAdapter, 'send', autospec=True) as send:
+            send.return_value.status_code = 502
+            adapter.send(request)
+            send.side_effect = RequestsConnectionError()
+            with pytest.raises(RequestsConnectionError):
+                adapter.send(request)
+            assert registry.breaker('https://edx.example.com/').state == OPEN
+
+            send.reset_mock()
+            with pytest.raises(CircuitOpen):
+                adapter.send(request)
+            assert not send.called
+
+        assert registry.breaker('https://ccxcon.example.com/').state == CLOSED
+
+    def test_deadline(self):
+        """
+        Timeouts are cut to the time left before the deadline, and requests after it fail.
+        """
+        registry = SessionRegistry(connect_timeout=5, read_timeout=30)
+        adapter = registry.adapter('https://edx.example.com/')
+        request = Request('GET', 'https://edx.example.com/').prepare()
+        with mock.patch.object(HTTPAdapter, 'send', autospec=True) as send:
+            send.return_value.status_code = 200
+            with deadline(10):
+                adapter.send(request)
+                connect_timeout, read_timeout = send.call_args[1]['timeout']
+                assert connect_timeout == 5
+                assert 9 < read_timeout <= 10
+
+            with deadline(0):
+                with pytest.raises(Timeout):
+                    adapter.send(request)
+            adapter.send(request)
+            assert send.call_args[1]['timeout'] == (5, 30)
+
+    def test_track(self):
+        """
+        Requests made by other clients can be tracked by a host's circuit breaker.
+        """
+        registry = SessionRegistry(failure_threshold=2)
+        url = 'https://edx.example.com/'
+        response = mock.Mock(status_code=404)
+        with pytest.raises(HTTPError):
+            with registry.track(url):
+                raise HTTPError(response=response)
+        assert registry.breaker(url).state == CLOSED
+
+        for _ in range(2):
+            with pytest.raises(Timeout):
+                with registry.track(url):
+                    raise Timeout()
+        with pytest.raises(CircuitOpen):
+            with registry.track(url):
+                pass
@@ -0,0 +1,158 @@
+"""
+Compares parsing whole blocks API responses with the streaming parser on large course trees.
+"""
+
+import json
+from timeit import default_timer
+
+from django.core.management import BaseCommand
+
+from portal.edx_blocks import CHUNK_SIZE, parse_course_blocks
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None  # pylint: disable=invalid-name
+
+BLOCK_URL = "http://localhost:8000/courses/course-v1:edX+Load+Test/jump_to/{}"
+
+
+def make_block(block_id, block_type, children):
+    """
+    Returns:
+        dict: A block shaped like those from the blocks API
+    """
+    return {
+        "id": block_id,
+        "type": block_type,
+        "display_name": "Benchmark {} {}".format(block_type, block_id),
+        "children": children,
+        "lms_web_url": BLOCK_URL.format(block_id),
+        "student_view_url": BLOCK_URL.format(block_id),
+        "visible_to_staff_only": False,
+    }
+
+
+def make_course_body(chapters, sequentials, verticals, components):
+    """
+    Make a blocks API response for a course with the given number of blocks at each level.
+
+    Returns:
+        bytes: The response body
+    """
+    blocks = {}
+    chapter_ids = []
+    for chapter in range(chapters):
+        chapter_id = "chapter-{}".format(chapter)
+        chapter_ids.append(chapter_id)
+        sequential_ids = []
+        for sequential in range(sequentials):
+            sequential_id = "{}-sequential-{}".format(chapter_id, sequential)
+            sequential_ids.append(sequential_id)
+            vertical_ids = []
+            for vertical in range(verticals):
+                vertical_id = "{}-vertical-{}".format(sequential_id, vertical)
+                vertical_ids.append(vertical_id)
+                component_ids = ["{}-html-{}".format(vertical_id, num) for num in range(components)]
+                for component_id in component_ids:
+                    blocks[component_id] = make_block(component_id, "html", [])
+                blocks[vertical_id] = make_block(vertical_id, "vertical", component_ids)
+            blocks[sequential_id] = make_block(sequential_id, "sequential", vertical_ids)
+        blocks[chapter_id] = make_block(chapter_id, "chapter", sequential_ids)
+    blocks["course"] = make_block("course", "course", chapter_ids)
+    return json.dumps({"blocks": blocks, "root": "course"}).encode('utf-8')
+
+
+def iter_chunks(body):
+    """
+    Yields the body in chunks, as response.iter_content does.
+    """
+    for start in range(0, len(body), CHUNK_SIZE):
+        yield body[start:start + CHUNK_SIZE]
+
+
+def parse_whole(chunks):
+    """
+    Parse a response by joining it and loading all of it, as response.json() does.
+    """
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def measure(func, body):
+    """
+    Returns:
+        (float, float): Seconds taken and peak megabytes allocated by func, or None
+            for the peak if it can't be measured
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = default_timer()
+    func(iter_chunks(body))
+    elapsed = default_timer() - start
+    if tracemalloc is None:
+        return elapsed, None
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1024.0 / 1024
+
+
+class Command(BaseCommand):
+    """
+    Compares parsing whole blocks API responses with the streaming parser.
+    """
+    help = "Time and measure memory used parsing synthetic edX course trees"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chapters',
+            dest='chapters',
+            type=int,
+            nargs='+',
+            default=[10, 50],
+            help='Numbers of chapters to benchmark with',
+        )
+        parser.add_argument(
+            '--sequentials',
+            dest='sequentials',
+            type=int,
+            default=10,
+            help='Number of sequentials per chapter',
+        )
+        parser.add_argument(
+            '--verticals',
+            dest='verticals',
+            type=int,
+            default=5,
+            help='Number of verticals per sequential',
+        )
+        parser.add_argument(
+            '--components',
+            dest='components',
+            type=int,
+            default=5,
+            help='Number of components per vertical',
+        )
+
+    def format_result(self, name, elapsed, peak):
+        """
+        Returns:
+            str: The time and memory used by one parser
+        """
+        result = "{name} {ms:.1f}ms".format(name=name, ms=elapsed * 1000)
+        if peak is not None:
+            result += " {mb:.1f}MB peak".format(mb=peak)
+        return result
+
+    def handle(self, *args, **kwargs):
+        for chapters in kwargs['chapters']:
+            body = make_course_body(
+                chapters, kwargs['sequentials'], kwargs['verticals'], kwargs['components']
+            )
+            whole = measure(parse_whole, body)
+            streaming = measure(parse_course_blocks, body)
+            self.stdout.write("{chapters} chapters, {mb:.1f}MB: {whole}, {streaming}".format(
+                chapters=chapters,
+                mb=len(body) / 1024.0 / 1024,
+                whole=self.format_result("json.loads", *whole),
+                streaming=self.format_result("streaming", *streaming),
+            ))
@@ -0,0 +1,32 @@
+"Test for blocks parser benchmark script"
+# pylint: disable=no-self-use
+from django.test import SimpleTestCase
+from django.utils.six import StringIO
+
+from portal.edx_blocks import parse_course_blocks
+from .benchmark_blocks_parse import Command, iter_chunks, make_course_body, parse_whole
+
+
+class BenchmarkBlocksParseTestCase(SimpleTestCase):
+    "Test for blocks parser benchmark script"
+
+    def test_benchmark(self):
+        "Should report timings for each course size"
+        out = StringIO()
+        command = Command(stdout=out)
+        command.handle(chapters=[1, 3], sequentials=2, verticals=2, components=2)
+
+        output = out.getvalue()
+        assert "1 chapters," in output
+        assert "3 chapters," in output
+        assert "json.loads" in output
+        assert "streaming" in output
+
+    def test_synthetic_course(self):
+        "The synthetic course parses the same both ways"
+        body = make_course_body(3, 2, 2, 2)
+        whole = parse_whole(iter_chunks(body))
+        streamed = parse_course_blocks(iter_chunks(body))
+        assert len(whole['blocks']) == 1 + 3 + 3 * 2 + 3 * 2 * 2 + 3 * 2 * 2 * 2
+        assert streamed['blocks']['course']['children'] == whole['blocks']['course']['children']
+        assert len(streamed['blocks']) == 4
@@ -0,0 +1,93 @@
+"""
+Times creating orders with different numbers of lines.
+"""
+
+from timeit import default_timer
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from portal.models import BackingInstance, Course, Module
+from portal.util import create_order, validate_cart
+
+
+class Command(BaseCommand):
+    """
+    Times creating orders with different numbers of lines.
+    """
+    help = "Time create_order for orders with different numbers of lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lines',
+            dest='lines',
+            type=int,
+            nargs='+',
+            default=[1, 10, 100],
+            help='Numbers of order lines to benchmark with',
+        )
+        parser.add_argument(
+            '--repeat',
+            dest='repeat',
+            type=int,
+            default=10,
+            help='Number of orders to create for each size',
+        )
+
+    @staticmethod
+    def create_cart(line_count):
+        """
+        Create a live course with line_count priced modules.
+
+        Returns:
+            list: A cart containing every module in the course
+        """
+        instance = BackingInstance.objects.create(instance_url="http://{}".format(uuid4().hex))
+        course = Course.objects.create(
+            uuid=uuid4().hex,
+            title="Benchmark course",
+            live=True,
+            instance=instance,
+        )
+        Module.objects.bulk_create(
+            Module(
+                uuid=uuid4().hex,
+                course=course,
+                title="Benchmark module {}".format(num),
+                price_without_tax=num + 1,
+                order=num,
+            ) for num in range(line_count)
+        )
+        return [{
+            "uuids": list(course.modules.values_list('uuid', flat=True)),
+            "seats": 10,
+            "course_uuid": course.uuid,
+        }]
+
+    def handle(self, *args, **kwargs):
+        if not settings.DEBUG:
+            raise CommandError("Not creating benchmark data in non-debug environment.")
+
+        for line_count in kwargs['lines']:
+            with transaction.atomic():
+                user = User.objects.create_user(uuid4().hex)
+                priced_cart = validate_cart(self.create_cart(line_count), user)
+
+                with CaptureQueriesContext(connection) as context:
+                    start = default_timer()
+                    for _ in range(kwargs['repeat']):
+                        create_order(priced_cart, user)
+                    elapsed = default_timer() - start
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                "{count} lines: {ms:.2f}ms and {queries} queries per order".format(
+                    count=line_count,
+                    ms=elapsed * 1000 / kwargs['repeat'],
+                    queries=len(context.captured_queries) // kwargs['repeat'],
+                )
+            )
@@ -0,0 +1,35 @@
+"Test for create_order benchmark script"
+# pylint: disable=no-self-use
+from django.core.management import CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+import pytest
+
+from portal.models import Course, Order, OrderLine
+from .benchmark_create_order import Command
+
+
+class BenchmarkCreateOrderTestCase(TestCase):
+    "Test for create_order benchmark script"
+
+    @override_settings(DEBUG=True)
+    def test_benchmark(self):
+        "Should report timings and clean up after itself"
+        out = StringIO()
+        command = Command(stdout=out)
+        command.handle(lines=[1, 10], repeat=2)
+
+        output = out.getvalue()
+        assert "1 lines:" in output
+        assert "10 lines:" in output
+        assert "3 queries per order" in output
+        assert not Course.objects.exists()
+        assert not Order.objects.exists()
+        assert not OrderLine.objects.exists()
+
+    @override_settings(DEBUG=False)
+    def test_error_if_not_debug(self):
+        "should error if not in debug environment"
+        with pytest.raises(CommandError):
+            Command().handle(lines=[1], repeat=1)
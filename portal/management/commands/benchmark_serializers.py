@@ -0,0 +1,101 @@
+"""
+Compares CourseSerializer with the fast serialization path on large catalogs.
+"""
+
+from timeit import default_timer
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from portal.models import BackingInstance, Course, Module
+from portal.serializers import CourseSerializer, serialize_courses
+
+
+class Command(BaseCommand):
+    """
+    Compares CourseSerializer with the fast serialization path.
+    """
+    help = "Time serializing the course catalog with CourseSerializer and the fast path"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--courses',
+            dest='courses',
+            type=int,
+            nargs='+',
+            default=[1000, 10000],
+            help='Numbers of courses to benchmark with',
+        )
+        parser.add_argument(
+            '--modules',
+            dest='modules',
+            type=int,
+            default=5,
+            help='Number of modules per course',
+        )
+
+    @staticmethod
+    def create_courses(course_count, module_count):
+        """
+        Create courses and modules in bulk.
+        """
+        instance = BackingInstance.objects.create(instance_url="http://{}".format(uuid4().hex))
+        Course.objects.bulk_create(
+            Course(
+                uuid=uuid4().hex,
+                title="Benchmark course {}".format(num),
+                description="Benchmark course description",
+                live=True,
+                instance=instance,
+                instructors=["Instructor {}".format(num) for num in range(3)],
+            ) for num in range(course_count)
+        )
+        Module.objects.bulk_create(
+            Module(
+                uuid=uuid4().hex,
+                course_id=course_id,
+                title="Benchmark module {}".format(num),
+                price_without_tax=num,
+                order=num,
+            )
+            for course_id in Course.objects.filter(instance=instance).values_list('id', flat=True)
+            for num in range(module_count)
+        )
+
+    @staticmethod
+    def time(func):
+        """
+        Returns:
+            float: Seconds taken to call func
+        """
+        start = default_timer()
+        func()
+        return default_timer() - start
+
+    def handle(self, *args, **kwargs):
+        if not settings.DEBUG:
+            raise CommandError("Not creating benchmark data in non-debug environment.")
+
+        renderer = JSONRenderer()
+        for course_count in kwargs['courses']:
+            with transaction.atomic():
+                self.create_courses(course_count, kwargs['modules'])
+                courses = Course.objects.filter(live=True)
+                serializer_time = self.time(lambda courses=courses: renderer.render(
+                    CourseSerializer(courses.for_serialization(), many=True).data
+                ))
+                fast_time = self.time(lambda courses=courses: renderer.render(serialize_courses(courses)))
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                "{count} courses: CourseSerializer {serializer:.3f}s, "
+                "fast path {fast:.3f}s, {speedup:.1f}x faster".format(
+                    count=course_count,
+                    serializer=serializer_time,
+                    fast=fast_time,
+                    speedup=serializer_time / fast_time if fast_time else float('inf'),
+                )
+            )
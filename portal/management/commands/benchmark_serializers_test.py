@@ -0,0 +1,33 @@
+"Test for serializer benchmark script"
+# pylint: disable=no-self-use
+from django.core.management import CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+import pytest
+
+from portal.models import Course, Module
+from .benchmark_serializers import Command
+
+
+class BenchmarkSerializersTestCase(TestCase):
+    "Test for serializer benchmark script"
+
+    @override_settings(DEBUG=True)
+    def test_benchmark(self):
+        "Should report timings and clean up after itself"
+        out = StringIO()
+        command = Command(stdout=out)
+        command.handle(courses=[3, 5], modules=2)
+
+        output = out.getvalue()
+        assert "3 courses:" in output
+        assert "5 courses:" in output
+        assert not Course.objects.exists()
+        assert not Module.objects.exists()
+
+    @override_settings(DEBUG=False)
+    def test_error_if_not_debug(self):
+        "should error if not in debug environment"
+        with pytest.raises(CommandError):
+            Command().handle(courses=[1], modules=1)
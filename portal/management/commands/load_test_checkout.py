@@ -0,0 +1,350 @@
+"""
+Load tests checkout against local stand-ins for Stripe and CCXCon.
+"""
+
+from collections import Counter, namedtuple
+import json
+import math
+import os
+import random
+import threading
+import time
+from timeit import default_timer
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from six.moves import queue  # pylint: disable=import-error
+from six.moves.BaseHTTPServer import (  # pylint: disable=import-error
+    BaseHTTPRequestHandler,
+    HTTPServer,
+)
+from six.moves.socketserver import ThreadingMixIn  # pylint: disable=import-error
+import stripe
+
+from portal.ccxcon_api import CCXCON_TOKEN_URL
+from portal.factories import CourseFactory, ModuleFactory, UserFactory
+from portal.models import BackingInstance
+
+CheckoutResult = namedtuple('CheckoutResult', ['status', 'latency', 'queries'])
+
+
+def stripe_response(path, failed):  # pylint: disable=unused-argument
+    """
+    Returns:
+        (int, dict): The status and body Stripe would respond to a charge with
+    """
+    if failed:
+        return 402, {
+            "error": {
+                "type": "card_error",
+                "code": "card_declined",
+                "message": "Your card was declined.",
+            }
+        }
+    return 200, {"id": "ch_load_test", "object": "charge", "paid": True}
+
+
+def ccxcon_response(path, failed):
+    """
+    Returns:
+        (int, dict): The status and body CCXCon would respond to a token or CCX request with
+    """
+    if path.startswith(CCXCON_TOKEN_URL):
+        return 200, {"access_token": "load-test", "token_type": "Bearer", "expires_in": 3600}
+    if failed:
+        return 500, {"error": "Stub error"}
+    return 201, {}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers every POST with the server's responder after its latency.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Respond like the service being stood in for"""
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        status, body = self.server.respond(self.path)
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Keep output quiet"""
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    A local HTTP server standing in for a remote service.
+    """
+    daemon_threads = True
+
+    def __init__(self, responder, latency=0, error_rate=0):
+        """
+        Args:
+            responder (callable): Takes the path and whether the request should fail,
+                and returns the status and body
+            latency (float): Seconds to wait before responding
+            error_rate (float): Fraction of requests which fail
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.responder = responder
+        self.latency = latency
+        self.error_rate = error_rate
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        """
+        Returns:
+            str: The server's base URL
+        """
+        return 'http://127.0.0.1:{}/'.format(self.server_port)
+
+    def respond(self, path):
+        """
+        Returns:
+            (int, dict): The status and body for a request
+        """
+        time.sleep(self.latency)
+        return self.responder(path, random.random() < self.error_rate)
+
+    def start(self):
+        """Start serving in a background thread"""
+        self.thread.start()
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.shutdown()
+        self.server_close()
+
+
+def percentile(values, pct):
+    """
+    Args:
+        values (list): Numbers
+        pct (float): A percentile between 0 and 100
+
+    Returns:
+        The nearest-rank percentile of values
+    """
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(pct / 100.0 * len(ordered))) - 1, 0)]
+
+
+class Command(BaseCommand):
+    """
+    Load tests checkout against local stand-ins for Stripe and CCXCon.
+    """
+    help = "Drive concurrent checkouts against stub Stripe and CCXCon servers and report throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            dest='requests',
+            type=int,
+            default=200,
+            help='Total number of checkouts',
+        )
+        parser.add_argument(
+            '--concurrency',
+            dest='concurrency',
+            type=int,
+            default=10,
+            help='Number of users checking out at once',
+        )
+        parser.add_argument(
+            '--courses',
+            dest='courses',
+            type=int,
+            default=10,
+            help='Number of courses to buy from',
+        )
+        parser.add_argument(
+            '--modules',
+            dest='modules',
+            type=int,
+            default=5,
+            help='Number of modules in each course',
+        )
+        for service in ('stripe', 'ccxcon'):
+            parser.add_argument(
+                '--{}-latency'.format(service),
+                dest='{}_latency'.format(service),
+                type=float,
+                default=100,
+                help='Milliseconds the {} stub waits before responding'.format(service),
+            )
+            parser.add_argument(
+                '--{}-error-rate'.format(service),
+                dest='{}_error_rate'.format(service),
+                type=float,
+                default=0,
+                help='Fraction of {} stub requests which fail'.format(service),
+            )
+
+    @staticmethod
+    def seed(user_count, course_count, module_count):
+        """
+        Create users who can check out and live courses with priced modules.
+
+        Returns:
+            (list, list, list): The users, the courses, and one cart for each course with its total
+        """
+        users = UserFactory.create_batch(user_count)
+        courses = []
+        carts = []
+        for _ in range(course_count):
+            course = CourseFactory.create(live=True)
+            courses.append(course)
+            modules = ModuleFactory.create_batch(module_count, course=course)
+            seats = 10
+            carts.append(([{
+                "uuids": [module.uuid for module in modules],
+                "seats": seats,
+                "course_uuid": course.uuid,
+            }], float(sum(module.price_without_tax for module in modules) * seats)))
+        return users, courses, carts
+
+    @staticmethod
+    def clean_up(users, courses):
+        """
+        Delete everything created by seed and the checkouts.
+        """
+        instance_ids = [course.instance_id for course in courses]
+        instance_ids.extend(user.userinfo.edx_instance_id for user in users)
+        # Orders, lines and fulfillments cascade from the users, and courses from their instances
+        User.objects.filter(id__in=[user.id for user in users]).delete()
+        BackingInstance.objects.filter(id__in=instance_ids).delete()
+
+    @staticmethod
+    def checkout(client, cart, total):
+        """
+        Check out a cart and time it.
+
+        Returns:
+            CheckoutResult: The response status, seconds taken and number of queries
+        """
+        with CaptureQueriesContext(connection) as context:
+            start = default_timer()
+            try:
+                status = client.post(
+                    reverse('checkout'),
+                    content_type='application/json',
+                    data=json.dumps({"cart": cart, "token": "tok_load_test", "total": total}),
+                ).status_code
+            except Exception:  # pylint: disable=broad-except
+                # The test client re-raises errors from the view instead of responding with a 500
+                status = 500
+            latency = default_timer() - start
+        return CheckoutResult(status, latency, len(context.captured_queries))
+
+    def worker(self, user, jobs, results):
+        """
+        Check out carts from jobs as user until there are none left.
+        """
+        client = Client()
+        client.force_login(user)
+        try:
+            while True:
+                try:
+                    cart, total = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                results.append(self.checkout(client, cart, total))
+        finally:
+            client.logout()
+            connection.close()
+
+    def run_load(self, users, carts, request_count):
+        """
+        Check out random carts with one thread per user.
+
+        Returns:
+            (list, float): A CheckoutResult for each request and the seconds taken
+        """
+        jobs = queue.Queue()
+        for _ in range(request_count):
+            jobs.put(random.choice(carts))
+        results = []
+        threads = [
+            threading.Thread(target=self.worker, args=(user, jobs, results))
+            for user in users
+        ]
+        start = default_timer()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, default_timer() - start
+
+    def report(self, results, elapsed, concurrency):
+        """
+        Write latency percentiles, queries per request and throughput.
+        """
+        latencies = [result.latency * 1000 for result in results]
+        queries = [result.queries for result in results]
+        statuses = Counter(result.status for result in results)
+        self.stdout.write("{count} checkouts, {concurrency} at once, in {seconds:.2f}s".format(
+            count=len(results), concurrency=concurrency, seconds=elapsed,
+        ))
+        self.stdout.write("Responses: {}".format(", ".join(
+            "{} x {}".format(status, count) for status, count in sorted(statuses.items())
+        )))
+        self.stdout.write("Latency: p50 {:.1f}ms, p95 {:.1f}ms, p99 {:.1f}ms".format(
+            percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99),
+        ))
+        self.stdout.write("Queries per request: {:.1f} mean, {} max".format(
+            float(sum(queries)) / len(queries), max(queries),
+        ))
+        self.stdout.write("Orders per second: {:.1f}".format(statuses[200] / elapsed))
+
+    def handle(self, *args, **kwargs):
+        if not settings.DEBUG:
+            raise CommandError("Not creating load test data in non-debug environment.")
+        if kwargs['requests'] < 1 or kwargs['concurrency'] < 1:
+            raise CommandError("Need at least one request and one user.")
+
+        stripe_server = StubServer(
+            stripe_response, kwargs['stripe_latency'] / 1000, kwargs['stripe_error_rate']
+        )
+        ccxcon_server = StubServer(
+            ccxcon_response, kwargs['ccxcon_latency'] / 1000, kwargs['ccxcon_error_rate']
+        )
+        stripe_server.start()
+        ccxcon_server.start()
+        users, courses, carts = self.seed(kwargs['concurrency'], kwargs['courses'], kwargs['modules'])
+        stripe_settings = stripe.api_base, stripe.api_key
+        insecure_transport = os.environ.get('OAUTHLIB_INSECURE_TRANSPORT')
+        try:
+            stripe.api_base = stripe_server.url.rstrip('/')
+            stripe.api_key = 'sk_test_load_test'
+            # The CCXCon stub doesn't use TLS
+            os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+            with override_settings(
+                CCXCON_API=ccxcon_server.url,
+                CCXCON_OAUTH_CLIENT_ID='load-test',
+                CCXCON_OAUTH_CLIENT_SECRET='load-test',
+            ):
+                results, elapsed = self.run_load(users, carts, kwargs['requests'])
+        finally:
+            stripe.api_base, stripe.api_key = stripe_settings
+            if insecure_transport is None:
+                os.environ.pop('OAUTHLIB_INSECURE_TRANSPORT', None)
+            else:
+                os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = insecure_transport
+            stripe_server.stop()
+            ccxcon_server.stop()
+            self.clean_up(users, courses)
+
+        self.report(results, elapsed, kwargs['concurrency'])
@@ -0,0 +1,66 @@
+"Test for checkout load test script"
+# pylint: disable=no-self-use
+from django.core.management import CommandError
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+import pytest
+
+from portal.models import Course, Order
+from .load_test_checkout import Command, percentile
+
+
+def run_load_test(**kwargs):
+    """Run the command with small defaults and return its output"""
+    options = {
+        'requests': 4,
+        'concurrency': 2,
+        'courses': 2,
+        'modules': 2,
+        'stripe_latency': 0,
+        'stripe_error_rate': 0,
+        'ccxcon_latency': 0,
+        'ccxcon_error_rate': 0,
+    }
+    options.update(kwargs)
+    out = StringIO()
+    Command(stdout=out).handle(**options)
+    return out.getvalue()
+
+
+class LoadTestCheckoutTestCase(TransactionTestCase):
+    "Test for checkout load test script"
+
+    @override_settings(DEBUG=True)
+    def test_load_test(self):
+        "Should report throughput and clean up after itself"
+        output = run_load_test()
+
+        assert "4 checkouts, 2 at once" in output
+        assert "Responses: 200 x 4" in output
+        assert "Latency: p50" in output
+        assert "Queries per request:" in output
+        assert "Orders per second:" in output
+        assert not Course.objects.exists()
+        assert not Order.objects.exists()
+
+    @override_settings(DEBUG=True)
+    def test_stripe_errors(self):
+        "Failed charges are counted as errors"
+        output = run_load_test(stripe_error_rate=1)
+        assert "Responses: 500 x 4" in output
+        assert "Orders per second: 0.0" in output
+
+    @override_settings(DEBUG=False)
+    def test_error_if_not_debug(self):
+        "should error if not in debug environment"
+        with pytest.raises(CommandError):
+            run_load_test()
+
+
+def test_percentile():
+    "Percentiles use the nearest rank"
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3], 95) == 3
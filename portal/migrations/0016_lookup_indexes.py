@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 14:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0015_live_default_false'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='course',
+            name='uuid',
+            field=models.TextField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='module',
+            name='locator_id',
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='module',
+            name='uuid',
+            field=models.TextField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='userinfo',
+            name='registration_token',
+            field=models.TextField(blank=True, null=True, unique=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='module',
+            index_together=set([('course', 'order')]),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 16:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0018_checkoutrecord'),
+    ]
+
+    operations = [
+        # Orders placed before this were charged and fulfilled during checkout
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.TextField(choices=[('pending', 'Pending'), ('charged', 'Charged'), ('fulfilled', 'Fulfilled'), ('failed', 'Failed')], db_index=True, default='fulfilled'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.TextField(choices=[('pending', 'Pending'), ('charged', 'Charged'), ('fulfilled', 'Fulfilled'), ('failed', 'Failed')], db_index=True, default='pending'),
+        ),
+    ]
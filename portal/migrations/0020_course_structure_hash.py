@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 17:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0019_order_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='structure_hash',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 19:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0020_course_structure_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkoutrecord',
+            name='request_hash',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -4,6 +4,7 @@ Models classes needed for portal
 from __future__ import unicode_literals
 from datetime import timedelta, datetime
 from django.db import models
+from django.db.models import Count, F, Max, Q, Sum
 
 from django.contrib.auth.models import User
 from django.db.models.fields.related import (
@@ -64,12 +65,83 @@ class BackingInstance(models.Model):
         return self.access_token_expiration <= now() + timedelta(hours=2)
 
 
+class CourseQuerySet(models.QuerySet):
+    """
+    QuerySet for courses which can express visibility rules in SQL.
+    """
+
+    def with_module_counts(self):
+        """
+        Annotate each course with its number of modules and number of priced modules.
+
+        Returns:
+            CourseQuerySet: Courses annotated with module_count and priced_module_count
+        """
+        return self.annotate(
+            module_count=Count('modules'),
+            # COUNT of a column skips NULLs so this only counts priced modules
+            priced_module_count=Count('modules__price_without_tax'),
+        )
+
+    def visible_to(self, user):
+        """
+        Filter to courses a user may see. A course is visible if it is live, has at least
+        one module and every module has a price, or if the user owns the course and has
+        permission to see their own courses which are not live.
+
+        Args:
+            user (django.contrib.auth.models.User): Logged in user
+
+        Returns:
+            CourseQuerySet: A lazy queryset of visible courses
+        """
+        visible = Q(
+            live=True,
+            module_count__gt=0,
+            module_count=F('priced_module_count'),
+        )
+        if user.has_perm("portal.{}".format(SEE_OWN_NOT_LIVE[0])):
+            # A subquery instead of a join on owners so module counts aren't multiplied
+            visible |= Q(id__in=user.courses_owned.values('id'))
+        return self.with_module_counts().filter(visible)
+
+    def modification_summary(self):
+        """
+        Summarize how many courses and modules there are and when they last changed,
+        without loading them.
+
+        Returns:
+            dict: course_count, module_count, courses_modified_at and modules_modified_at
+        """
+        return self.annotate(
+            summary_module_count=Count('modules'),
+            summary_modified_at=Max('modified_at'),
+            summary_modules_modified_at=Max('modules__modified_at'),
+        ).aggregate(
+            course_count=Count('summary_modified_at'),
+            module_count=Sum('summary_module_count'),
+            courses_modified_at=Max('summary_modified_at'),
+            modules_modified_at=Max('summary_modules_modified_at'),
+        )
+
+    def for_serialization(self):
+        """
+        Load the relations used by CourseSerializer up front so serializing many courses
+        doesn't issue queries per course.
+
+        Returns:
+            CourseQuerySet: Courses with instance joined and modules prefetched
+        """
+        return self.select_related('instance').prefetch_related('modules')
+
+
 @python_2_unicode_compatible
 class Course(models.Model):
     """
     A CCX course
     """
-    uuid = TextField()
+    # Not unique since courses created by the edX webhook don't have one
+    uuid = TextField(db_index=True)
     edx_course_id = models.TextField(help_text="course locator from edx",
                                      unique=True, null=True)
     title = TextField()
@@ -84,6 +156,10 @@ class Course(models.Model):
     overview = TextField(blank=True, null=True)
     image_url = TextField(blank=True, null=True)
     instructors = JSONField(blank=True, null=True)
+    # Hash of the chapter structure last synced from edX, see portal.tasks.get_structure_hash
+    structure_hash = TextField(blank=True, null=True)
+
+    objects = CourseQuerySet.as_manager()
 
     @property
     def is_available_for_purchase(self):
@@ -112,13 +188,14 @@ class Module(models.Model):
     """
     A chapter in a CCX course
     """
-    uuid = TextField()
+    # Not unique since modules created by module_population don't have one
+    uuid = TextField(db_index=True)
     course = ForeignKey(Course, related_name="modules")
     title = TextField()
     price_without_tax = DecimalField(decimal_places=2, max_digits=20, blank=True, null=True)
     created_at = DateTimeField(auto_now_add=True, blank=True)
     modified_at = DateTimeField(auto_now=True, blank=True)
-    locator_id = models.CharField(max_length=255, null=True)
+    locator_id = models.CharField(max_length=255, null=True, db_index=True)
     order = models.IntegerField(default=0)
 
     @property
@@ -134,6 +211,9 @@ class Module(models.Model):
 
     class Meta:  # pylint: disable=missing-docstring, no-init, old-style-class, too-few-public-methods
         ordering = ('course_id', 'order')
+        index_together = (
+            ('course', 'order'),
+        )
         permissions = (
             EDIT_OWN_PRICE,
         )
@@ -144,7 +224,7 @@ class UserInfo(models.Model):
     Other user information.
     """
     user = OneToOneField(User, primary_key=True)
-    registration_token = TextField(null=True, blank=True)
+    registration_token = TextField(null=True, blank=True, unique=True)
     organization = TextField()
     full_name = TextField()
     edx_instance = ForeignKey(BackingInstance, blank=True, null=True)
@@ -153,10 +233,26 @@ class UserInfo(models.Model):
 class Order(models.Model):
     """
     An order that has been placed after purchasing courses.
+
+    Orders are committed as pending before the card is charged, become
+    charged once the charge succeeds, and end up fulfilled once every CCX
+    is created. They fail if either the charge or a CCX fails.
     """
+    PENDING = 'pending'
+    CHARGED = 'charged'
+    FULFILLED = 'fulfilled'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (CHARGED, 'Charged'),
+        (FULFILLED, 'Fulfilled'),
+        (FAILED, 'Failed'),
+    )
+
     subtotal = DecimalField(decimal_places=2, max_digits=20)
     total_paid = DecimalField(decimal_places=2, max_digits=20)
     purchaser = ForeignKey(User)
+    status = TextField(choices=STATUS_CHOICES, default=PENDING, db_index=True)
     created_at = DateTimeField(auto_now_add=True, blank=True)
     modified_at = DateTimeField(auto_now=True, blank=True)
 
@@ -172,3 +268,51 @@ class OrderLine(models.Model):
     line_total = DecimalField(decimal_places=2, max_digits=20)
     created_at = DateTimeField(auto_now_add=True, blank=True)
     modified_at = DateTimeField(auto_now=True, blank=True)
+
+
+class Fulfillment(models.Model):
+    """
+    A CCX which needs to be created on CCXCon for a course in an order.
+
+    Rows are written in the same transaction as their order and drained by
+    portal.tasks.fulfill_ccx.
+    """
+    PENDING = 'pending'
+    FULFILLED = 'fulfilled'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (FULFILLED, 'Fulfilled'),
+        (FAILED, 'Failed'),
+    )
+
+    order = ForeignKey(Order)
+    course = ForeignKey(Course)
+    seats = IntegerField()
+    status = TextField(choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    attempts = IntegerField(default=0)
+    last_error = TextField(blank=True, null=True)
+    created_at = DateTimeField(auto_now_add=True, blank=True)
+    modified_at = DateTimeField(auto_now=True, blank=True)
+
+
+class CheckoutRecord(models.Model):
+    """
+    The outcome of a checkout submitted with an idempotency key, so a repeat
+    submission gets the same response instead of placing a second order.
+    A record without a response is a checkout still in progress, or one
+    abandoned by a crash if it's older than CHECKOUT_IDEMPOTENCY_TIMEOUT.
+    """
+    user = ForeignKey(User)
+    key = TextField()
+    order = ForeignKey(Order, blank=True, null=True)
+    response_status = IntegerField(blank=True, null=True)
+    response_data = JSONField(blank=True, null=True)
+    # Hash of the request body, so a different checkout reusing the key is rejected
+    request_hash = TextField(blank=True, null=True)
+    created_at = DateTimeField(auto_now_add=True, blank=True)
+
+    class Meta:  # pylint: disable=missing-docstring, no-init, old-style-class, too-few-public-methods
+        unique_together = (
+            ('user', 'key'),
+        )
@@ -5,16 +5,19 @@ Tests for models
 from __future__ import unicode_literals
 
 from datetime import timedelta
+from unittest import skipUnless
+from django.db import connection
 from django.test import TestCase
 from django.utils.timezone import now
 import pytest
-from .models import BackingInstance
+from .models import BackingInstance, Course, Module, UserInfo
 
 from portal.factories import (
     CourseFactory,
     ModuleFactory,
     BackingInstanceFactory,
 )
+from portal.views.util import assert_index_scan
 
 
 class ModelsTests(TestCase):
@@ -59,3 +62,31 @@ def test_expiration(incoming, expected):
     """Validate expiration tests correct conditions"""
     assert BackingInstance(
         access_token_expiration=incoming).is_expired == expected
+
+
+@skipUnless(connection.vendor == 'postgresql', "EXPLAIN output is Postgres specific")
+class IndexTests(TestCase):
+    """
+    Hot lookups should use an index
+    """
+
+    def test_course_uuid(self):  # pylint: disable=no-self-use
+        """Course lookups by uuid"""
+        assert_index_scan(Course.objects.filter(uuid='uuid'))
+
+    def test_module_uuid(self):  # pylint: disable=no-self-use
+        """Module lookups by uuid"""
+        assert_index_scan(Module.objects.filter(uuid__in=['uuid1', 'uuid2']))
+
+    def test_module_locator_id(self):  # pylint: disable=no-self-use
+        """Module lookups by locator_id"""
+        assert_index_scan(Module.objects.filter(locator_id='locator'))
+
+    def test_module_course_order(self):  # pylint: disable=no-self-use
+        """A course's modules in order"""
+        course = CourseFactory.create()
+        assert_index_scan(course.modules.order_by('order'))
+
+    def test_registration_token(self):  # pylint: disable=no-self-use
+        """UserInfo lookups by registration token"""
+        assert_index_scan(UserInfo.objects.filter(registration_token='token'))
@@ -2,10 +2,20 @@
 Utility functions.
 """
 from datetime import timedelta
+import hashlib
+import time
+from uuid import uuid4
 from six.moves.urllib.parse import urljoin  # pylint: disable=import-error
 
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import force_bytes
 from django.utils.timezone import now
-import requests
+
+from portal.http_pool import SESSIONS, deadline, time_left
+
+# Same as BackingInstance.is_expired: tokens this close to expiring are refreshed
+EXPIRY_MARGIN = timedelta(hours=2)
 
 
 class UnretrievableToken(Exception):
@@ -14,9 +24,82 @@ class UnretrievableToken(Exception):
     """
 
 
+def _token_keys(instance):
+    """
+    Returns:
+        (str, str): Cache keys for an instance's token and for the lock around refreshing it
+    """
+    digest = hashlib.md5(force_bytes(instance.instance_url)).hexdigest()
+    return 'edx-token:{}'.format(digest), 'edx-token-refresh:{}'.format(digest)
+
+
+def _expires_within(instance, margin):
+    """
+    Returns:
+        bool: True if the instance has no token or it expires within margin
+    """
+    return (
+        not instance.access_token or
+        not instance.access_token_expiration or
+        instance.access_token_expiration <= now() + margin
+    )
+
+
+def _cache_token(instance):
+    """
+    Share an instance's token with other processes until it's due to be refreshed.
+    """
+    if _expires_within(instance, EXPIRY_MARGIN):
+        return
+    token_key, _ = _token_keys(instance)
+    timeout = (instance.access_token_expiration - now() - EXPIRY_MARGIN).total_seconds()
+    cache.set(token_key, {
+        'access_token': instance.access_token,
+        'expiration': instance.access_token_expiration,
+    }, int(timeout))
+
+
+def _acquire_refresh_lock(lock_key):
+    """
+    Wait for the lock around refreshing a token, for at most
+    EDX_TOKEN_LOCK_TIMEOUT seconds or the time left before the current deadline.
+
+    Args:
+        lock_key (str): The lock's cache key
+
+    Returns:
+        str: A token identifying this holder of the lock, for _release_refresh_lock
+    """
+    owner = uuid4().hex
+    wait = settings.EDX_TOKEN_LOCK_TIMEOUT
+    remaining = time_left()
+    if remaining is not None:
+        wait = min(wait, remaining)
+    give_up_at = time.time() + wait
+    # The lock outlives the refresh, which runs under an EDX_DEADLINE of its own
+    while not cache.add(lock_key, owner, settings.EDX_DEADLINE):
+        if time.time() >= give_up_at:
+            raise UnretrievableToken("Timed out waiting for another token refresh")
+        time.sleep(min(0.1, max(give_up_at - time.time(), 0)))
+    return owner
+
+
+def _release_refresh_lock(lock_key, owner):
+    """
+    Release the lock around refreshing a token, unless it expired and another process holds it now.
+
+    Args:
+        lock_key (str): The lock's cache key
+        owner (str): The token from _acquire_refresh_lock
+    """
+    if cache.get(lock_key) == owner:
+        cache.delete(lock_key)
+
+
 def get_access_token(instance):
     """
-    Fetch a usable access token.
+    Fetch a usable access token. Tokens are read from the cache when possible,
+    since another process may have refreshed the token since instance was loaded.
 
     Args:
         instance (oauth_mgmt.models.BackingInstance): OAuth2 app to get tokens for
@@ -24,42 +107,77 @@ def get_access_token(instance):
     Returns:
         access_token (str): The bearer token to use as the value in the Authorization header.
     """
+    token_key, _ = _token_keys(instance)
+    cached = cache.get(token_key)
+    if cached is not None and cached['expiration'] > now() + EXPIRY_MARGIN:
+        return cached['access_token']
+
     if not instance.is_expired:
         # Return currently valid token.
+        _cache_token(instance)
         return instance.access_token
-    elif not instance.access_token:
-        # Get an access token.
-        params = {
-            "grant_type": "authorization_code",
-            "response_type": "code",
-            "client_id": instance.oauth_client_id,
-            "client_secret": instance.oauth_client_secret,
-            "code": instance.grant_token,
-        }
-
-    else:
-        # refresh the token
-        params = {
-            "grant_type": "refresh_token",
-            "client_id": instance.oauth_client_id,
-            "client_secret": instance.oauth_client_secret,
-            "refresh_token": instance.refresh_token,
-        }
-
-    resp = requests.post(
-        urljoin(instance.instance_url, '/oauth2/access_token/'),
-        data=params)
-    if resp.status_code >= 300:
-        raise UnretrievableToken(
-            "Could not request token: Status: {status}, Message: {msg}".format(
-                status=resp.status_code,
-                msg=resp.content,
-            ))
-
-    j_resp = resp.json()
-    instance.access_token = j_resp['access_token']
-    instance.refresh_token = j_resp['refresh_token']
-    instance.access_token_expiration = now() + timedelta(seconds=j_resp['expires_in'])
-    instance.save()
+    return refresh_access_token(instance)
+
+
+def refresh_access_token(instance, margin=EXPIRY_MARGIN):
+    """
+    Get a new access token for an instance if its token expires within margin.
+    Only one process refreshes an instance's token at a time, since refresh
+    tokens can only be used once.
+
+    Args:
+        instance (oauth_mgmt.models.BackingInstance): OAuth2 app to get tokens for
+        margin (datetime.timedelta): How soon the token must expire to be refreshed
+
+    Returns:
+        access_token (str): The bearer token to use as the value in the Authorization header.
+    """
+    _, lock_key = _token_keys(instance)
+    owner = _acquire_refresh_lock(lock_key)
+    try:
+        # Another process may have refreshed the token while we waited, using up the refresh token
+        instance.refresh_from_db(fields=['access_token', 'refresh_token', 'access_token_expiration'])
+        if not _expires_within(instance, margin):
+            _cache_token(instance)
+            return instance.access_token
+
+        if not instance.access_token:
+            # Get an access token.
+            params = {
+                "grant_type": "authorization_code",
+                "response_type": "code",
+                "client_id": instance.oauth_client_id,
+                "client_secret": instance.oauth_client_secret,
+                "code": instance.grant_token,
+            }
+
+        else:
+            # refresh the token
+            params = {
+                "grant_type": "refresh_token",
+                "client_id": instance.oauth_client_id,
+                "client_secret": instance.oauth_client_secret,
+                "refresh_token": instance.refresh_token,
+            }
+
+        with deadline(settings.EDX_DEADLINE):
+            resp = SESSIONS.session(instance.instance_url).post(
+                urljoin(instance.instance_url, '/oauth2/access_token/'),
+                data=params)
+        if resp.status_code >= 300:
+            raise UnretrievableToken(
+                "Could not request token: Status: {status}, Message: {msg}".format(
+                    status=resp.status_code,
+                    msg=resp.content,
+                ))
+
+        j_resp = resp.json()
+        instance.access_token = j_resp['access_token']
+        instance.refresh_token = j_resp['refresh_token']
+        instance.access_token_expiration = now() + timedelta(seconds=j_resp['expires_in'])
+        instance.save(update_fields=['access_token', 'refresh_token', 'access_token_expiration'])
+        _cache_token(instance)
+    finally:
+        _release_refresh_lock(lock_key, owner)
 
     return instance.access_token
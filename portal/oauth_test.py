@@ -0,0 +1,145 @@
+"""
+Tests for fetching edX access tokens
+"""
+from datetime import timedelta
+import time
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils.timezone import now
+import mock
+import pytest
+
+from .factories import BackingInstanceFactory
+from .http_pool import deadline
+from .models import BackingInstance
+from .oauth import UnretrievableToken, _token_keys, get_access_token, refresh_access_token
+
+
+@mock.patch('portal.oauth.SESSIONS', autospec=True)
+class GetAccessTokenTests(TestCase):
+    """
+    Tests for get_access_token
+    """
+    def setUp(self):
+        self.instance = BackingInstanceFactory.create(
+            oauth_client_id='client',
+            oauth_client_secret='secret',
+            access_token='old-access',
+            refresh_token='old-refresh',
+            access_token_expiration=now() - timedelta(minutes=1),
+        )
+
+    def mock_token_response(self, m_sessions, status_code=200):
+        """Make the mocked edX respond to token requests"""
+        resp = m_sessions.session.return_value.post.return_value
+        resp.status_code = status_code
+        resp.json.return_value = {
+            'access_token': 'new-access',
+            'refresh_token': 'new-refresh',
+            'expires_in': 10 * 60 * 60,
+        }
+        return m_sessions.session.return_value.post
+
+    def test_valid_token(self, m_sessions):
+        """
+        A token which isn't about to expire is used without a request, and cached.
+        """
+        BackingInstance.objects.filter(id=self.instance.id).update(
+            access_token_expiration=now() + timedelta(hours=5)
+        )
+        self.instance.refresh_from_db()
+        assert get_access_token(self.instance) == 'old-access'
+        assert cache.get(_token_keys(self.instance)[0])['access_token'] == 'old-access'
+        assert not m_sessions.session.called
+
+    def test_refresh(self, m_sessions):
+        """
+        Expired tokens are refreshed, saved and cached.
+        """
+        post = self.mock_token_response(m_sessions)
+        assert get_access_token(self.instance) == 'new-access'
+        assert post.call_args[1]['data']['grant_type'] == 'refresh_token'
+        assert post.call_args[1]['data']['refresh_token'] == 'old-refresh'
+
+        self.instance.refresh_from_db()
+        assert self.instance.refresh_token == 'new-refresh'
+        assert not self.instance.is_expired
+
+        # Another process with an old copy of the instance reads the new token from the cache
+        stale = BackingInstance(id=self.instance.id, instance_url=self.instance.instance_url)
+        assert get_access_token(stale) == 'new-access'
+        assert post.call_count == 1
+        assert cache.get(_token_keys(self.instance)[1]) is None
+
+    def test_refreshed_elsewhere(self, m_sessions):
+        """
+        A token refreshed by another process since the instance was loaded isn't refreshed again.
+        """
+        BackingInstance.objects.filter(id=self.instance.id).update(
+            access_token='other-access',
+            refresh_token='other-refresh',
+            access_token_expiration=now() + timedelta(hours=5),
+        )
+        assert get_access_token(self.instance) == 'other-access'
+        assert not m_sessions.session.called
+
+    def test_first_token(self, m_sessions):
+        """
+        Instances without a token use their grant token.
+        """
+        post = self.mock_token_response(m_sessions)
+        BackingInstance.objects.filter(id=self.instance.id).update(access_token=None, grant_token='grant')
+        self.instance.refresh_from_db()
+        assert get_access_token(self.instance) == 'new-access'
+        assert post.call_args[1]['data']['grant_type'] == 'authorization_code'
+        assert post.call_args[1]['data']['code'] == 'grant'
+
+    def test_error(self, m_sessions):
+        """
+        Error responses raise UnretrievableToken and release the lock.
+        """
+        self.mock_token_response(m_sessions, status_code=400)
+        with pytest.raises(UnretrievableToken):
+            get_access_token(self.instance)
+        assert cache.get(_token_keys(self.instance)[1]) is None
+
+    def test_lock_timeout(self, m_sessions):
+        """
+        Waiting too long for another process's refresh raises UnretrievableToken.
+        """
+        cache.add(_token_keys(self.instance)[1], True)
+        with self.settings(EDX_TOKEN_LOCK_TIMEOUT=0):
+            with pytest.raises(UnretrievableToken):
+                refresh_access_token(self.instance)
+        assert not m_sessions.session.called
+
+    def test_lock_wait_limited_by_deadline(self, m_sessions):
+        """
+        Waiting for another process's refresh stops at the current deadline.
+        """
+        cache.add(_token_keys(self.instance)[1], 'other')
+        start = time.time()
+        with self.settings(EDX_TOKEN_LOCK_TIMEOUT=30):
+            with deadline(0.2):
+                with pytest.raises(UnretrievableToken):
+                    refresh_access_token(self.instance)
+        assert time.time() - start < 5
+        assert not m_sessions.session.called
+
+    def test_lock_taken_over(self, m_sessions):
+        """
+        A refresh which outlived its lock doesn't release the lock another process took since.
+        """
+        lock_key = _token_keys(self.instance)[1]
+        post = self.mock_token_response(m_sessions)
+        response = post.return_value
+
+        def _expire_lock(*args, **kwargs):  # pylint: disable=unused-argument
+            """Another process takes the lock after it expires"""
+            cache.set(lock_key, 'other')
+            return response
+        post.side_effect = _expire_lock
+
+        assert refresh_access_token(self.instance) == 'new-access'
+        assert cache.get(lock_key) == 'other'
@@ -0,0 +1,36 @@
+"""
+Pagination classes for REST API
+"""
+
+from __future__ import unicode_literals
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+
+
+class CourseCursorPagination(CursorPagination):
+    """
+    Cursor pagination for courses. This is opt-in: results are only paginated
+    if the client passes page_size.
+    """
+    # Matches Course.Meta.ordering, with id to break ties
+    ordering = ('created_at', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Paginate if page_size was passed, else return None so the full list is used.
+        """
+        if self.page_size_query_param not in request.query_params:
+            return None
+
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except ValueError:
+            raise ValidationError("page_size must be a positive integer")
+        if page_size <= 0:
+            raise ValidationError("page_size must be a positive integer")
+
+        self.page_size = min(page_size, self.max_page_size)
+        return super(CourseCursorPagination, self).paginate_queryset(queryset, request, view=view)
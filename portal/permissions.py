@@ -64,54 +64,41 @@ class AuthorizationHelpers(object):
     Functions used to ensure permissions are applied.
     """
 
-    @classmethod
-    def _is_visible(cls, course, user):
-        """
-        Helper method to contain course visibility logic.
-        """
-        return course.is_available_for_purchase or (
-            cls.is_owner(course, user) and cls.can_see_own_not_live(course, user)
-        )
-
-    @classmethod
-    def get_courses(cls, user):
+    @staticmethod
+    def get_courses(user):
         """
-        Returns a list of courses accessible by user.
+        Returns courses accessible by user.
 
         Args:
             user (django.contrib.auth.models.User): Logged in user
 
         Returns:
-            list: A list of courses
+            CourseQuerySet: A lazy queryset of courses
         """
         from portal.models import Course
-        return [
-            course for course in Course.objects.all()
-            if cls._is_visible(course, user)
-        ]
+        return Course.objects.visible_to(user)
 
-    @classmethod
-    def get_course(cls, course_uuid, user):
+    @staticmethod
+    def get_course(course_uuid, user, queryset=None):
         """
         Returns a course, or None if no course exists or is not available for purchase.
 
         Args:
             course_uuid (str): A course UUID
             user (django.contrib.auth.models.User): Logged in user
+            queryset (CourseQuerySet): Optional queryset to look up the course in,
+                for example to prefetch related objects
         Returns:
             Course: A course, or None if course is not accessible to the user
         """
         from portal.models import Course
+        if queryset is None:
+            queryset = Course.objects.all()
         try:
-            course = Course.objects.get(uuid=course_uuid)
+            return queryset.visible_to(user).get(uuid=course_uuid)
         except Course.DoesNotExist:
-            log.debug("Couldn't find a course with uuid %s in the portal", course_uuid)
-            return None
-
-        if not cls._is_visible(course, user):
-            log.debug("Course %s isn't available for sale.", course)
+            log.debug("Couldn't find a course with uuid %s visible to %s", course_uuid, user)
             return None
-        return course
 
     @staticmethod
     def is_owner(course, user):
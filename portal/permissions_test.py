@@ -49,7 +49,7 @@ class PermissionsTests(TestCase):
         ]) == sorted(codenames)
 
     def test_get_courses(self):
-        """Assert get_courses returns a list of courses available for purchase"""
+        """Assert get_courses returns courses available for purchase"""
         # Note that course1 is not live
         course1 = CourseFactory.create(live=False)
         ModuleFactory.create(
@@ -61,7 +61,7 @@ class PermissionsTests(TestCase):
             price_without_tax=1,
             course=course2
         )
-        assert AuthorizationHelpers.get_courses(AnonymousUser()) == [course2]
+        assert list(AuthorizationHelpers.get_courses(AnonymousUser())) == [course2]
 
     def test_get_courses_not_live(self):
         """
@@ -84,8 +84,44 @@ class PermissionsTests(TestCase):
         user.groups.add(Group.objects.get(name="Instructor"))
         user.courses_owned.add(course1)
 
-        assert AuthorizationHelpers.get_courses(AnonymousUser()) == [course2]
-        assert AuthorizationHelpers.get_courses(user) == [course1, course2]
+        assert list(AuthorizationHelpers.get_courses(AnonymousUser())) == [course2]
+        assert list(AuthorizationHelpers.get_courses(user)) == [course1, course2]
+
+    def test_get_courses_single_query(self):
+        """
+        Assert that get_courses evaluates in one query regardless of how many courses
+        and modules there are.
+        """
+        for _ in range(5):
+            course = CourseFactory.create(live=True)
+            for _ in range(3):
+                ModuleFactory.create(course=course)
+        owned = CourseFactory.create(live=False)
+        ModuleFactory.create(course=owned)
+
+        user = User.objects.create_user(username="user")
+        user.groups.add(Group.objects.get(name="Instructor"))
+        user.courses_owned.add(owned)
+        user = User.objects.get(username="user")
+        # Load permissions up front so only the course query is counted
+        user.get_all_permissions()
+
+        with self.assertNumQueries(1):
+            assert len(list(AuthorizationHelpers.get_courses(user))) == 6
+
+    def test_get_courses_unpriced_module(self):
+        """
+        A live course with any module missing a price is not visible, even to an owner
+        without permission to see courses which aren't live.
+        """
+        course = CourseFactory.create(live=True)
+        ModuleFactory.create(course=course, price_without_tax=1)
+        ModuleFactory.create(course=course, price_without_tax=None)
+        user = User.objects.create_user(username="user")
+        user.courses_owned.add(course)
+
+        assert list(AuthorizationHelpers.get_courses(AnonymousUser())) == []
+        assert list(AuthorizationHelpers.get_courses(user)) == []
 
     def test_get_course_success(self):
         """Assert get_course returns a Course"""
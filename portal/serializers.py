@@ -3,6 +3,7 @@ Serializers for REST API
 """
 
 from __future__ import unicode_literals
+from collections import OrderedDict, defaultdict
 
 from rest_framework.serializers import (
     FloatField,
@@ -48,6 +49,17 @@ class CourseSerializer(ModelSerializer):
             'edx_instance',
         )
 
+    def __init__(self, *args, **kwargs):
+        """
+        Args:
+            fields (iterable): Optional names of the only fields to include
+        """
+        fields = kwargs.pop('fields', None)
+        super(CourseSerializer, self).__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     def get_instructors(self, obj):  # pylint: disable=no-self-use
         """Output the instructor JSON without escaping it"""
         return obj.instructors
@@ -86,3 +98,71 @@ class EdxCourseSerializer(ModelSerializer):
             'image_url',
             'instance',
         )
+
+
+# Read-only fast path. These build the same output as CourseSerializer from
+# .values() rows, skipping model instances and per-field serializer dispatch.
+# Keep them in sync with the serializers above.
+COURSE_VALUES_COLUMNS = {
+    'edx_instance': 'instance__instance_url',
+}
+
+
+def serialize_modules_by_course(courses):
+    """
+    Serialize the modules for some courses like ModuleSerializer.
+
+    Args:
+        courses (CourseQuerySet): The courses
+    Returns:
+        dict: Lists of serialized modules keyed by course id
+    """
+    modules = defaultdict(list)
+    rows = Module.objects.filter(course__in=courses.values('id')).values_list(
+        'course_id', 'uuid', 'title', 'price_without_tax'
+    )
+    for course_id, uuid, title, price_without_tax in rows:
+        modules[course_id].append(OrderedDict((
+            ('uuid', uuid),
+            ('title', title),
+            ('price_without_tax', None if price_without_tax is None else float(price_without_tax)),
+        )))
+    return modules
+
+
+def serialize_courses(courses, fields=None):
+    """
+    Serialize courses like CourseSerializer(courses, many=True, fields=fields).data
+
+    Args:
+        courses (CourseQuerySet): The courses to serialize
+        fields (iterable): Optional names of the only fields to include
+    Returns:
+        list: Serialized courses
+    """
+    fields = [
+        name for name in CourseSerializer.Meta.fields
+        if fields is None or name in fields
+    ]
+    # Relations loaded for model serialization aren't used here
+    courses = courses.prefetch_related(None)
+    columns = [
+        COURSE_VALUES_COLUMNS.get(name, name) for name in fields if name != 'modules'
+    ]
+    rows = courses.values('id', *columns)
+    modules = serialize_modules_by_course(courses) if 'modules' in fields else None
+    instructors_field = Course._meta.get_field('instructors')  # pylint: disable=protected-access
+
+    serialized = []
+    for row in rows:
+        course = OrderedDict()
+        for name in fields:
+            if name == 'modules':
+                course[name] = modules.get(row['id'], [])
+            elif name == 'instructors':
+                # Same conversion the model applies when loading the attribute
+                course[name] = instructors_field.to_python(row[name])
+            else:
+                course[name] = row[COURSE_VALUES_COLUMNS.get(name, name)]
+        serialized.append(course)
+    return serialized
@@ -2,12 +2,15 @@
 from __future__ import unicode_literals
 
 from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
 
 from portal.factories import CourseFactory, ModuleFactory
+from portal.models import Course
 from portal.serializers import (
     CourseSerializer,
     CourseSerializerReduced,
     ModuleSerializer,
+    serialize_courses,
 )
 
 
@@ -48,6 +51,15 @@ class SerializersTest(TestCase):
             ]
         }
 
+    def test_course_serializer_fields(self):  # pylint: disable=no-self-use
+        """Assert CourseSerializer can be limited to some fields"""
+        course = CourseFactory.create()
+        rep = CourseSerializer(course, fields=['uuid', 'live']).data
+        assert dict(rep) == {
+            "uuid": course.uuid,
+            "live": course.live,
+        }
+
     def test_module_serializer(self):  # pylint: disable=no-self-use
         """Assert behavior of ModuleSerializer"""
         module = ModuleFactory.create()
@@ -56,3 +68,38 @@ class SerializersTest(TestCase):
             "title": module.title,
             "price_without_tax": float(module.price_without_tax)
         }
+
+
+class FastSerializationTest(TestCase):
+    """
+    The fast path must render exactly what the serializers render
+    """
+
+    def setUp(self):
+        course = CourseFactory.create(title="Cours\u00e9", instructors=None, description=None)
+        ModuleFactory.create(course=course, price_without_tax=None)
+        ModuleFactory.create(course=course, price_without_tax=0, order=2)
+        ModuleFactory.create(course=course, price_without_tax="12.34", order=1)
+        CourseFactory.create(live=True)
+        course = CourseFactory.create(instructors={"name": "someone"})
+        ModuleFactory.create_batch(3, course=course)
+
+    def test_course_serializer(self):
+        """Assert serialize_courses renders the same bytes as CourseSerializer"""
+        renderer = JSONRenderer()
+        expected = renderer.render(CourseSerializer(Course.objects.all(), many=True).data)
+        assert renderer.render(serialize_courses(Course.objects.all())) == expected
+
+    def test_course_serializer_fields(self):
+        """Assert serialize_courses renders the same bytes as CourseSerializer for a sparse fieldset"""
+        renderer = JSONRenderer()
+        for fields in (['uuid'], ['modules', 'title'], ['edx_instance', 'instructors', 'live']):
+            expected = renderer.render(
+                CourseSerializer(Course.objects.all(), many=True, fields=fields).data
+            )
+            assert renderer.render(serialize_courses(Course.objects.all(), fields)) == expected
+
+    def test_queries(self):
+        """The fast path uses one query for courses and one for modules"""
+        with self.assertNumQueries(2):
+            serialize_courses(Course.objects.all())
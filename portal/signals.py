@@ -0,0 +1,19 @@
+"""Signals for courses and modules"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from portal.catalog_cache import invalidate_catalog
+from portal.models import Course, Module
+
+
+# pylint: disable=unused-argument
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def catalog_changed(*args, **kwargs):
+    """
+    Any change to a course or module can change the public catalog, including
+    whether a course is visible at all.
+    """
+    invalidate_catalog()
@@ -1,21 +1,40 @@
 """
 Course Tasks
 """
+from datetime import timedelta
+import hashlib
+import json
+import logging
+from multiprocessing.pool import ThreadPool
+import time
 from six.moves.urllib.parse import urljoin  # pylint: disable=import-error
 
-import requests
-from requests.exceptions import RequestException
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, IntegerField, TextField, Value, When
+from django.utils.encoding import force_bytes
+from django.utils.timezone import now
+from requests.exceptions import HTTPError, RequestException
 
 from teachersportal.celery import async
-from portal.models import Course, Module
-from portal.oauth import get_access_token
+from portal.catalog_cache import invalidate_catalog
+from portal.ccxcon_api import CCXConAPI
+from portal.circuit_breaker import OPEN
+from portal.edx_blocks import CHUNK_SIZE, parse_course_blocks
+from portal.http_pool import SESSIONS, deadline
+from portal.models import BackingInstance, Course, Fulfillment, Module, Order, OrderLine
+from portal.oauth import UnretrievableToken, get_access_token, refresh_access_token
+from portal.util import set_order_status
 
+log = logging.getLogger(__name__)
 
-def get_subchapters(module_id, blocks):
-    """
-    Fetches nested subchapters for a module.
-    """
-    return [blocks[x]['display_name'] for x in blocks[module_id]['children']]
+# Results of module_population
+STRUCTURE_UNCHANGED = 'unchanged'
+STRUCTURE_UPDATED = 'updated'
+
+# Seconds between checks of whether another module_population run has finished
+POPULATION_LOCK_POLL = 0.5
 
 
 def get_backoff(retries=0):
@@ -31,21 +50,144 @@ def get_backoff(retries=0):
     return (retries + 1) ** 2 * 60 + 60
 
 
-# pylint: disable=too-many-locals
+def get_structure_hash(chapters):
+    """
+    Hashes the parts of a course's chapters which modules are made from.
+
+    Args:
+        chapters (list): Chapter blocks in course order
+
+    Returns:
+        str: A hex digest which changes when chapters are added, removed,
+            renamed, reordered, hidden or shown
+    """
+    structure = [
+        [chapter['id'], chapter['display_name'], bool(chapter.get('visible_to_staff_only'))]
+        for chapter in chapters
+    ]
+    return hashlib.sha256(json.dumps(structure).encode('utf-8')).hexdigest()
+
+
+def get_population_keys(course_id):
+    """
+    Args:
+        course_id (str): An edX course id
+
+    Returns:
+        (str, str): Cache keys marking a module_population run as queued and as running
+    """
+    digest = hashlib.md5(force_bytes(course_id)).hexdigest()
+    return 'module-population-queued:{}'.format(digest), 'module-population-running:{}'.format(digest)
+
+
+def queue_module_population(course_id):
+    """
+    Queues module_population for a course unless a run is already queued, in which
+    case that run will pick up the change. Bursts of updates for one course
+    cause at most one queued and one running sync.
+
+    Args:
+        course_id (str): An edX course id
+
+    Returns:
+        bool: True if a run was queued
+    """
+    queued_key, _ = get_population_keys(course_id)
+    if not cache.add(queued_key, True, settings.MODULE_POPULATION_LOCK_TIMEOUT):
+        log.debug("module_population for %s is already queued", course_id)
+        return False
+    module_population.apply_async((course_id,), countdown=settings.MODULE_POPULATION_DELAY)
+    return True
+
+
+def acquire_population_lock(running_key, wait=0):
+    """
+    Take the lock which lets one module_population run per course at a time.
+
+    Args:
+        running_key (str): The running key from get_population_keys
+        wait (float): Seconds to wait for another run to finish
+
+    Returns:
+        bool: True if the lock was taken
+    """
+    give_up_at = time.time() + wait
+    while not cache.add(running_key, True, settings.MODULE_POPULATION_LOCK_TIMEOUT):
+        if time.time() >= give_up_at:
+            return False
+        time.sleep(POPULATION_LOCK_POLL)
+    return True
+
+
+def mark_population_queued(queued_key, countdown):
+    """
+    Mark a run as queued until countdown seconds from now plus the lock
+    timeout, so updates in the meantime are coalesced into it.
+    """
+    cache.set(queued_key, True, countdown + settings.MODULE_POPULATION_LOCK_TIMEOUT)
+
+
 @async.task(bind=True, max_retries=5)
 def module_population(self, course_id):
     """
-    Gets and persists a list of modules for a given course.
+    Gets and persists a list of modules for a given course. Only one run per
+    course happens at a time.
+
+    Returns:
+        str: STRUCTURE_UNCHANGED if the chapters were the same as last time, else STRUCTURE_UPDATED
     """
+    queued_key, running_key = get_population_keys(course_id)
+    # Eager runs can't be queued for later, so they wait briefly for the running sync instead
+    wait = settings.MODULE_POPULATION_EAGER_WAIT if self.request.is_eager else 0
+    if not acquire_population_lock(running_key, wait):
+        if self.request.is_eager:
+            log.warning("Gave up waiting for module_population of %s to finish", course_id)
+            return None
+        log.debug("module_population for %s is already running", course_id)
+        # Stay queued and try again once the running sync is likely done
+        mark_population_queued(queued_key, settings.MODULE_POPULATION_DELAY)
+        module_population.apply_async((course_id,), countdown=settings.MODULE_POPULATION_DELAY)
+        return None
+
+    # Updates from now on may not be in the response, so they need to queue another run
+    cache.delete(queued_key)
     try:
-        course = Course.objects.get(edx_course_id=course_id)
-    except Course.DoesNotExist:
-        return  # delete case.
+        return populate_modules(course_id)
+    except RequestException as exc:
+        if self.request.retries >= self.max_retries:
+            # Without a retry to coalesce into, the next update has to queue a run
+            cache.delete(queued_key)
+            log.error("Giving up on module_population for %s", course_id)
+            raise
+        countdown = get_backoff(self.request.retries)
+        # The retry is the queued run, so updates until it starts don't queue another
+        mark_population_queued(queued_key, countdown)
+        retry_kwargs = {} if isinstance(exc, HTTPError) else {'exc': exc}
+    finally:
+        cache.delete(running_key)
+    # Retry once the lock is released, since eager retries run straight away
+    self.retry(countdown=countdown, **retry_kwargs)
 
-    access_token = get_access_token(course.instance)
 
+# pylint: disable=too-many-locals
+def populate_modules(course_id):
+    """
+    Fetches a course's chapters from edX and syncs its modules to them.
+
+    Args:
+        course_id (str): An edX course id
+
+    Returns:
+        str: STRUCTURE_UNCHANGED if the chapters were the same as last time, else STRUCTURE_UPDATED
+    """
     try:
-        resp = requests.get(
+        course = Course.objects.get(edx_course_id=course_id)
+    except Course.DoesNotExist:
+        return None  # delete case.
+
+    with deadline(settings.EDX_DEADLINE):
+        access_token = get_access_token(course.instance)
+        resp = SESSIONS.session(course.instance.instance_url).get(
             urljoin(course.instance.instance_url, '/api/courses/v1/blocks/'),
             params={
                 "depth": "all",
@@ -54,36 +196,305 @@ def module_population(self, course_id):
                 "requested_fields": "children,display_name,id,type,visible_to_staff_only",
             }, headers={
                 'Authorization': 'Bearer {}'.format(access_token)
-            })
-    except RequestException as exc:
-        self.retry(exc=exc, countdown=get_backoff(self.request.retries))
-
-    if resp.status_code >= 300:
-        self.retry(countdown=get_backoff(self.request.retries))
+            }, stream=True)
+        try:
+            if resp.status_code >= 300:
+                raise HTTPError("edX responded with {}".format(resp.status_code), response=resp)
+            # Only the chapters are needed, so don't load the whole tree into memory
+            j_resp = parse_course_blocks(resp.iter_content(CHUNK_SIZE))
+        finally:
+            resp.close()
 
-    j_resp = resp.json()
     blocks = j_resp['blocks']
     locations = blocks[j_resp['root']]['children']
     chapters = [blocks[location] for location in locations]
+    structure_hash = get_structure_hash(chapters)
+    if structure_hash == course.structure_hash:
+        log.info("Structure of course %s is unchanged", course_id)
+        return STRUCTURE_UNCHANGED
+
     visible_course_ids = {
         chapter['id'] for chapter in chapters
         if not chapter.get('visible_to_staff_only')
     }
+    sync_modules(course, chapters, visible_course_ids, structure_hash)
+    return STRUCTURE_UPDATED
+
 
-    # Delete happens first so we don't have duplicate `order` entries.
-    for module in course.modules.exclude(locator_id__in=visible_course_ids):
-        module.delete()
+def sync_modules(course, chapters, visible_course_ids, structure_hash):
+    """
+    Makes a course's modules match its chapters on edX. Existing modules are
+    loaded once and the difference is applied with at most one delete, one
+    insert and one update, in a single transaction along with the new
+    structure hash.
+
+    Args:
+        course (Course): The course
+        chapters (list): Chapter blocks in course order
+        visible_course_ids (set): Locators of the chapters which aren't hidden
+        structure_hash (str): The chapters' hash from get_structure_hash
+    """
+    existing = {}
+    stale_ids = []
+    for module in course.modules.order_by('id'):
+        if module.locator_id in visible_course_ids and module.locator_id not in existing:
+            existing[module.locator_id] = module
+        else:
+            stale_ids.append(module.id)
 
+    new_modules = []
+    changed = {}
     for num, payload in enumerate(chapters):
         locator_id = payload['id']
         if locator_id not in visible_course_ids:
             continue
 
+        module = existing.get(locator_id)
+        if module is None:
+            new_modules.append(Module(
+                course=course, locator_id=locator_id, title=payload['display_name'], order=num
+            ))
+        elif module.title != payload['display_name'] or module.order != num:
+            changed[module.id] = (payload['display_name'], num)
+
+    modules_changed = bool(stale_ids or new_modules or changed)
+    with transaction.atomic():
+        # update() so saving the hash doesn't bump the course's modified_at
+        Course.objects.filter(id=course.id).update(structure_hash=structure_hash)
+        if stale_ids:
+            Module.objects.filter(id__in=stale_ids).delete()
+        if new_modules:
+            Module.objects.bulk_create(new_modules)
+        if changed:
+            Module.objects.filter(id__in=changed.keys()).update(
+                title=Case(
+                    *[When(id=module_id, then=Value(title)) for module_id, (title, _) in changed.items()],
+                    output_field=TextField()
+                ),
+                order=Case(
+                    *[When(id=module_id, then=Value(order)) for module_id, (_, order) in changed.items()],
+                    output_field=IntegerField()
+                ),
+                modified_at=now(),
+            )
+    if modules_changed:
+        # Bulk inserts and updates don't send the signals which normally do this
+        invalidate_catalog()
+
+
+def get_ccxcon():
+    """
+    Returns:
+        CCXConAPI: A client for the configured CCXCon
+    """
+    return CCXConAPI(
+        settings.CCXCON_API,
+        settings.CCXCON_OAUTH_CLIENT_ID,
+        settings.CCXCON_OAUTH_CLIENT_SECRET,
+    )
+
+
+def create_ccx(ccxcon, fulfillment, course_modules):
+    """
+    POSTs the CCX for a fulfillment. This doesn't touch the database so it can
+    run outside of the calling thread.
+
+    Args:
+        ccxcon (CCXConAPI): The CCXCon client
+        fulfillment (Fulfillment): A fulfillment with its order purchaser and course loaded
+        course_modules (list): Module UUIDs of the order
+
+    Returns:
+        str: The error if the CCX couldn't be created, else None
+    """
+    course = fulfillment.course
+    try:
+        with deadline(settings.CCXCON_DEADLINE):
+            _, status_code, response_json = ccxcon.create_ccx(
+                course.uuid, fulfillment.order.purchaser.email, fulfillment.seats, course.title,
+                course_modules=course_modules,
+            )
+    except Exception as exc:  # pylint: disable=broad-except
+        return str(exc)
+    if status_code >= 300:
+        return 'Unable to post to ccxcon. Error: {} -- {}'.format(status_code, response_json)
+    return None
+
+
+def record_attempt(fulfillment, error):
+    """
+    Saves the outcome of an attempt to create a fulfillment's CCX. Fulfillments
+    are marked as failed once they run out of attempts.
+
+    Args:
+        fulfillment (Fulfillment): The fulfillment attempted
+        error (str): The error from create_ccx, or None on success
+    """
+    fulfillment.attempts += 1
+    fulfillment.last_error = error
+    if error is None:
+        fulfillment.status = Fulfillment.FULFILLED
+    else:
+        log.error("Couldn't connect to ccxcon. Reason: %s", error)
+        if fulfillment.attempts > fulfill_ccx.max_retries:
+            fulfillment.status = Fulfillment.FAILED
+    fulfillment.save()
+    if fulfillment.status != Fulfillment.PENDING:
+        finish_order(fulfillment.order)
+
+
+def finish_order(order):
+    """
+    Marks a charged order as fulfilled or failed once none of its fulfillments are pending.
+
+    Args:
+        order (Order): The order
+    """
+    statuses = set(order.fulfillment_set.values_list('status', flat=True))
+    if Fulfillment.PENDING in statuses:
+        return
+    status = Order.FAILED if Fulfillment.FAILED in statuses else Order.FULFILLED
+    set_order_status(order, status, from_status=Order.CHARGED)
+
+
+def ccxcon_circuit_open():
+    """
+    Returns:
+        bool: True if requests to CCXCon are failing fast because it's down
+    """
+    return bool(settings.CCXCON_API) and SESSIONS.breaker(settings.CCXCON_API).state == OPEN
+
+
+def requeue_until_ccxcon_available(task, args):
+    """
+    Queues a task again once CCXCon's circuit will let a trial request through.
+    Eager tasks can't be deferred, so their fulfillments are left pending for
+    drain_fulfillments.
+
+    Args:
+        task (celery.Task): The bound task which found the circuit open
+        args (tuple): The task's arguments
+    """
+    if task.request.is_eager:
+        return
+    task.apply_async(args, countdown=SESSIONS.breaker(settings.CCXCON_API).reset_timeout)
+
+
+def pending_fulfillments():
+    """
+    Returns:
+        QuerySet: Pending fulfillments with everything create_ccx needs loaded
+    """
+    # Orders which haven't been charged yet must not get CCXs
+    return Fulfillment.objects.filter(
+        status=Fulfillment.PENDING, order__status=Order.CHARGED
+    ).select_related(
+        'order__purchaser', 'course'
+    ).order_by('id')
+
+
+def order_module_uuids(order_id):
+    """
+    Returns:
+        list: UUIDs of the modules bought in an order
+    """
+    return list(
+        OrderLine.objects.filter(order_id=order_id).order_by('id').values_list('module__uuid', flat=True)
+    )
+
+
+@async.task(bind=True)
+def fulfill_order(self, order_id):
+    """
+    Creates the CCXs for every course in an order at once, sharing one
+    authenticated CCXCon session. Fulfillments which fail are retried
+    individually by fulfill_ccx.
+    """
+    if ccxcon_circuit_open():
+        # Try again once the circuit resets instead of using up the fulfillments' attempts
+        log.warning("CCXCon is unavailable, retrying order %s once its circuit resets", order_id)
+        requeue_until_ccxcon_available(self, (order_id,))
+        return
+
+    fulfillments = list(pending_fulfillments().filter(order_id=order_id))
+    if not fulfillments:
+        return
+
+    course_modules = order_module_uuids(order_id)
+    ccxcon = get_ccxcon()
+    try:
+        # Fetch the token up front so the threads don't each fetch their own
+        with deadline(settings.CCXCON_DEADLINE):
+            ccxcon.authenticate()
+    except Exception as exc:  # pylint: disable=broad-except
+        errors = [str(exc)] * len(fulfillments)
+    else:
+        pool = ThreadPool(min(len(fulfillments), settings.CCXCON_FULFILLMENT_CONCURRENCY))
+        try:
+            errors = pool.map(
+                lambda fulfillment: create_ccx(ccxcon, fulfillment, course_modules),
+                fulfillments
+            )
+        finally:
+            pool.close()
+            pool.join()
+
+    for fulfillment, error in zip(fulfillments, errors):
+        record_attempt(fulfillment, error)
+        if fulfillment.status == Fulfillment.PENDING:
+            fulfill_ccx.apply_async((fulfillment.id,), countdown=get_backoff(fulfillment.attempts - 1))
+
+
+@async.task(bind=True, max_retries=5)
+def fulfill_ccx(self, fulfillment_id):
+    """
+    Creates the CCX for a pending fulfillment on CCXCon.
+    """
+    if ccxcon_circuit_open():
+        # A new task rather than self.retry(), which would use up max_retries
+        log.warning("CCXCon is unavailable, retrying fulfillment %s once its circuit resets", fulfillment_id)
+        requeue_until_ccxcon_available(self, (fulfillment_id,))
+        return
+
+    try:
+        fulfillment = pending_fulfillments().get(id=fulfillment_id)
+    except Fulfillment.DoesNotExist:
+        return  # already fulfilled or given up on
+
+    error = create_ccx(get_ccxcon(), fulfillment, order_module_uuids(fulfillment.order_id))
+    record_attempt(fulfillment, error)
+
+    if fulfillment.status == Fulfillment.PENDING:
+        self.retry(countdown=get_backoff(fulfillment.attempts - 1))
+
+
+@async.task
+def drain_fulfillments():
+    """
+    Queues pending fulfillments which haven't been attempted for longer than
+    the retry schedule allows, e.g. because a worker died, the task was
+    never queued after the order committed or CCXCon was unavailable.
+    """
+    cutoff = now() - timedelta(seconds=get_backoff(fulfill_ccx.max_retries))
+    stale = pending_fulfillments().filter(modified_at__lt=cutoff)
+    for fulfillment_id in stale.values_list('id', flat=True):
+        fulfill_ccx.delay(fulfillment_id)
+
+
+@async.task
+def refresh_access_tokens():
+    """
+    Refreshes edX tokens which will expire before this runs again, so syncs
+    and CCX creation don't wait on a refresh.
+    """
+    margin = timedelta(seconds=settings.EDX_TOKEN_REFRESH_MARGIN)
+    instances = BackingInstance.objects.filter(
+        access_token_expiration__lte=now() + margin,
+        refresh_token__isnull=False,
+    ).exclude(refresh_token='').order_by('id')
+    for instance in instances:
         try:
-            module = Module.objects.get(course=course, locator_id=locator_id)
-        except Module.DoesNotExist:
-            module = Module(course=course, locator_id=locator_id)
-        module.title = payload['display_name']
-        module.order = num
-        module.subchapters = get_subchapters(module.locator_id, blocks)
-        module.save()
+            with deadline(settings.EDX_DEADLINE):
+                refresh_access_token(instance, margin=margin)
+        except (RequestException, UnretrievableToken):
+            log.exception("Couldn't refresh the access token for %s", instance.instance_url)
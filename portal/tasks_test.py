@@ -4,17 +4,42 @@ Module Population Tests
 # pylint: disable=no-self-use,no-value-for-parameter
 from copy import deepcopy
 import json
+from datetime import timedelta
 import os
+import time
 
+from django.core.cache import cache
+from django.utils.timezone import now
 import mock
 import pytest
 from requests.exceptions import RequestException
 from django.test import TestCase
 from celery.exceptions import Retry
 
-from .tasks import module_population, get_backoff
-from .factories import CourseFactory, ModuleFactory
-from .models import Module
+from .tasks import (
+    STRUCTURE_UNCHANGED,
+    STRUCTURE_UPDATED,
+    drain_fulfillments,
+    fulfill_ccx,
+    fulfill_order,
+    get_backoff,
+    get_population_keys,
+    get_structure_hash,
+    module_population,
+    queue_module_population,
+    refresh_access_tokens,
+)
+from .factories import (
+    BackingInstanceFactory,
+    CourseFactory,
+    FulfillmentFactory,
+    ModuleFactory,
+    OrderFactory,
+    OrderLineFactory,
+)
+from .http_pool import SESSIONS
+from .models import Fulfillment, Module, Order
+from .oauth import UnretrievableToken
 
 
 @pytest.mark.parametrize("retries,backoff", [
@@ -31,6 +56,14 @@ def test_get_backoff(retries, backoff):
     assert get_backoff(retries) == backoff
 
 
+def as_chunks(payload, size=1000):
+    """
+    Serialize a blocks API response as it would be streamed.
+    """
+    body = json.dumps(payload).encode('utf-8')
+    return [body[start:start + size] for start in range(0, len(body), size)]
+
+
 class ModulePopulationTests(TestCase):
     """
     Module Population Tests
@@ -58,42 +91,42 @@ class ModulePopulationTests(TestCase):
         Errors doing request should surface the exception.
         """
         course = CourseFactory.create()
-        with mock.patch('portal.tasks.requests', autospec=True) as m_req:
-            m_req.get.side_effect = RequestException()
+        with mock.patch('portal.tasks.SESSIONS', autospec=True) as m_req:
+            m_req.session.return_value.get.side_effect = RequestException()
 
             with pytest.raises(RequestException):
                 module_population(course.course_id)
 
     @mock.patch('portal.tasks.get_access_token', autospec=True)
-    @mock.patch('portal.tasks.requests', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
     def test_request_non_200_exceptions(self, m_req, m_gat):
         """
         non 200 status codes should throw exception and retry.
         """
         course = CourseFactory.create()
         m_gat.return_value = 'asdf'
-        m_req.get.return_value.status_code = 400
+        m_req.session.return_value.get.return_value.status_code = 400
 
         with pytest.raises(Retry):
             module_population(course.course_id)
 
     @mock.patch('portal.tasks.get_access_token', autospec=True)
-    @mock.patch('portal.tasks.requests', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
     def test_modules_created(self, m_req, m_gat):
         """
         Modules are created.
         """
         m_gat.return_value = 'asdf'
         course = CourseFactory.create()
-        m_req.get.return_value.status_code = 200
-        m_req.get.return_value.json = lambda: self.structure_response
+        m_req.session.return_value.get.return_value.status_code = 200
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks(self.structure_response)
 
         module_population(course.course_id)
 
         assert Module.objects.count() == 6
 
     @mock.patch('portal.tasks.get_access_token', autospec=True)
-    @mock.patch('portal.tasks.requests', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
     def test_deleted_modules_removed(self, m_req, m_gat):
         """
         If module isn't in payload, it should be deleted.
@@ -101,25 +134,25 @@ class ModulePopulationTests(TestCase):
         course = CourseFactory.create()
         ModuleFactory.create(course=course)
         m_gat.return_value = 'asdf'
-        m_req.get.return_value.status_code = 200
-        m_req.get.return_value.json = lambda: {
-            'blocks': {'test': {'children': []}}, 'root': 'test'
-        }
+        m_req.session.return_value.get.return_value.status_code = 200
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks({
+            'blocks': {'test': {'children': [], 'type': 'course'}}, 'root': 'test'
+        })
 
         module_population(course.course_id)
 
         assert Module.objects.count() == 0
 
     @mock.patch('portal.tasks.get_access_token', autospec=True)
-    @mock.patch('portal.tasks.requests', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
     def test_module_ordering(self, m_req, m_gat):
         """
         Modules should be ordered based on position in the payload.
         """
         m_gat.return_value = 'asdf'
         course = CourseFactory.create()
-        m_req.get.return_value.status_code = 200
-        m_req.get.return_value.json = lambda: self.structure_response
+        m_req.session.return_value.get.return_value.status_code = 200
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks(self.structure_response)
 
         module_population(course.course_id)
 
@@ -134,23 +167,23 @@ class ModulePopulationTests(TestCase):
         assert actual == expected
 
     @mock.patch('portal.tasks.get_access_token', autospec=True)
-    @mock.patch('portal.tasks.requests', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
     def test_module_reordering(self, m_req, m_gat):
         """
         If modules change order, the db should update accordingly.
         """
         course = CourseFactory.create()
         m_gat.return_value = 'asdf'
-        m_req.get.return_value.status_code = 200
-        m_req.get.return_value.json = lambda: self.structure_response
+        m_req.session.return_value.get.return_value.status_code = 200
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks(self.structure_response)
 
         # initial population. Known to work via `test_module_ordering`
         module_population(course.course_id)
 
-        m_req.get.return_value.status_code = 200
+        m_req.session.return_value.get.return_value.status_code = 200
         resp = self.structure_response.copy()
         resp['blocks'][resp['root']]['children'].sort()
-        m_req.get.return_value.json = lambda: resp
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks(resp)
 
         module_population(course.course_id)
 
@@ -167,7 +200,7 @@ class ModulePopulationTests(TestCase):
         assert actual == expected
 
     @mock.patch('portal.tasks.get_access_token', autospec=True)
-    @mock.patch('portal.tasks.requests', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
     def test_dont_populate_hidden(self, m_req, m_gat):
         """
         If some modules are marked as hidden, don't populate them.
@@ -186,8 +219,8 @@ class ModulePopulationTests(TestCase):
             'visible_to_staff_only'] = True
 
         course = CourseFactory.create()
-        m_req.get.return_value.status_code = 200
-        m_req.get.return_value.json = lambda: response_with_hidden
+        m_req.session.return_value.get.return_value.status_code = 200
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks(response_with_hidden)
         m_gat.return_value = 'asdf'
 
         # initial population. Known to work via `test_module_ordering`
@@ -198,15 +231,15 @@ class ModulePopulationTests(TestCase):
         assert first_module_title not in titles
 
     @mock.patch('portal.tasks.get_access_token', autospec=True)
-    @mock.patch('portal.tasks.requests', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
     def test_delete_existing_hidden(self, m_req, m_gat):
         """
         If some modules are newly marked as hidden, delete them.
         """
         course = CourseFactory.create()
         m_gat.return_value = 'asdf'
-        m_req.get.return_value.status_code = 200
-        m_req.get.return_value.json = lambda: self.structure_response
+        m_req.session.return_value.get.return_value.status_code = 200
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks(self.structure_response)
 
         # initial population. Known to work via `test_module_ordering`
         module_population(course.course_id)
@@ -219,8 +252,8 @@ class ModulePopulationTests(TestCase):
         response_with_hidden['blocks'][first_module_locator_id][
             'visible_to_staff_only'] = True
 
-        m_req.get.return_value.status_code = 200
-        m_req.get.return_value.json = lambda: response_with_hidden
+        m_req.session.return_value.get.return_value.status_code = 200
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks(response_with_hidden)
 
         # initial population. Known to work via `test_module_ordering`
         module_population(course.course_id)
@@ -228,3 +261,401 @@ class ModulePopulationTests(TestCase):
         # Expect that the hidden module's title is not present
         titles = {module.title for module in course.modules.all()}
         assert first_module_title not in titles
+
+    @mock.patch('portal.tasks.get_access_token', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
+    def test_resync_updates_in_place(self, m_req, m_gat):
+        """
+        Renamed modules keep their rows, and a resync without changes doesn't write anything.
+        """
+        course = CourseFactory.create()
+        m_gat.return_value = 'asdf'
+        m_req.session.return_value.get.return_value.status_code = 200
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks(self.structure_response)
+        assert module_population(course.course_id) == STRUCTURE_UPDATED
+        ids = set(Module.objects.values_list('id', flat=True))
+
+        # Loading the course and its instance
+        with self.assertNumQueries(2):
+            assert module_population(course.course_id) == STRUCTURE_UNCHANGED
+
+        renamed = deepcopy(self.structure_response)
+        first_locator_id = renamed['blocks'][renamed['root']]['children'][0]
+        renamed['blocks'][first_locator_id]['display_name'] = "Renamed"
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks(renamed)
+        # The loads, then the hash and one module update in a savepoint
+        with self.assertNumQueries(7):
+            assert module_population(course.course_id) == STRUCTURE_UPDATED
+
+        assert set(Module.objects.values_list('id', flat=True)) == ids
+        assert Module.objects.get(locator_id=first_locator_id).title == "Renamed"
+        assert Module.objects.get(locator_id=first_locator_id).order == 0
+
+    @mock.patch('portal.tasks.get_access_token', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
+    def test_catalog_invalidated(self, m_req, m_gat):
+        """
+        The catalog cache is invalidated when modules change, but not when nothing did.
+        """
+        course = CourseFactory.create()
+        m_gat.return_value = 'asdf'
+        m_req.session.return_value.get.return_value.status_code = 200
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks(self.structure_response)
+        with mock.patch('portal.tasks.invalidate_catalog', autospec=True) as invalidate:
+            module_population(course.course_id)
+            assert invalidate.call_count == 1
+            module_population(course.course_id)
+            assert invalidate.call_count == 1
+
+    @mock.patch('portal.tasks.get_access_token', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
+    def test_one_run_at_a_time(self, m_req, m_gat):
+        """
+        A run which starts while another is running for the same course is queued again.
+        """
+        course = CourseFactory.create(edx_course_id='course-v1:edX+DemoX+Demo_Course')
+        m_gat.return_value = 'asdf'
+        m_req.session.return_value.get.return_value.status_code = 200
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks(self.structure_response)
+        queued_key, running_key = get_population_keys(course.edx_course_id)
+
+        cache.add(running_key, True)
+        with mock.patch.object(module_population, 'apply_async') as apply_async:
+            assert module_population(course.edx_course_id) is None
+        apply_async.assert_called_once_with((course.edx_course_id,), countdown=10)
+        assert not m_req.session.called
+        # Updates in the meantime are coalesced into the queued run
+        assert cache.get(queued_key) is True
+
+        cache.delete(running_key)
+        cache.add(queued_key, True)
+        assert module_population(course.edx_course_id) == STRUCTURE_UPDATED
+        assert cache.get(queued_key) is None
+        assert cache.get(running_key) is None
+
+    @mock.patch('portal.tasks.get_access_token', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
+    def test_lock_released_on_retry(self, m_req, m_gat):
+        """
+        The running lock is released when a run fails and retries.
+        """
+        course = CourseFactory.create(edx_course_id='course-v1:edX+DemoX+Demo_Course')
+        m_gat.return_value = 'asdf'
+        m_req.session.return_value.get.side_effect = RequestException()
+        with pytest.raises(RequestException):
+            module_population(course.edx_course_id)
+        queued_key, running_key = get_population_keys(course.edx_course_id)
+        assert cache.get(running_key) is None
+        # The retry counts as the queued run
+        assert cache.get(queued_key) is True
+        assert not queue_module_population(course.edx_course_id)
+
+    @mock.patch('portal.tasks.get_access_token', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
+    def test_retries_exhausted(self, m_req, m_gat):
+        """
+        Once the retries run out the run isn't left queued, so the next update queues another.
+        """
+        course = CourseFactory.create(edx_course_id='course-v1:edX+DemoX+Demo_Course')
+        m_gat.return_value = 'asdf'
+        m_req.session.return_value.get.side_effect = RequestException()
+        with pytest.raises(RequestException):
+            module_population.delay(course.edx_course_id).get()
+        assert m_req.session.return_value.get.call_count == module_population.max_retries + 1
+        queued_key, running_key = get_population_keys(course.edx_course_id)
+        assert cache.get(queued_key) is None
+        assert cache.get(running_key) is None
+        with mock.patch.object(module_population, 'apply_async'):
+            assert queue_module_population(course.edx_course_id)
+
+    @mock.patch('portal.tasks.get_access_token', autospec=True)
+    @mock.patch('portal.tasks.SESSIONS', autospec=True)
+    def test_eager_waits(self, m_req, m_gat):
+        """
+        An eager run waits for the running sync to finish instead of being dropped.
+        """
+        course = CourseFactory.create(edx_course_id='course-v1:edX+DemoX+Demo_Course')
+        m_gat.return_value = 'asdf'
+        m_req.session.return_value.get.return_value.status_code = 200
+        m_req.session.return_value.get.return_value.iter_content.return_value = as_chunks(self.structure_response)
+        running_key = get_population_keys(course.edx_course_id)[1]
+
+        cache.add(running_key, True)
+        with mock.patch('portal.tasks.time.sleep', autospec=True) as sleep:
+            # The other run finishes while this one waits
+            sleep.side_effect = lambda _: cache.delete(running_key)
+            assert module_population.delay(course.edx_course_id).get() == STRUCTURE_UPDATED
+        assert sleep.call_count == 1
+        assert m_req.session.called
+
+
+class QueueModulePopulationTests(TestCase):
+    """
+    Tests for coalescing module_population runs
+    """
+    @mock.patch('portal.tasks.module_population', autospec=True)
+    def test_coalesced(self, mod_pop):
+        """
+        Only one run is queued per course until it starts.
+        """
+        assert queue_module_population('course1')
+        assert not queue_module_population('course1')
+        assert queue_module_population('course2')
+        assert mod_pop.apply_async.call_args_list == [
+            mock.call(('course1',), countdown=10),
+            mock.call(('course2',), countdown=10),
+        ]
+
+        # Once the run starts later updates queue another one
+        cache.delete(get_population_keys('course1')[0])
+        assert queue_module_population('course1')
+        assert mod_pop.apply_async.call_count == 3
+
+
+def test_structure_hash():
+    """
+    The structure hash changes with chapter ids, names, order and visibility.
+    """
+    chapters = [
+        {'id': 'chapter1', 'display_name': 'One', 'type': 'chapter'},
+        {'id': 'chapter2', 'display_name': 'Two', 'type': 'chapter'},
+    ]
+    structure_hash = get_structure_hash(chapters)
+    assert get_structure_hash(deepcopy(chapters)) == structure_hash
+
+    reordered = list(reversed(chapters))
+    renamed = deepcopy(chapters)
+    renamed[0]['display_name'] = 'Uno'
+    hidden = deepcopy(chapters)
+    hidden[1]['visible_to_staff_only'] = True
+    for changed in (reordered, renamed, hidden, chapters[:1]):
+        assert get_structure_hash(changed) != structure_hash
+
+
+@mock.patch('portal.tasks.CCXConAPI')
+class FulfillCCXTests(TestCase):
+    """
+    Tests for creating CCXs from fulfillments
+    """
+    def setUp(self):
+        self.fulfillment = FulfillmentFactory.create()
+        self.line = OrderLineFactory.create(
+            order=self.fulfillment.order,
+            module__course=self.fulfillment.course,
+        )
+
+    def test_fulfilled(self, ccxcon_api):
+        """
+        A successful POST marks the fulfillment as fulfilled.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+        fulfill_ccx(self.fulfillment.id)
+
+        ccxcon_api.return_value.create_ccx.assert_called_once_with(
+            self.fulfillment.course.uuid,
+            self.fulfillment.order.purchaser.email,
+            self.fulfillment.seats,
+            self.fulfillment.course.title,
+            course_modules=[self.line.module.uuid],
+        )
+        self.fulfillment.refresh_from_db()
+        assert self.fulfillment.status == Fulfillment.FULFILLED
+        assert self.fulfillment.attempts == 1
+        assert self.fulfillment.last_error is None
+        assert Order.objects.get(id=self.fulfillment.order.id).status == Order.FULFILLED
+
+    def test_error_retries(self, ccxcon_api):
+        """
+        An error records the reason and retries.
+        """
+        ccxcon_api.return_value.create_ccx.side_effect = AttributeError("Example Error")
+        with pytest.raises(Retry):
+            fulfill_ccx(self.fulfillment.id)
+
+        self.fulfillment.refresh_from_db()
+        assert self.fulfillment.status == Fulfillment.PENDING
+        assert self.fulfillment.attempts == 1
+        assert self.fulfillment.last_error == "Example Error"
+
+    def test_gives_up(self, ccxcon_api):
+        """
+        After the last retry the fulfillment is marked as failed.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (False, 500, "This is an error")
+        fulfill_ccx.delay(self.fulfillment.id)
+
+        assert ccxcon_api.return_value.create_ccx.call_count == fulfill_ccx.max_retries + 1
+        self.fulfillment.refresh_from_db()
+        assert self.fulfillment.status == Fulfillment.FAILED
+        assert "This is an error" in self.fulfillment.last_error
+        assert Order.objects.get(id=self.fulfillment.order.id).status == Order.FAILED
+
+    def test_already_fulfilled(self, ccxcon_api):
+        """
+        Fulfillments which aren't pending are skipped.
+        """
+        self.fulfillment.status = Fulfillment.FULFILLED
+        self.fulfillment.save()
+        fulfill_ccx(self.fulfillment.id)
+        assert not ccxcon_api.return_value.create_ccx.called
+
+    def test_order_not_charged(self, ccxcon_api):
+        """
+        CCXs aren't created for orders which haven't been charged.
+        """
+        for status in (Order.PENDING, Order.FAILED):
+            Order.objects.filter(id=self.fulfillment.order.id).update(status=status)
+            fulfill_ccx(self.fulfillment.id)
+            fulfill_order(self.fulfillment.order.id)
+        assert not ccxcon_api.return_value.create_ccx.called
+
+    def test_drain_stale(self, ccxcon_api):
+        """
+        Only pending fulfillments which haven't been touched for a while are queued.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+        stale = FulfillmentFactory.create()
+        Fulfillment.objects.filter(id=stale.id).update(modified_at=now() - timedelta(days=1))
+
+        drain_fulfillments()
+
+        assert ccxcon_api.return_value.create_ccx.call_count == 1
+        assert Fulfillment.objects.get(id=stale.id).status == Fulfillment.FULFILLED
+        assert Fulfillment.objects.get(id=self.fulfillment.id).status == Fulfillment.PENDING
+
+
+@mock.patch('portal.tasks.CCXConAPI')
+class FulfillOrderTests(TestCase):
+    """
+    Tests for creating every CCX in an order at once
+    """
+    def setUp(self):
+        self.order = OrderFactory.create(status=Order.CHARGED)
+        self.fulfillments = []
+        for _ in range(3):
+            line = OrderLineFactory.create(order=self.order)
+            self.fulfillments.append(FulfillmentFactory.create(
+                order=self.order, course=line.module.course, seats=line.seats
+            ))
+
+    def test_fulfilled_concurrently(self, ccxcon_api):
+        """
+        Every course's CCX is created at the same time with one client.
+        """
+        def _create_ccx(*args, **kwargs):  # pylint: disable=unused-argument
+            """Side effect function simulating a slow CCXCon"""
+            time.sleep(.3)
+            return True, 201, {}
+        ccxcon_api.return_value.create_ccx.side_effect = _create_ccx
+
+        start = time.time()
+        with self.settings(CCXCON_FULFILLMENT_CONCURRENCY=4):
+            fulfill_order(self.order.id)
+        assert time.time() - start < .6
+
+        assert ccxcon_api.call_count == 1
+        assert ccxcon_api.return_value.authenticate.call_count == 1
+        assert sorted(
+            call[0][0] for call in ccxcon_api.return_value.create_ccx.call_args_list
+        ) == sorted(fulfillment.course.uuid for fulfillment in self.fulfillments)
+        assert set(
+            Fulfillment.objects.values_list('status', flat=True)
+        ) == {Fulfillment.FULFILLED}
+        assert Order.objects.get(id=self.order.id).status == Order.FULFILLED
+
+    def test_failures_retried(self, ccxcon_api):
+        """
+        A course whose CCX can't be created is retried on its own.
+        """
+        failing_uuid = self.fulfillments[0].course.uuid
+
+        def _create_ccx(master_course_uuid, *args, **kwargs):  # pylint: disable=unused-argument
+            """Side effect function failing the first course"""
+            if master_course_uuid == failing_uuid:
+                raise AttributeError("Example Error")
+            return True, 201, {}
+        ccxcon_api.return_value.create_ccx.side_effect = _create_ccx
+
+        fulfill_order(self.order.id)
+
+        failed = Fulfillment.objects.get(id=self.fulfillments[0].id)
+        assert failed.status == Fulfillment.FAILED
+        assert failed.attempts == fulfill_ccx.max_retries + 1
+        assert Fulfillment.objects.filter(status=Fulfillment.FULFILLED).count() == 2
+        assert Order.objects.get(id=self.order.id).status == Order.FAILED
+
+    def test_token_error(self, ccxcon_api):
+        """
+        If a token can't be fetched every fulfillment records the error.
+        """
+        ccxcon_api.return_value.authenticate.side_effect = AttributeError("Token Error")
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+
+        fulfill_order(self.order.id)
+
+        assert Fulfillment.objects.filter(
+            status=Fulfillment.FULFILLED, attempts=2, last_error=None
+        ).count() == 3
+
+    def test_circuit_open(self, ccxcon_api):
+        """
+        While CCXCon's circuit is open fulfillments are queued again for when
+        it resets, without using up attempts.
+        """
+        with self.settings(CCXCON_API='https://ccxcon.example.com/api/'):
+            breaker = SESSIONS.breaker('https://ccxcon.example.com/api/')
+            for _ in range(breaker.failure_threshold):
+                breaker.record_failure()
+            with mock.patch.object(fulfill_order, 'apply_async') as order_async:
+                with mock.patch.object(fulfill_ccx, 'apply_async') as ccx_async:
+                    fulfill_order(self.order.id)
+                    fulfill_ccx(self.fulfillments[0].id)
+
+        assert not ccxcon_api.called
+        assert Fulfillment.objects.filter(status=Fulfillment.PENDING, attempts=0).count() == 3
+        order_async.assert_called_once_with((self.order.id,), countdown=breaker.reset_timeout)
+        ccx_async.assert_called_once_with((self.fulfillments[0].id,), countdown=breaker.reset_timeout)
+
+    def test_circuit_open_eager(self, ccxcon_api):
+        """
+        Eager tasks can't be deferred, so they leave fulfillments pending for drain_fulfillments.
+        """
+        with self.settings(CCXCON_API='https://ccxcon.example.com/api/'):
+            breaker = SESSIONS.breaker('https://ccxcon.example.com/api/')
+            for _ in range(breaker.failure_threshold):
+                breaker.record_failure()
+            fulfill_order.delay(self.order.id)
+            fulfill_ccx.delay(self.fulfillments[0].id)
+
+        assert not ccxcon_api.called
+        assert Fulfillment.objects.filter(status=Fulfillment.PENDING, attempts=0).count() == 3
+
+
+@mock.patch('portal.tasks.refresh_access_token', autospec=True)
+class RefreshAccessTokensTests(TestCase):
+    """
+    Tests for refreshing edX tokens ahead of time
+    """
+    def test_refreshes_expiring(self, refresh):
+        """
+        Only tokens which can be refreshed and expire before the next run are refreshed.
+        """
+        expiring = BackingInstanceFactory.create(
+            refresh_token='refresh', access_token_expiration=now() + timedelta(hours=2, minutes=30)
+        )
+        BackingInstanceFactory.create(refresh_token='refresh', access_token_expiration=now() + timedelta(hours=5))
+        BackingInstanceFactory.create(refresh_token=None)
+
+        refresh_access_tokens()
+
+        assert [call[0][0] for call in refresh.call_args_list] == [expiring]
+        assert refresh.call_args[1]['margin'] == timedelta(hours=3)
+
+    def test_errors_logged(self, refresh):
+        """
+        One instance failing doesn't stop the others being refreshed.
+        """
+        BackingInstanceFactory.create_batch(2, refresh_token='refresh', access_token_expiration=now())
+        refresh.side_effect = UnretrievableToken("Error")
+        refresh_access_tokens()
+        assert refresh.call_count == 2
@@ -5,7 +5,7 @@ from django.conf.urls import url, include
 from django.contrib import admin
 
 from portal.views.activation import activate_view
-from portal.views.checkout_api import CheckoutView
+from portal.views.checkout_api import CheckoutView, QuoteView
 from portal.views.login import LoginView, logout_view
 from portal.views.course_api import CourseListView, CourseDetailView
 from portal.views.permissions_api import course_permissions_view
@@ -27,6 +27,7 @@ urlpatterns = (
     url(r'^api/v1/register/$', register_view, name='register'),
     url(r'^api/v1/activate/$', activate_view, name='activate'),
     url(r'^api/v1/checkout/$', CheckoutView.as_view(), name='checkout'),
+    url(r'^api/v1/quote/$', QuoteView.as_view(), name='quote'),
     url(r'^status/', include('server_status.urls')),
     url(r'^o/', include('oauth2_provider.urls', namespace='oauth2_provider')),
     # Note: this catches all URLs so put it last
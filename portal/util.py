@@ -3,12 +3,21 @@ Helper functions which may be generally useful.
 """
 
 from __future__ import unicode_literals
+from collections import namedtuple, OrderedDict
 from decimal import Decimal, ROUND_HALF_EVEN
+import hashlib
+import json
 import logging
 
+from django.conf import settings
+from django.core import signing
+from django.utils.encoding import force_text
+from django.utils.timezone import now
 from rest_framework.exceptions import ValidationError
 
 from portal.models import (
+    Course,
+    Fulfillment,
     Module,
     Order,
     OrderLine,
@@ -17,33 +26,110 @@ from portal.permissions import AuthorizationHelpers
 
 log = logging.getLogger(__name__)
 
+QUOTE_SALT = 'portal.quote'
 
-def calculate_cart_subtotal(cart):
+PricedLine = namedtuple('PricedLine', ['module', 'seats', 'line_total'])
+
+
+class PricedCart(object):
+    """
+    A validated cart with the modules and prices it was validated against.
     """
-    Calculate total of a cart.
+
+    def __init__(self, lines):
+        """
+        Args:
+            lines (list): A PricedLine for each module in the cart
+        """
+        self.lines = lines
+        self.subtotal = sum((line.line_total for line in lines), Decimal())
+
+    @property
+    def cents(self):
+        """
+        Returns:
+            int: The subtotal in cents
+        """
+        return get_cents(self.subtotal)
+
+
+def _collect_cart_uuids(cart):
+    """
+    Collect course and module uuids from a cart which hasn't been validated yet.
+    Malformed items are skipped here and rejected by validate_cart.
+
     Args:
         cart (list): A list of items in cart
     Returns:
-        Decimal: Total price of cart
+        tuple: (set, set) Course uuids and module uuids
     """
-    total = Decimal()
+    course_uuids = set()
+    module_uuids = set()
     for item in cart:
-        for uuid in item['uuids']:
-            total += calculate_orderline_total(uuid, item['seats'])
-    return total
+        try:
+            course_uuids.add(force_text(item['course_uuid']))
+            uuids = item['uuids']
+        except (KeyError, TypeError):
+            continue
+        if isinstance(uuids, list):
+            module_uuids.update(force_text(uuid) for uuid in uuids)
+    return course_uuids, module_uuids
+
+
+def _is_available_for_purchase(course):
+    """
+    Course.is_available_for_purchase computed from the annotations added by
+    CourseQuerySet.with_module_counts, so it doesn't need more queries.
+    """
+    return (
+        course.live and
+        course.module_count > 0 and
+        course.module_count == course.priced_module_count
+    )
+
 
+def _can_purchase(course, owned_course_ids):
+    """
+    Same as AuthorizationHelpers.can_purchase_course, for courses from _load_cart.
 
-def calculate_orderline_total(uuid, seats):
+    Args:
+        course (Course): A course annotated by CourseQuerySet.with_module_counts
+        owned_course_ids (set): Ids of the courses the user owns
+    Returns:
+        bool: True if the user can buy the course
     """
-    Calculate total for a particular item.
+    return course.id not in owned_course_ids and _is_available_for_purchase(course)
+
+
+def _load_cart(cart, user):
+    """
+    Look up the courses and modules in a cart in bulk.
+
     Args:
-        uuid (str): A UUID
-        seats (int): A number of seats
+        cart (list): A list of items in cart
+        user (django.contrib.auth.models.User): A user
     Returns:
-        Decimal: Product price times number of seats
+        tuple: (dict, set, dict) Courses visible to the user by uuid, ids of the
+            courses the user owns, and modules by uuid
     """
-    module = Module.objects.get(uuid=uuid)
-    return module.price_without_tax * seats
+    course_uuids, module_uuids = _collect_cart_uuids(cart)
+    courses = {
+        course.uuid: course for course in
+        AuthorizationHelpers.get_courses(user).filter(uuid__in=course_uuids)
+    }
+    if user.id is None:
+        owned_course_ids = set()
+    else:
+        owned_course_ids = set(
+            Course.objects.filter(
+                uuid__in=course_uuids, owners__id=user.id
+            ).values_list('id', flat=True)
+        )
+    modules = {
+        module.uuid: module for module in
+        Module.objects.filter(uuid__in=module_uuids).select_related('course')
+    }
+    return courses, owned_course_ids, modules
 
 
 # pylint: disable=too-many-branches
@@ -53,9 +139,15 @@ def validate_cart(cart, user):
     Args:
         cart (list): A list of items in cart
         user (django.contrib.auth.models.User): A user
+    Returns:
+        PricedCart: The cart with its modules and prices
     """
     modules_in_cart = set()
     courses_in_cart = set()
+    lines = []
+
+    # Look up everything in the cart up front, then check items in order
+    courses, owned_course_ids, modules = _load_cart(cart, user)
 
     for item in cart:
         try:
@@ -81,19 +173,19 @@ def validate_cart(cart, user):
         if course_uuid in courses_in_cart:
             log.debug("Duplicate course %s in cart", course_uuid)
             raise ValidationError("Duplicate course in cart")
-        course = AuthorizationHelpers.get_course(course_uuid, user)
+        course = courses.get(force_text(course_uuid))
         if course is None:
+            log.debug("Couldn't find a course with uuid %s visible to %s", course_uuid, user)
             raise ValidationError("One or more courses are unavailable")
 
-        if not AuthorizationHelpers.can_purchase_course(course, user):
+        if not _can_purchase(course, owned_course_ids):
             raise ValidationError("User cannot purchase this course")
 
         courses_in_cart.add(course_uuid)
 
         for uuid in uuids:
-            try:
-                module = Module.objects.get(uuid=uuid)
-            except Module.DoesNotExist:
+            module = modules.get(force_text(uuid))
+            if module is None:
                 log.debug('Could not find module with uuid %s', uuid)
                 raise ValidationError("One or more modules are unavailable")
 
@@ -113,40 +205,155 @@ def validate_cart(cart, user):
                 raise ValidationError("Duplicate module in cart")
 
             modules_in_cart.add(uuid)
+            lines.append(PricedLine(module, seats, module.price_without_tax * seats))
+
+    return PricedCart(lines)
 
 
-def create_order(cart, user):
+def get_cart_hash(cart):
     """
-    Create an order given a cart's contents.
+    Hash a cart's contents so a quote can be tied to it.
     Args:
-        cart: (list): A list of items in cart.
+        cart (list): A list of items in cart
+    Returns:
+        str: A hex digest which doesn't depend on key order
+    """
+    serialized = json.dumps(cart, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def get_module_version(module):
+    """
+    Args:
+        module (Module): A module
+    Returns:
+        str: A value which changes whenever the module is saved, for example with a new price
+    """
+    return module.modified_at.isoformat()
+
+
+def make_quote(cart, priced_cart, user):
+    """
+    Sign the price of a validated cart so checkout doesn't need to validate it again.
+    Args:
+        cart (list): The cart as sent by the client
+        priced_cart (PricedCart): The cart returned by validate_cart
+        user (django.contrib.auth.models.User): The user the quote is for
+    Returns:
+        str: A quote token which expires after settings.QUOTE_MAX_AGE seconds
+    """
+    return signing.dumps({
+        'user': user.id,
+        'cart': get_cart_hash(cart),
+        'cents': priced_cart.cents,
+        'versions': {line.module.uuid: get_module_version(line.module) for line in priced_cart.lines},
+    }, salt=QUOTE_SALT, compress=True)
+
+
+def validate_quote(quote, cart, user):
+    """
+    Check a quote and price its cart. If none of the cart's modules have changed
+    and its courses can still be bought this is the same lookups as
+    validate_cart, otherwise the cart needs to go through validate_cart again
+    for its errors.
+    Args:
+        quote (str): A token from make_quote
+        cart (list): The cart as sent by the client
+        user (django.contrib.auth.models.User): A user
+    Returns:
+        (int, PricedCart): The quoted total in cents, and the priced cart or None if the quote is out of date
+    """
+    try:
+        data = signing.loads(quote, salt=QUOTE_SALT, max_age=settings.QUOTE_MAX_AGE)
+    except signing.SignatureExpired:
+        raise ValidationError("Quote has expired")
+    except signing.BadSignature:
+        raise ValidationError("Invalid quote")
+    if data['user'] != user.id or data['cart'] != get_cart_hash(cart):
+        raise ValidationError("Quote doesn't match cart")
+
+    versions = data['versions']
+    courses, owned_course_ids, modules = _load_cart(cart, user)
+    lines = []
+    # The cart was validated when the quote was made, so it's well formed
+    for item in cart:
+        course = courses.get(force_text(item['course_uuid']))
+        if course is None or not _can_purchase(course, owned_course_ids):
+            log.debug("Course %s can't be bought since quote was made", item['course_uuid'])
+            return data['cents'], None
+        for uuid in item['uuids']:
+            module = modules.get(force_text(uuid))
+            if (
+                    module is None or
+                    module.course_id != course.id or
+                    get_module_version(module) != versions.get(force_text(uuid)) or
+                    not module.is_available_for_purchase
+            ):
+                log.debug("Module %s changed since quote was made", uuid)
+                return data['cents'], None
+            lines.append(PricedLine(module, item['seats'], module.price_without_tax * item['seats']))
+    return data['cents'], PricedCart(lines)
+
+
+def create_order(priced_cart, user):
+    """
+    Create an order given a cart's contents, along with a pending Fulfillment
+    for each course so CCXs can be created once the order is committed.
+    Args:
+        priced_cart: (PricedCart): A cart returned by validate_cart
         user: (django.contrib.auth.models.User): A user
     Returns:
         Order: A newly created order
     """
-    validate_cart(cart, user)
-
-    subtotal = calculate_cart_subtotal(cart)
     order = Order.objects.create(
         purchaser=user,
-        subtotal=subtotal,
-        total_paid=subtotal,
+        subtotal=priced_cart.subtotal,
+        total_paid=priced_cart.subtotal,
+    )
+    # Django 1.9 doesn't set primary keys on bulk created objects, so callers
+    # should load lines through order.orderline_set
+    OrderLine.objects.bulk_create(
+        OrderLine(
+            order=order,
+            seats=line.seats,
+            module=line.module,
+            price_without_tax=line.module.price_without_tax,
+            line_total=line.line_total
+        ) for line in priced_cart.lines
+    )
+
+    # Every module in a course is bought with the same number of seats
+    seats_by_course = OrderedDict()
+    for line in priced_cart.lines:
+        seats_by_course.setdefault(line.module.course, line.seats)
+    Fulfillment.objects.bulk_create(
+        Fulfillment(order=order, course=course, seats=seats)
+        for course, seats in seats_by_course.items()
     )
-    for item in cart:
-        seats = item['seats']
-        uuids = item['uuids']
-        for uuid in uuids:
-            module = Module.objects.get(uuid=uuid)
-            OrderLine.objects.create(
-                order=order,
-                seats=seats,
-                module=module,
-                price_without_tax=module.price_without_tax,
-                line_total=calculate_orderline_total(uuid, seats)
-            )
     return order
 
 
+def set_order_status(order, status, from_status=None):
+    """
+    Move an order to a new status with a single UPDATE, so no lock is held
+    on the row for longer than the statement.
+    Args:
+        order (Order): An order
+        status (str): The new status
+        from_status (str): If set, the order is only changed if it has this status
+    Returns:
+        bool: True if the order was changed
+    """
+    orders = Order.objects.filter(id=order.id)
+    if from_status is not None:
+        orders = orders.filter(status=from_status)
+    # update() skips auto_now fields
+    updated = orders.update(status=status, modified_at=now()) == 1
+    if updated:
+        order.status = status
+    return updated
+
+
 def get_cents(dec):
     """
     Helper function to get an integer cents value from a Decimal.
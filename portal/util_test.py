@@ -6,6 +6,8 @@ from __future__ import unicode_literals
 from decimal import Decimal
 
 from django.contrib.auth.models import User, Group
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.exceptions import ValidationError
 
 from portal.models import Order, OrderLine
@@ -15,8 +17,7 @@ from portal.factories import (
     ModuleFactory,
 )
 from portal.util import (
-    calculate_cart_subtotal,
-    calculate_orderline_total,
+    PricedCart,
     create_order,
     get_cents,
     validate_cart,
@@ -95,19 +96,19 @@ class CheckoutValidationTests(CourseTests):
         self.module.price_without_tax = 0
         self.module.save()
 
-        assert calculate_cart_subtotal([
+        assert validate_cart([
             {
                 "uuids": [self.module.uuid],
                 "seats": 10,
                 "course_uuid": self.course.uuid
             }
-        ]) == 0
+        ], self.user).subtotal == 0
 
     def test_empty_cart_total(self):  # pylint: disable=no-self-use
         """
         Assert that an empty cart has a total of $0
         """
-        assert calculate_cart_subtotal([]) == 0
+        assert PricedCart([]).subtotal == 0
 
     def test_cart_total(self):
         """
@@ -117,32 +118,22 @@ class CheckoutValidationTests(CourseTests):
             course=self.course,
         )
         seats = 10
-        assert calculate_cart_subtotal([
+        priced_cart = validate_cart([
             {
                 "uuids": [self.module.uuid, module2.uuid],
                 "seats": seats,
                 "course_uuid": self.course.uuid
             }
-        ]) == (
+        ], self.user)
+        assert [line.line_total for line in priced_cart.lines] == [
+            self.module.price_without_tax * seats,
+            module2.price_without_tax * seats,
+        ]
+        assert priced_cart.subtotal == (
             self.module.price_without_tax * seats +
             module2.price_without_tax * seats
         )
 
-    def test_empty_line_total(self):
-        """
-        Assert that an line with a module with price $0 has a total of $0
-        """
-        self.module.price_without_tax = 0
-        self.module.save()
-
-        assert calculate_orderline_total(self.module.uuid, 10) == 0
-
-    def test_line_total(self):
-        """
-        Assert that a line total is the price times quantity.
-        """
-        assert calculate_orderline_total(self.module.uuid, 10) == self.module.price_without_tax * 10
-
     def test_validation(self):
         """
         Assert that a valid cart will pass validation.
@@ -369,6 +360,64 @@ class CheckoutValidationTests(CourseTests):
             }], self.user)
         assert ex.exception.detail[0] == "One or more courses are unavailable"
 
+    def test_priced_cart(self):
+        """
+        Assert that validation returns the cart's modules and prices.
+        """
+        module2 = ModuleFactory.create(course=self.course, price_without_tax=Decimal('1.25'))
+        priced_cart = validate_cart([
+            {
+                "uuids": [self.module.uuid, module2.uuid],
+                "seats": 3,
+                "course_uuid": self.course.uuid
+            }
+        ], self.user)
+        assert [(line.module, line.seats) for line in priced_cart.lines] == [
+            (self.module, 3), (module2, 3)
+        ]
+        assert priced_cart.lines[1].line_total == Decimal('3.75')
+        assert priced_cart.subtotal == self.module.price_without_tax * 3 + Decimal('3.75')
+        assert priced_cart.cents == get_cents(priced_cart.subtotal)
+
+    def test_validation_queries(self):
+        """
+        Validation takes the same number of queries no matter how big the cart is.
+        """
+        cart = []
+        for _ in range(5):
+            course = CourseFactory.create(live=True)
+            modules = ModuleFactory.create_batch(10, course=course)
+            cart.append({
+                "uuids": [module.uuid for module in modules],
+                "seats": 10,
+                "course_uuid": course.uuid,
+            })
+        # Load permissions up front so only cart queries are counted
+        self.user.get_all_permissions()
+
+        with self.assertNumQueries(3):
+            validate_cart(cart, self.user)
+
+    def test_first_error_wins(self):
+        """
+        Items are checked in order, so an error in an earlier item is reported
+        even though a later item is malformed.
+        """
+        with self.assertRaises(ValidationError) as ex:
+            validate_cart([
+                {
+                    "uuids": [self.module.uuid],
+                    "seats": 10,
+                    "course_uuid": "missing"
+                },
+                {
+                    "uuids": [self.module.uuid],
+                    "seats": 0,
+                    "course_uuid": self.course.uuid
+                },
+            ], self.user)
+        assert ex.exception.detail[0] == "One or more courses are unavailable"
+
 
 class CheckoutOrderTests(CourseTests):
     """
@@ -388,7 +437,7 @@ class CheckoutOrderTests(CourseTests):
         """
         Assert an empty order
         """
-        order = create_order([], self.user)
+        order = create_order(validate_cart([], self.user), self.user)
         assert order.purchaser == self.user
         assert order.total_paid == 0
         assert order.subtotal == 0
@@ -413,7 +462,7 @@ class CheckoutOrderTests(CourseTests):
 
         first_seats = 5
         second_seats = 10
-        order = create_order([
+        cart = [
             {
                 "uuids": [self.module.uuid],
                 "seats": first_seats,
@@ -424,7 +473,8 @@ class CheckoutOrderTests(CourseTests):
                 "seats": second_seats,
                 "course_uuid": second_module.course.uuid
             },
-        ], self.user)
+        ]
+        order = create_order(validate_cart(cart, self.user), self.user)
         first_line_total = self.module.price_without_tax * first_seats
         second_line_total = second_price * second_seats
 
@@ -443,3 +493,39 @@ class CheckoutOrderTests(CourseTests):
         assert second_line.line_total == second_line_total
         assert second_line.price_without_tax == second_price
         assert second_line.seats == second_seats
+
+    def test_modules_looked_up_once(self):
+        """
+        Validating a cart and creating its order only looks up modules once.
+        """
+        cart = [{
+            "uuids": [self.module.uuid] + [
+                module.uuid for module in ModuleFactory.create_batch(3, course=self.course)
+            ],
+            "seats": 5,
+            "course_uuid": self.course.uuid
+        }]
+        with CaptureQueriesContext(connection) as context:
+            create_order(validate_cart(cart, self.user), self.user)
+        module_queries = [
+            query for query in context.captured_queries
+            if 'FROM "portal_module"' in query['sql']
+        ]
+        assert len(module_queries) == 1
+
+    def test_order_line_queries(self):
+        """
+        Order lines are inserted together no matter how many modules are in the cart.
+        """
+        cart = [{
+            "uuids": [self.module.uuid] + [
+                module.uuid for module in ModuleFactory.create_batch(9, course=self.course)
+            ],
+            "seats": 5,
+            "course_uuid": self.course.uuid
+        }]
+        priced_cart = validate_cart(cart, self.user)
+        with self.assertNumQueries(3):
+            order = create_order(priced_cart, self.user)
+        assert order.orderline_set.count() == 10
+        assert order.fulfillment_set.get().seats == 5
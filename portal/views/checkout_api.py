@@ -3,139 +3,249 @@ API for checkout
 """
 
 from __future__ import unicode_literals
+from datetime import timedelta
+import hashlib
+import json
 import logging
 from decimal import Decimal
 
 from django.conf import settings
 from django.db import transaction
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils.encoding import force_bytes
+from django.utils.timezone import now
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from stripe import Charge
+from stripe.error import AuthenticationError, CardError, InvalidRequestError
 
 from portal.util import (
-    calculate_cart_subtotal,
     create_order,
     get_cents,
+    make_quote,
+    set_order_status,
     validate_cart,
+    validate_quote,
 )
-from ..models import OrderLine
-from ..ccxcon_api import CCXConAPI
+from portal.models import CheckoutRecord, Fulfillment, Order
+from portal.tasks import fulfill_order
 
 log = logging.getLogger(__name__)
 
+IDEMPOTENCY_KEY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+# Stripe errors which mean the card wasn't charged. Anything else, like a
+# timeout or a 500 from Stripe, may have happened after the charge was made.
+CHARGE_REJECTED_ERRORS = (AuthenticationError, CardError, InvalidRequestError)
 
-class CheckoutView(APIView):
+
+def get_cart(data):
     """
-    Handles checkout for courses and modules.
+    Get the cart from request data, before validate_cart looks at its contents.
+
+    Args:
+        data (dict): The request data
+    Returns:
+        list: The cart
+    """
+    try:
+        cart = data['cart']
+    except KeyError as ex:
+        raise ValidationError("Missing key {}".format(ex.args[0]))
+
+    if not isinstance(cart, list):
+        raise ValidationError("Cart must be a list of items")
+    if len(cart) == 0:
+        raise ValidationError("Cannot checkout an empty cart")
+    return cart
+
+
+def get_request_hash(data):
+    """
+    Hash a checkout request so a repeat can be told apart from a different checkout.
+    Args:
+        data (dict): The request data
+    Returns:
+        str: A hex digest which doesn't depend on key order
+    """
+    serialized = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def get_stripe_idempotency_key(record):
+    """
+    Stripe keys are shared by the whole account and limited to 255 characters.
+    Every attempt with the same record uses the same key, so Stripe returns the
+    first charge instead of making another. Stripe also remembers declines, so
+    records are deleted when a charge is declined and the retry gets a new one.
+    Args:
+        record (CheckoutRecord): The checkout's idempotency record
+    Returns:
+        str: The idempotency key for the charge
+    """
+    return "checkout-{user_id}-{record_id}-{key_hash}".format(
+        user_id=record.user_id,
+        record_id=record.id,
+        key_hash=hashlib.sha256(force_bytes(record.key)).hexdigest(),
+    )
+
+
+def take_over_abandoned(record, request_hash):
+    """
+    Claim an unfinished checkout record if it's old enough that its request must have crashed.
+
+    Args:
+        record (CheckoutRecord): A record without a response
+        request_hash (str): The hash of the request taking it over
+    Returns:
+        bool: True if the record was claimed
+    """
+    cutoff = now() - timedelta(seconds=settings.CHECKOUT_IDEMPOTENCY_TIMEOUT)
+    # Only one request can match the old created_at, so only one takes the record over
+    claimed = CheckoutRecord.objects.filter(
+        id=record.id, response_status__isnull=True, created_at__lt=cutoff
+    ).update(created_at=now(), request_hash=request_hash)
+    if claimed:
+        log.warning(
+            "Retrying abandoned checkout %s, previous order: %s", record.id, record.order_id
+        )
+    return bool(claimed)
+
+
+def queue_fulfillment(order):
+    """
+    Queue CCX creation for a charged order. The customer has already paid, so
+    if the task can't be queued the order's pending fulfillments are left for
+    drain_fulfillments instead of failing the checkout.
+
+    Args:
+        order (Order): The charged order
+    """
+    try:
+        fulfill_order.delay(order.id)
+    except Exception:  # pylint: disable=broad-except
+        log.exception("Unable to queue fulfillment for order %s", order.id)
+
+
+class QuoteView(APIView):
+    """
+    Prices a cart and signs the price, so checkout doesn't need to validate the cart again.
     """
     permission_classes = (IsAuthenticated,)
 
-    @staticmethod
-    def notify_external_services(order, user):
+    def post(self, request):
         """
-        Notify external services (ie CCXCon) about purchases.
-
+        Quote the price of a cart.
         Args:
-          order (portal.models.Order): The user's order.
-          user (django.contrib.auth.models.User): User for the request.
-
+            request: rest_framework.request.Request
         Returns:
-          errors (set): A set of errors resulting from notification
+            rest_framework.response.Response
         """
-        errors = set()
-        courses_and_seats = {}
+        cart = get_cart(request.data)
+        priced_cart = validate_cart(cart, request.user)
+        return Response({
+            "quote": make_quote(cart, priced_cart, request.user),
+            "total": str(priced_cart.subtotal),
+            "expires_in": settings.QUOTE_MAX_AGE,
+        })
 
-        try:
-            user.userinfo
-        except ObjectDoesNotExist:
-            raise ValidationError("You must have a user profile to check out.")
 
-        # OrderLine stores a reference to a module and the number of seats
-        # for each module. This number of seats should always be the same for each module
-        # in a course.
-        for line in OrderLine.objects.filter(order=order):
-            course_uuid = line.module.course.uuid
-            if course_uuid not in courses_and_seats:
-                courses_and_seats[line.module.course.uuid] = (line.module.course, line.seats)
-
-        ccxcon = CCXConAPI(
-            settings.CCXCON_API,
-            settings.CCXCON_OAUTH_CLIENT_ID,
-            settings.CCXCON_OAUTH_CLIENT_SECRET,
-        )
-        for course, seats in courses_and_seats.values():
-            try:
-                _, status_code, response_json = ccxcon.create_ccx(
-                    course.uuid, user.email, seats, course.title,
-                    course_modules=[
-                        orderline.module.uuid
-                        for orderline in order.orderline_set.all()
-                    ])
-            except Exception as e:  # pylint: disable=broad-except,invalid-name
-                log.error("Couldn't connect to ccxcon. Reason: %s", e)
-                errors.add(str(e))
-                continue
-
-            if status_code >= 300:
-                errors.add('Unable to post to ccxcon. Error: {} -- {}'.format(
-                    status_code, response_json))
-                log.error(
-                    "Couldn't connect to ccxcon. Reason: %s", response_json)
-        return errors
+class CheckoutView(APIView):
+    """
+    Handles checkout for courses and modules.
+    """
+    permission_classes = (IsAuthenticated,)
 
     def validate_data(self):
         """
-        Validates incoming request data.
+        Validates incoming request data. Carts with a quote from QuoteView
+        are checked against it instead of the total from the client.
 
         Returns:
-            (string, dict): stripe token and cart information.
+            (string, PricedCart): stripe token and the validated cart.
         """
         data = self.request.data
+        quote = data.get('quote')
         try:
             token = str(data['token'])
-            cart = data['cart']
-            estimated_total = Decimal(float(data['total']))
+            if quote is None:
+                estimated_total = Decimal(float(data['total']))
         except KeyError as ex:
             raise ValidationError("Missing key {}".format(ex.args[0]))
         except (TypeError, ValueError):
             raise ValidationError("Invalid float")
+        cart = get_cart(data)
+
+        try:
+            self.request.user.userinfo
+        except ObjectDoesNotExist:
+            raise ValidationError("You must have a user profile to check out.")
+
+        if quote is not None:
+            expected_cents, priced_cart = validate_quote(str(quote), cart, self.request.user)
+            if priced_cart is not None:
+                return token, priced_cart
+        else:
+            expected_cents = get_cents(estimated_total)
 
-        if not isinstance(cart, list):
-            raise ValidationError("Cart must be a list of items")
-        if len(cart) == 0:
-            raise ValidationError("Cannot checkout an empty cart")
-        validate_cart(cart, self.request.user)
+        priced_cart = validate_cart(cart, self.request.user)
 
-        total = calculate_cart_subtotal(cart)
-        if get_cents(total) != get_cents(estimated_total):
+        if priced_cart.cents != expected_cents:
             log.error(
                 "Cart total doesn't match expected value. "
                 "Total from client: %f but actual total is: %f",
-                estimated_total,
-                total
+                Decimal(expected_cents) / 100,
+                priced_cart.subtotal
             )
             raise ValidationError("Cart total doesn't match expected value")
 
-        return token, cart
+        return token, priced_cart
 
-    def post(self, request):
+    def charge(self, token, priced_cart, record=None):
         """
-        Make a purchase of the cart.
+        Create the order and charge for it. The order is committed as pending
+        first so no transaction or row lock is held while waiting on Stripe,
+        then moved on to charged or failed.
+
         Args:
-            request: rest_framework.request.Request
+            token (str): The Stripe token
+            priced_cart (PricedCart): The validated cart
+            record (CheckoutRecord): The idempotency record for the checkout, if any
         Returns:
-            rest_framework.response.Response
+            Order: The order placed
         """
-        token, cart = self.validate_data()
-
+        user = self.request.user
         with transaction.atomic():
-            order = create_order(cart, request.user)
+            order = create_order(priced_cart, user)
+            if record is not None:
+                # Linked now so a retry charges this order instead of placing another
+                record.order = order
+                record.save(update_fields=['order'])
+
+        self.charge_order(order, token, record)
+        return order
+
+    @staticmethod
+    def charge_order(order, token, record=None):
+        """
+        Charge for a pending order and mark it charged. Without an idempotency
+        record any error fails the order. With one, the order is only failed if
+        Stripe rejected the charge, since otherwise the card may have been
+        charged and a retry with the same Stripe key will find out.
 
-            amount_in_cents = get_cents(order.total_paid)
-            if amount_in_cents != 0:
+        Args:
+            order (Order): A pending order
+            token (str): The Stripe token
+            record (CheckoutRecord): The idempotency record for the checkout, if any
+        """
+        amount_in_cents = get_cents(order.total_paid)
+        if amount_in_cents != 0:
+            kwargs = {}
+            if record is not None:
+                kwargs['idempotency_key'] = get_stripe_idempotency_key(record)
+            try:
                 Charge.create(
                     amount=amount_in_cents,
                     currency="usd",
@@ -143,15 +253,91 @@ class CheckoutView(APIView):
                     description="Course purchase for MIT Teacher's Portal",
                     metadata={
                         "order_id": order.id
-                    }
+                    },
+                    **kwargs
                 )
+            except Exception as ex:
+                if record is None or isinstance(ex, CHARGE_REJECTED_ERRORS):
+                    set_order_status(order, Order.FAILED, from_status=Order.PENDING)
+                    order.fulfillment_set.update(status=Fulfillment.FAILED)
+                raise
+        set_order_status(order, Order.CHARGED, from_status=Order.PENDING)
 
-        errors = self.notify_external_services(order, request.user)
+    def resume(self, record):
+        """
+        Finish the order placed by an earlier attempt at a checkout, so a
+        takeover doesn't place and charge a second order.
+
+        Args:
+            record (CheckoutRecord): A record linked to an order
+        Returns:
+            Order: The order placed
+        """
+        order = record.order
+        if order.status == Order.PENDING:
+            # The request hash matched, so this is the token the order was placed with
+            self.charge_order(order, str(self.request.data.get('token')), record)
+        elif order.status == Order.FAILED:
+            raise ValidationError("The previous attempt at this checkout failed, please try again")
+        return order
+
+    def post(self, request):
+        """
+        Make a purchase of the cart. If the request has an Idempotency-Key
+        header, repeating it returns the first response without placing
+        another order.
+        Args:
+            request: rest_framework.request.Request
+        Returns:
+            rest_framework.response.Response
+        """
+        idempotency_key = request.META.get(IDEMPOTENCY_KEY_HEADER)
+        if idempotency_key is None:
+            token, priced_cart = self.validate_data()
+            order = self.charge(token, priced_cart)
+            queue_fulfillment(order)
+            return Response(status=200)
+
+        if not idempotency_key or len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            raise ValidationError(
+                "Idempotency key must be 1 to {} characters".format(MAX_IDEMPOTENCY_KEY_LENGTH)
+            )
+        request_hash = get_request_hash(request.data)
+        record, created = CheckoutRecord.objects.get_or_create(
+            user=request.user, key=idempotency_key, defaults={'request_hash': request_hash}
+        )
+        if not created:
+            # Records saved before request hashes were stored can't be checked
+            if record.request_hash is not None and record.request_hash != request_hash:
+                return Response(
+                    {"error": "This idempotency key was used for a different checkout"}, status=422
+                )
+            if record.response_status is not None:
+                return Response(record.response_data, status=record.response_status)
+            if not take_over_abandoned(record, request_hash):
+                return Response(
+                    {"error": "A checkout with this idempotency key is in progress"}, status=409
+                )
+
+        try:
+            if record.order_id is None:
+                token, priced_cart = self.validate_data()
+                order = self.charge(token, priced_cart, record)
+            else:
+                order = self.resume(record)
+        except Exception:
+            # Keep the record if a charge may have been made, so the retry reuses the
+            # order and Stripe key. Otherwise let the client try again with the same key.
+            if not Order.objects.filter(id=record.order_id).exclude(status=Order.FAILED).exists():
+                record.delete()
+            raise
 
-        if len(errors):
-            return Response({
-                'error': "Unable to post to CCXCon",
-                'error_list': errors,
-            }, status=500)
+        response = Response(status=200)
+        record.response_status = response.status_code
+        record.response_data = response.data
+        record.save(update_fields=['response_status', 'response_data'])
 
-        return Response(status=200)
+        # CCXs are created from the fulfillments committed with the order, so a
+        # slow or failing CCXCon doesn't hold up or fail a paid checkout.
+        queue_fulfillment(order)
+        return response
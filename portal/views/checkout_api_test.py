@@ -3,29 +3,30 @@ Tests for checkout API
 """
 # pylint: disable=no-self-use,invalid-name
 from __future__ import unicode_literals
+from datetime import timedelta
+from decimal import Decimal
+import hashlib
 import json
 
+from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
+from django.utils.timezone import now
 from mock import patch
 from stripe import Charge
+from stripe.error import APIConnectionError, CardError
 
 from portal.factories import (
     CourseFactory,
     ModuleFactory,
-    OrderFactory,
-    OrderLineFactory,
 )
-from portal.models import Order, OrderLine, UserInfo
+from portal.models import CheckoutRecord, Fulfillment, Order, OrderLine, UserInfo
 from portal.views.base import CourseTests
 from portal.util import (
-    calculate_cart_subtotal,
-    calculate_orderline_total,
     get_cents,
+    validate_cart,
 )
 
-from .checkout_api import CheckoutView
-
 
 class CheckoutAPITests(CourseTests):
     """
@@ -48,7 +49,7 @@ class CheckoutAPITests(CourseTests):
         )
         self.client.login(username=self.user.username, password=password)
 
-    @patch('portal.views.checkout_api.CCXConAPI')
+    @patch('portal.tasks.CCXConAPI')
     def test_no_userinfo(self, ccxcon_api):
         """Should show validation error if there isn't a user info"""
         user = User.objects.create_user(
@@ -67,7 +68,7 @@ class CheckoutAPITests(CourseTests):
             "course_uuid": self.course.uuid
         }
         cart = [cart_item]
-        total = calculate_cart_subtotal(cart)
+        total = validate_cart(cart, self.user).subtotal
         # Note: autospec intentionally not used, we need an unbound method here
         with patch.object(Charge, 'create') as create_mock:
             mocked_kwargs = {}
@@ -178,12 +179,12 @@ class CheckoutAPITests(CourseTests):
             "course_uuid": self.course.uuid
         }
         cart = [cart_item]
-        total = calculate_cart_subtotal(cart)
+        total = validate_cart(cart, self.user).subtotal
         # Note: autospec intentionally not used, we need an unbound method here
         with patch.object(Charge, 'create') as create_mock:
             with patch(
-                'portal.views.checkout_api.CheckoutView.notify_external_services'
-            ) as notify_mock:
+                'portal.views.checkout_api.fulfill_order'
+            ) as fulfill_mock:
                 resp = self.client.post(
                     reverse('checkout'),
                     content_type='application/json',
@@ -196,7 +197,7 @@ class CheckoutAPITests(CourseTests):
 
         assert resp.status_code == 200, resp.content.decode('utf-8')
         assert create_mock.call_count == 1
-        assert notify_mock.call_count == 1
+        assert fulfill_mock.delay.call_count == 1
 
     def test_missing_item_keys(self):
         """
@@ -224,7 +225,7 @@ class CheckoutAPITests(CourseTests):
             assert resp.status_code == 400, resp.content.decode('utf-8')
             assert "Missing key {}".format(key) in resp.content.decode('utf-8')
 
-    @patch('portal.views.checkout_api.CCXConAPI')
+    @patch('portal.tasks.CCXConAPI')
     def test_cart_without_price(self, ccxcon_api):
         """
         Assert that if the total of a cart is zero, checkout still works.
@@ -254,7 +255,7 @@ class CheckoutAPITests(CourseTests):
         assert resp.status_code == 200, resp.content.decode('utf-8')
         assert ccxcon_api.return_value.create_ccx.called
 
-    @patch('portal.views.checkout_api.CCXConAPI')
+    @patch('portal.tasks.CCXConAPI')
     def test_ccx_creation(self, ccxcon_api):
         """
         Assert that CCX is created, on successful checkout.
@@ -272,7 +273,7 @@ class CheckoutAPITests(CourseTests):
             "course_uuid": self.course.uuid
         }
         cart = [cart_item]
-        total = calculate_cart_subtotal(cart)
+        total = validate_cart(cart, self.user).subtotal
         # Note: autospec intentionally not used, we need an unbound method here
         with patch.object(Charge, 'create') as create_mock:
 
@@ -289,6 +290,8 @@ class CheckoutAPITests(CourseTests):
         assert resp.status_code == 200, resp.content.decode('utf-8')
         assert create_mock.call_count == 1
         assert ccxcon_api.return_value.create_ccx.call_count == 1
+        assert Fulfillment.objects.get().status == Fulfillment.FULFILLED
+        assert Order.objects.get().status == Order.FULFILLED
         ccxcon_api.return_value.create_ccx.assert_called_with(
             self.course.uuid,
             self.user.email,
@@ -297,7 +300,7 @@ class CheckoutAPITests(CourseTests):
             course_modules=[self.module.uuid, module2.uuid],
         )
 
-    @patch('portal.views.checkout_api.CCXConAPI')
+    @patch('portal.tasks.CCXConAPI')
     def test_stripe_charge(self, ccxcon_api):
         """
         Assert that we execute the stripe charge with the proper arguments, on successful checkout.
@@ -309,7 +312,7 @@ class CheckoutAPITests(CourseTests):
             "course_uuid": self.course.uuid
         }
         cart = [cart_item]
-        total = calculate_cart_subtotal(cart)
+        total = validate_cart(cart, self.user).subtotal
         # Note: autospec intentionally not used, we need an unbound method here
         with patch.object(Charge, 'create') as create_mock:
             mocked_kwargs = {}
@@ -341,10 +344,7 @@ class CheckoutAPITests(CourseTests):
         order = Order.objects.get(id=mocked_kwargs['metadata']['order_id'])
         assert order.orderline_set.count() == 1
         order_line = order.orderline_set.first()
-        assert calculate_orderline_total(
-            cart_item['uuids'][0],
-            cart_item['seats']
-        ) == order_line.line_total
+        assert self.module.price_without_tax * cart_item['seats'] == order_line.line_total
 
     def test_cart_with_price_not_matching_total(self):
         """
@@ -370,10 +370,10 @@ class CheckoutAPITests(CourseTests):
         assert resp.status_code == 400, resp.content.decode('utf-8')
         assert "Cart total doesn't match expected value" in resp.content.decode('utf-8')
 
-    @patch('portal.views.checkout_api.CCXConAPI')
+    @patch('portal.tasks.CCXConAPI')
     def test_cart_fails_to_checkout(self, ccxcon_api):
         """
-        Assert that we clean up everything if checkout failed.
+        Assert that a failed charge fails the order and no CCX is created.
         """
         cart_item = {
             "uuids": [self.module.uuid],
@@ -395,29 +395,17 @@ class CheckoutAPITests(CourseTests):
                     data=json.dumps({
                         "cart": cart,
                         "token": "token",
-                        "total": float(calculate_cart_subtotal(cart))
+                        "total": float(validate_cart(cart, self.user).subtotal)
                     })
                 )
             assert ex.exception.args[0] == 'test exception'
 
-            assert Order.objects.count() == 0
-            assert OrderLine.objects.count() == 0
+            assert Order.objects.get().status == Order.FAILED
+            assert OrderLine.objects.count() == 1
+            assert Fulfillment.objects.get().status == Fulfillment.FAILED
             assert not ccxcon_api.called
 
-    @patch('portal.views.checkout_api.CCXConAPI')
-    def test_failed_api_try_all(self, ccxcon_api):
-        """
-        If the post fails, it should try again for the second orderline.
-        """
-        ccxcon_api.return_value.create_ccx.side_effect = AttributeError()
-        order = OrderFactory.create()
-        OrderLineFactory.create_batch(2, order=order)
-
-        CheckoutView().notify_external_services(order, order.purchaser)
-
-        assert ccxcon_api.return_value.create_ccx.call_count == 2
-
-    @patch('portal.views.checkout_api.CCXConAPI')
+    @patch('portal.tasks.CCXConAPI')
     def test_failed_post_makes_orders(self, ccxcon_api):
         """
         If the ccx creation fails, orders are still created
@@ -439,25 +427,62 @@ class CheckoutAPITests(CourseTests):
                 data=json.dumps({
                     "cart": cart,
                     "token": "token",
-                    "total": float(calculate_cart_subtotal(cart))
+                    "total": float(validate_cart(cart, self.user).subtotal)
                 })
             )
 
-        assert resp.status_code == 500, resp.content.decode('utf-8')
+        assert resp.status_code == 200, resp.content.decode('utf-8')
         assert Order.objects.count() - start == 1
         assert OrderLine.objects.count() - start_ol == 1
+        fulfillment = Fulfillment.objects.get()
+        assert fulfillment.status == Fulfillment.FAILED
+        assert fulfillment.attempts == 6
+
+    def test_queue_failure_after_charge(self):
+        """
+        If fulfillment can't be queued after the charge, checkout still succeeds
+        and the fulfillment is left pending for drain_fulfillments.
+        """
+        cart = [{
+            "uuids": [self.module.uuid],
+            "seats": 5,
+            "course_uuid": self.course.uuid
+        }]
+        total = validate_cart(cart, self.user).subtotal
+        with patch.object(Charge, 'create') as create_mock:
+            with patch('portal.views.checkout_api.fulfill_order') as fulfill_mock:
+                fulfill_mock.delay.side_effect = Exception("broker unavailable")
+                resp = self.client.post(
+                    reverse('checkout'),
+                    content_type='application/json',
+                    data=json.dumps({
+                        "cart": cart,
+                        "token": "token",
+                        "total": float(total)
+                    })
+                )
 
-    @patch('portal.views.checkout_api.CCXConAPI')
-    def test_errors_propagate_to_response(self, ccxcon_api):
+        assert resp.status_code == 200, resp.content.decode('utf-8')
+        assert create_mock.call_count == 1
+        assert Order.objects.get().status == Order.CHARGED
+        assert Fulfillment.objects.get().status == Fulfillment.PENDING
+
+    @patch('portal.tasks.CCXConAPI')
+    def test_errors_recorded_on_fulfillments(self, ccxcon_api):
         """
-        If there are errors on checkout, they make it to the response.
+        If CCXCon errors after checkout, the errors are recorded on each course's fulfillment.
         """
         course2 = CourseFactory.create(live=True)
         module2 = ModuleFactory.create(course=course2, price_without_tax=345)
-        ccxcon_api.return_value.create_ccx.side_effect = [
-            AttributeError("Example Error"),
-            AttributeError("Another Error"),
-        ]
+        errors = {
+            self.course.uuid: "Example Error",
+            course2.uuid: "Another Error",
+        }
+
+        def _create_ccx(master_course_uuid, *args, **kwargs):  # pylint: disable=unused-argument
+            """Side effect function to fail each course with its own error"""
+            raise AttributeError(errors[master_course_uuid])
+        ccxcon_api.return_value.create_ccx.side_effect = _create_ccx
         cart = [
             {
                 "uuids": [self.module.uuid],
@@ -477,18 +502,19 @@ class CheckoutAPITests(CourseTests):
                 data=json.dumps({
                     "cart": cart,
                     "token": "token",
-                    "total": float(calculate_cart_subtotal(cart))
+                    "total": float(validate_cart(cart, self.user).subtotal)
                 })
             )
 
-        assert resp.status_code == 500, resp.content.decode('utf-8')
-        assert "Example Error" in resp.content.decode('utf-8')
-        assert "Another Error" in resp.content.decode('utf-8')
+        assert resp.status_code == 200, resp.content.decode('utf-8')
+        assert ccxcon_api.return_value.create_ccx.call_count == 12
+        assert Fulfillment.objects.get(course=self.course).last_error == "Example Error"
+        assert Fulfillment.objects.get(course=course2).last_error == "Another Error"
 
-    @patch('portal.views.checkout_api.CCXConAPI')
-    def test_non_200_propagates_to_response(self, ccxcon_api):
+    @patch('portal.tasks.CCXConAPI')
+    def test_non_200_recorded_on_fulfillment(self, ccxcon_api):
         """
-        If ccx POST returns a non-200, the response will have this information.
+        If ccx POST returns a non-200, the fulfillment records it and checkout still succeeds.
         """
         error_message = "This is an error"
         ccxcon_api.return_value.create_ccx.return_value = [
@@ -507,7 +533,7 @@ class CheckoutAPITests(CourseTests):
             "course_uuid": self.course.uuid
         }
         cart = [cart_item]
-        total = calculate_cart_subtotal(cart)
+        total = validate_cart(cart, self.user).subtotal
         # Note: autospec intentionally not used, we need an unbound method here
         with patch.object(Charge, 'create') as create_mock:
 
@@ -521,9 +547,11 @@ class CheckoutAPITests(CourseTests):
                 })
             )
 
-        assert resp.status_code == 500, resp.content.decode('utf-8')
-        assert error_message in resp.content.decode('utf-8')
+        assert resp.status_code == 200, resp.content.decode('utf-8')
         assert create_mock.call_count == 1
+        fulfillment = Fulfillment.objects.get()
+        assert fulfillment.status == Fulfillment.FAILED
+        assert error_message in fulfillment.last_error
 
     def test_not_logged_in(self):
         """
@@ -546,3 +574,358 @@ class CheckoutAPITests(CourseTests):
             })
         )
         assert resp.status_code == 403
+
+
+@patch('portal.tasks.CCXConAPI')
+class IdempotentCheckoutTests(CourseTests):
+    """
+    Tests for checkout with an idempotency key
+    """
+    def setUp(self):
+        super(IdempotentCheckoutTests, self).setUp()
+        self.course.live = True
+        self.course.save()
+
+        self.user = User.objects.create_user(
+            username="auser",
+            password="apass",
+            email="email@example.com"
+        )
+        UserInfo.objects.create(user=self.user, full_name='Test User')
+        self.client.login(username="auser", password="apass")
+        self.cart = [{
+            "uuids": [self.module.uuid],
+            "seats": 5,
+            "course_uuid": self.course.uuid
+        }]
+
+    def post(self, key, total=None):
+        """Checkout the cart with an idempotency key"""
+        if total is None:
+            total = float(validate_cart(self.cart, self.user).subtotal)
+        return self.client.post(
+            reverse('checkout'),
+            content_type='application/json',
+            data=json.dumps({
+                "cart": self.cart,
+                "token": "token",
+                "total": total
+            }),
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_repeat_returns_first_response(self, ccxcon_api):
+        """
+        Repeating a checkout with the same key doesn't charge or order again.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+        with patch.object(Charge, 'create') as create_mock:
+            first = self.post('key')
+            second = self.post('key')
+
+        assert first.status_code == second.status_code == 200
+        assert create_mock.call_count == 1
+        assert Order.objects.count() == 1
+        assert create_mock.call_args[1]['idempotency_key'] == "checkout-{}-{}-{}".format(
+            self.user.id, CheckoutRecord.objects.get().id, hashlib.sha256(b'key').hexdigest()
+        )
+        assert ccxcon_api.return_value.create_ccx.call_count == 1
+        assert CheckoutRecord.objects.get().order == Order.objects.get()
+
+    def test_keys_scoped_to_user(self, ccxcon_api):
+        """
+        Different users can use the same key.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+        other = User.objects.create_user(username="other", password="other")
+        UserInfo.objects.create(user=other, full_name='Other User')
+        with patch.object(Charge, 'create') as create_mock:
+            self.post('key')
+            self.client.login(username="other", password="other")
+            self.post('key')
+
+        assert create_mock.call_count == 2
+        assert Order.objects.count() == 2
+
+    def test_different_request(self, ccxcon_api):
+        """
+        Reusing a key for a different checkout gets a 422 instead of the first response.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+        with patch.object(Charge, 'create') as create_mock:
+            first = self.post('key')
+            self.cart[0]['seats'] = 6
+            second = self.post('key')
+
+        assert first.status_code == 200, first.content.decode('utf-8')
+        assert second.status_code == 422, second.content.decode('utf-8')
+        assert create_mock.call_count == 1
+        assert Order.objects.count() == 1
+
+    def test_in_progress(self, ccxcon_api):  # pylint: disable=unused-argument
+        """
+        A repeat while the first checkout is still running gets a 409.
+        """
+        CheckoutRecord.objects.create(user=self.user, key='key')
+        with patch.object(Charge, 'create') as create_mock:
+            resp = self.post('key')
+        assert resp.status_code == 409, resp.content.decode('utf-8')
+        assert not create_mock.called
+        assert not Order.objects.exists()
+
+    def test_abandoned(self, ccxcon_api):
+        """
+        A checkout which never finished is retried once it's older than CHECKOUT_IDEMPOTENCY_TIMEOUT.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+        record = CheckoutRecord.objects.create(user=self.user, key='key')
+        CheckoutRecord.objects.filter(id=record.id).update(
+            created_at=now() - timedelta(seconds=settings.CHECKOUT_IDEMPOTENCY_TIMEOUT + 1)
+        )
+        with patch.object(Charge, 'create') as create_mock:
+            resp = self.post('key')
+        assert resp.status_code == 200, resp.content.decode('utf-8')
+        assert create_mock.call_count == 1
+        record = CheckoutRecord.objects.get()
+        assert record.response_status == 200
+        assert record.order == Order.objects.get()
+
+    def test_repeat_after_charge_error(self, ccxcon_api):
+        """
+        If Stripe might have made the charge, the record is kept. A repeat gets a 409 until
+        the record is abandoned, then charges the same order with the same Stripe key.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+        with patch.object(Charge, 'create') as create_mock:
+            create_mock.side_effect = APIConnectionError("timed out")
+            with self.assertRaises(APIConnectionError):
+                self.post('key')
+            first_key = create_mock.call_args[1]['idempotency_key']
+
+            create_mock.side_effect = None
+            resp = self.post('key')
+            assert resp.status_code == 409, resp.content.decode('utf-8')
+            assert create_mock.call_count == 1
+
+            CheckoutRecord.objects.update(
+                created_at=now() - timedelta(seconds=settings.CHECKOUT_IDEMPOTENCY_TIMEOUT + 1)
+            )
+            resp = self.post('key')
+
+        assert resp.status_code == 200, resp.content.decode('utf-8')
+        assert create_mock.call_count == 2
+        assert create_mock.call_args[1]['idempotency_key'] == first_key
+        order = Order.objects.get()
+        assert order.status == Order.FULFILLED
+        record = CheckoutRecord.objects.get()
+        assert record.order == order
+        assert record.response_status == 200
+
+    def test_abandoned_after_charge(self, ccxcon_api):
+        """
+        Taking over a checkout whose order was already charged finishes it without charging again.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+        with patch.object(Charge, 'create'):
+            self.post('key')
+        CheckoutRecord.objects.update(
+            response_status=None,
+            response_data=None,
+            created_at=now() - timedelta(seconds=settings.CHECKOUT_IDEMPOTENCY_TIMEOUT + 1),
+        )
+
+        with patch.object(Charge, 'create') as create_mock:
+            resp = self.post('key')
+        assert resp.status_code == 200, resp.content.decode('utf-8')
+        assert not create_mock.called
+        assert Order.objects.count() == 1
+        assert CheckoutRecord.objects.get().response_status == 200
+
+    def test_failure_can_be_retried(self, ccxcon_api):
+        """
+        Errors aren't stored, so the client can fix the problem and use the same key.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+        resp = self.post('key', total=0)
+        assert resp.status_code == 400, resp.content.decode('utf-8')
+
+        with patch.object(Charge, 'create') as create_mock:
+            create_mock.side_effect = CardError("card declined", None, 'card_declined')
+            with self.assertRaises(CardError):
+                self.post('key')
+        assert not CheckoutRecord.objects.exists()
+        assert Order.objects.get().status == Order.FAILED
+
+        failed_key = create_mock.call_args[1]['idempotency_key']
+
+        with patch.object(Charge, 'create') as create_mock:
+            resp = self.post('key')
+        assert resp.status_code == 200, resp.content.decode('utf-8')
+        assert CheckoutRecord.objects.get().order.status == Order.FULFILLED
+        # Stripe remembers the failure for the first key, so the retry needs another
+        assert create_mock.call_args[1]['idempotency_key'] != failed_key
+
+    def test_key_too_long(self, ccxcon_api):  # pylint: disable=unused-argument
+        """
+        Keys longer than 255 characters are rejected.
+        """
+        resp = self.post('k' * 256)
+        assert resp.status_code == 400, resp.content.decode('utf-8')
+
+    def test_longest_key(self, ccxcon_api):
+        """
+        The longest key allowed still fits in a Stripe idempotency key.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+        with patch.object(Charge, 'create') as create_mock:
+            resp = self.post('k' * 255)
+        assert resp.status_code == 200, resp.content.decode('utf-8')
+        assert len(create_mock.call_args[1]['idempotency_key']) <= 255
+
+
+@patch('portal.tasks.CCXConAPI')
+class QuoteTests(CourseTests):
+    """
+    Tests for checkout with a quote
+    """
+    def setUp(self):
+        super(QuoteTests, self).setUp()
+        self.course.live = True
+        self.course.save()
+
+        self.user = User.objects.create_user(
+            username="auser",
+            password="apass",
+            email="email@example.com"
+        )
+        UserInfo.objects.create(user=self.user, full_name='Test User')
+        self.client.login(username="auser", password="apass")
+        self.cart = [{
+            "uuids": [self.module.uuid],
+            "seats": 5,
+            "course_uuid": self.course.uuid
+        }]
+
+    def get_quote(self):
+        """Quote the cart"""
+        resp = self.client.post(
+            reverse('quote'),
+            content_type='application/json',
+            data=json.dumps({"cart": self.cart})
+        )
+        assert resp.status_code == 200, resp.content.decode('utf-8')
+        return json.loads(resp.content.decode('utf-8'))
+
+    def checkout(self, quote):
+        """Checkout the cart with a quote"""
+        return self.client.post(
+            reverse('checkout'),
+            content_type='application/json',
+            data=json.dumps({
+                "cart": self.cart,
+                "token": "token",
+                "quote": quote,
+            })
+        )
+
+    def test_quote(self, ccxcon_api):
+        """
+        Checkout with a quote charges the quoted total without validating the cart again.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+        quote = self.get_quote()
+        total = validate_cart(self.cart, self.user).subtotal
+        assert Decimal(quote['total']) == total
+        assert quote['expires_in'] == 900
+
+        with patch.object(Charge, 'create') as create_mock, patch(
+            'portal.views.checkout_api.validate_cart'
+        ) as validate_mock:
+            resp = self.checkout(quote['quote'])
+        assert resp.status_code == 200, resp.content.decode('utf-8')
+        assert not validate_mock.called
+        assert create_mock.call_args[1]['amount'] == get_cents(total)
+        assert Order.objects.get().total_paid == total
+
+    def test_module_changed(self, ccxcon_api):
+        """
+        If a module changed since the quote the cart is validated again,
+        and the checkout fails if its price changed.
+        """
+        ccxcon_api.return_value.create_ccx.return_value = (True, 201, {})
+        quote = self.get_quote()['quote']
+        self.module.title = "New title"
+        self.module.save()
+        with patch.object(Charge, 'create'), patch(
+            'portal.views.checkout_api.validate_cart', wraps=validate_cart
+        ) as validate_mock:
+            resp = self.checkout(quote)
+        assert resp.status_code == 200, resp.content.decode('utf-8')
+        assert validate_mock.called
+
+        quote = self.get_quote()['quote']
+        self.module.price_without_tax += 1
+        self.module.save()
+        with patch.object(Charge, 'create') as create_mock:
+            resp = self.checkout(quote)
+        assert resp.status_code == 400, resp.content.decode('utf-8')
+        assert "Cart total doesn't match expected value" in resp.content.decode('utf-8')
+        assert not create_mock.called
+
+    def test_course_changed(self, ccxcon_api):  # pylint: disable=unused-argument
+        """
+        A quote can't be used once its course can't be bought, even if its modules didn't change.
+        """
+        quote = self.get_quote()['quote']
+        ModuleFactory.create(course=self.course, price_without_tax=None)
+        with patch.object(Charge, 'create') as create_mock:
+            resp = self.checkout(quote)
+        assert resp.status_code == 400, resp.content.decode('utf-8')
+        assert "User cannot purchase this course" in resp.content.decode('utf-8')
+        assert not create_mock.called
+
+    def test_owner_after_quote(self, ccxcon_api):  # pylint: disable=unused-argument
+        """
+        A quote can't be used once the user owns the course.
+        """
+        quote = self.get_quote()['quote']
+        self.course.owners.add(self.user)
+        with patch.object(Charge, 'create') as create_mock:
+            resp = self.checkout(quote)
+        assert resp.status_code == 400, resp.content.decode('utf-8')
+        assert "User cannot purchase this course" in resp.content.decode('utf-8')
+        assert not create_mock.called
+
+    def test_invalid_quote(self, ccxcon_api):  # pylint: disable=unused-argument
+        """
+        Tampered, expired or mismatched quotes are rejected.
+        """
+        quote = self.get_quote()['quote']
+        with patch.object(Charge, 'create') as create_mock:
+            resp = self.checkout(quote + "x")
+            assert resp.status_code == 400, resp.content.decode('utf-8')
+            assert "Invalid quote" in resp.content.decode('utf-8')
+
+            with self.settings(QUOTE_MAX_AGE=-1):
+                resp = self.checkout(quote)
+            assert resp.status_code == 400, resp.content.decode('utf-8')
+            assert "Quote has expired" in resp.content.decode('utf-8')
+
+            self.cart[0]['seats'] = 6
+            resp = self.checkout(quote)
+            assert resp.status_code == 400, resp.content.decode('utf-8')
+            assert "Quote doesn't match cart" in resp.content.decode('utf-8')
+        assert not create_mock.called
+
+    def test_quote_validates_cart(self, ccxcon_api):  # pylint: disable=unused-argument
+        """
+        Carts are validated before they're quoted.
+        """
+        self.cart[0]['seats'] = 0
+        resp = self.client.post(
+            reverse('quote'),
+            content_type='application/json',
+            data=json.dumps({"cart": self.cart})
+        )
+        assert resp.status_code == 400, resp.content.decode('utf-8')
+        assert "Number of seats is zero" in resp.content.decode('utf-8')
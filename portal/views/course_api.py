@@ -4,26 +4,33 @@ Views for course availability listing.
 from __future__ import unicode_literals
 
 from decimal import Decimal, DecimalException
+import hashlib
 import logging
-from six.moves.urllib.parse import (  # pylint: disable=import-error
-    urlparse,
-    urlunparse,
-)
 from six import string_types
 
 from django.conf import settings
-from django.http.response import Http404
-from oauthlib.oauth2 import BackendApplicationClient
-from requests_oauthlib import OAuth2Session
+from django.http.response import Http404, HttpResponse
+from django.utils.decorators import method_decorator
+from django.utils.encoding import force_bytes
+from django.views.decorators.http import condition
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView, RetrieveAPIView
 from rest_framework.response import Response
 
-from portal.models import Module
-from portal.permissions import AuthorizationHelpers
+from portal.ccxcon_api import CCXConAPI
+from portal.catalog_cache import (
+    COURSE_LIST_KEY,
+    course_detail_key,
+    get_rendered,
+    set_rendered,
+)
+from portal.models import Course, Module
+from portal.pagination import CourseCursorPagination
+from portal.permissions import AuthorizationHelpers, SEE_OWN_NOT_LIVE
 from portal.serializers import (
     CourseSerializer,
     CourseSerializerReduced,
+    serialize_courses,
 )
 
 
@@ -38,45 +45,275 @@ def ccxcon_request():
         conn_info (requests_oauthlib.OAuth2Session): You can use this to make
             authenticated requests to the backing instance.
     """
-    ccxcon_api = settings.CCXCON_API
-    client_id = settings.CCXCON_OAUTH_CLIENT_ID
-    client_secret = settings.CCXCON_OAUTH_CLIENT_SECRET
-
-    # Get an oauth token. At some point in the future we may want to cache
-    # this if it doesn't already so we don't make an unnecessary request here.
-    client = BackendApplicationClient(client_id=client_id)
-    oauth_ccxcon = OAuth2Session(client=client)
-    token_url = urlunparse(urlparse(ccxcon_api)._replace(path="/o/token/"))
-    oauth_ccxcon.fetch_token(
-        token_url=token_url,
-        client_id=client_id,
-        client_secret=client_secret,
+    ccxcon = CCXConAPI(
+        settings.CCXCON_API,
+        settings.CCXCON_OAUTH_CLIENT_ID,
+        settings.CCXCON_OAUTH_CLIENT_SECRET,
+    )
+    # The token comes from the process wide token cache, so this only makes a
+    # request to CCXCon when there isn't an unexpired token
+    ccxcon.authenticate()
+    return ccxcon.oauth_client
+
+
+def is_catalog_cacheable(request):
+    """
+    Args:
+        request (rest_framework.request.Request): The request
+    Returns:
+        bool: True if the response is shared by every anonymous user through the catalog cache
+    """
+    return (
+        request.user.is_anonymous() and
+        request.accepted_renderer.format == 'json' and
+        not request.query_params
     )
 
-    return oauth_ccxcon
 
+def get_catalog_cache_key(uuid=None):
+    """
+    Args:
+        uuid (str): An optional course UUID
+    Returns:
+        str: The catalog cache key for the course list, or a course detail if uuid is given
+    """
+    return COURSE_LIST_KEY if uuid is None else course_detail_key(uuid)
+
+
+def get_catalog_rendered(request, key):
+    """
+    Look up a cached catalog response once per request, since both the ETag and the view need it.
+
+    Args:
+        request (rest_framework.request.Request): The request
+        key (str): The catalog cache key
+    Returns:
+        tuple: The result of portal.catalog_cache.get_rendered
+    """
+    if not hasattr(request, 'catalog_rendered'):
+        request.catalog_rendered = get_rendered(key)
+    return request.catalog_rendered
+
+
+def get_catalog_summary(request, uuid=None):
+    """
+    Summarize the courses visible to the user, or a single course if uuid is given.
+    The result is stored on the request since both the ETag and Last-Modified
+    are computed from it.
+
+    Args:
+        request (rest_framework.request.Request): The request
+        uuid (str): An optional course UUID
+    Returns:
+        dict: The result of CourseQuerySet.modification_summary
+    """
+    if not hasattr(request, 'catalog_summary'):
+        courses = AuthorizationHelpers.get_courses(request.user)
+        if uuid is not None:
+            courses = courses.filter(uuid=uuid)
+        request.catalog_summary = courses.modification_summary()
+    return request.catalog_summary
+
+
+def catalog_etag(request, uuid=None):
+    """
+    Compute an ETag for the course list or a course detail without serializing it.
+
+    Args:
+        request (rest_framework.request.Request): The request
+        uuid (str): An optional course UUID
+    Returns:
+        str: The ETag, or None if the course isn't visible
+    """
+    if is_catalog_cacheable(request):
+        # The catalog generation changes whenever a course or module does, so
+        # a cached response needs no queries at all
+        key = get_catalog_cache_key(uuid)
+        content, generation = get_catalog_rendered(request, key)
+        if content is None and uuid is not None and not get_catalog_summary(request, uuid)['course_count']:
+            return None
+        return hashlib.md5(force_bytes("anonymous:{key}:{generation}".format(
+            key=key,
+            generation=generation,
+        ))).hexdigest()
+
+    summary = get_catalog_summary(request, uuid)
+    if uuid is not None and not summary['course_count']:
+        return None
+
+    user = request.user
+    # Users who can see their own courses which aren't live see a different catalog,
+    # and anonymous users get a reduced course detail.
+    if user.has_perm("portal.{}".format(SEE_OWN_NOT_LIVE[0])):
+        visibility = "user-{}".format(user.id)
+    elif user.is_anonymous():
+        visibility = "anonymous"
+    else:
+        visibility = "public"
+
+    # The query string selects fields and pages, which changes the body
+    return hashlib.md5(force_bytes("{query}:{visibility}:{course_count}:{module_count}:{courses}:{modules}".format(
+        query=request.META.get('QUERY_STRING', ''),
+        visibility=visibility,
+        course_count=summary['course_count'],
+        module_count=summary['module_count'],
+        courses=summary['courses_modified_at'],
+        modules=summary['modules_modified_at'],
+    ))).hexdigest()
+
+
+def catalog_last_modified(request, uuid=None):
+    """
+    The last time a visible course or module changed. Unlike the ETag this can't
+    reflect deletions, so clients should prefer If-None-Match.
+
+    Args:
+        request (rest_framework.request.Request): The request
+        uuid (str): An optional course UUID
+    Returns:
+        datetime.datetime: The last modification time, or None if there are no courses
+            or the response comes from the anonymous catalog cache
+    """
+    if is_catalog_cacheable(request):
+        # Not worth a query, since the ETag already covers these
+        return None
+    summary = get_catalog_summary(request, uuid)
+    timestamps = [
+        timestamp for timestamp in (summary['courses_modified_at'], summary['modules_modified_at'])
+        if timestamp is not None
+    ]
+    if not timestamps:
+        return None
+    return max(timestamps)
+
+
+class AnonymousCatalogCacheMixin(object):
+    """
+    Serves GET requests from anonymous users out of the catalog cache. Every
+    anonymous user sees the same catalog so the rendered JSON can be shared.
+    Views showing a single course take its UUID from the uuid URL kwarg.
+    """
 
-class CourseListView(ListAPIView):
+    def get(self, request, *args, **kwargs):
+        """
+        Return the cached body if there is one, else render it and cache it.
+        """
+        # pylint: disable=no-member
+        if not is_catalog_cacheable(request):
+            return super(AnonymousCatalogCacheMixin, self).get(request, *args, **kwargs)
+
+        key = get_catalog_cache_key(kwargs.get('uuid'))
+        content, generation = get_catalog_rendered(request, key)
+        if content is None:
+            response = super(AnonymousCatalogCacheMixin, self).get(request, *args, **kwargs)
+            content = request.accepted_renderer.render(
+                response.data, request.accepted_media_type, self.get_renderer_context()
+            )
+            set_rendered(key, content, generation)
+        return HttpResponse(content, content_type=request.accepted_renderer.media_type)
+
+
+class CourseListView(AnonymousCatalogCacheMixin, ListAPIView):
     """
     Lists courses available for purchase
     """
     serializer_class = CourseSerializer
     # No authentication for course list, we want the public to see this
     permission_classes = ()
+    # Maximum number of queries per request, independent of the number of courses.
+    # Enforced in tests with portal.views.util.assert_query_budget.
+    query_budget = 7
+    pagination_class = CourseCursorPagination
+    # Relations which can be added to a sparse fieldset with ?expand=
+    expandable_fields = ('modules',)
+
+    @method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified))
+    def get(self, request, *args, **kwargs):
+        """
+        Course list, or 304 Not Modified if the client's copy is current.
+        """
+        return super(CourseListView, self).get(request, *args, **kwargs)
 
-    def get_queryset(self):
-        """A queryset for courses that are available for purchase"""
+    def get_requested_fields(self):
+        """
+        Parse the sparse fieldset from ?fields= and ?expand=.
 
-        return AuthorizationHelpers.get_courses(self.request.user)
+        Returns:
+            list: Names of CourseSerializer fields to include, or None for all of them
+        """
+        params = self.request.query_params
+        if 'fields' not in params:
+            return None
+
+        fields = [name for name in params['fields'].split(',') if name]
+        expand = [name for name in params.get('expand', '').split(',') if name]
+        unknown = set(fields) - set(CourseSerializer.Meta.fields)
+        if unknown:
+            raise ValidationError("Unknown fields: {}".format(", ".join(sorted(unknown))))
+        unknown = set(expand) - set(self.expandable_fields)
+        if unknown:
+            raise ValidationError("Cannot expand: {}".format(", ".join(sorted(unknown))))
+        return fields + expand
+
+    def get_serializer(self, *args, **kwargs):
+        """
+        Restrict the serializer to the sparse fieldset, if any
+        """
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super(CourseListView, self).get_serializer(*args, **kwargs)
 
+    def list(self, request, *args, **kwargs):
+        """
+        Serialize the full list with the fast path in portal.serializers. Pages are
+        small so they use CourseSerializer.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return Response(serialize_courses(queryset, self.get_requested_fields()))
 
-class CourseDetailView(RetrieveAPIView):
+    def get_queryset(self):
+        """A queryset for courses that are available for purchase"""
+
+        courses = AuthorizationHelpers.get_courses(self.request.user)
+        fields = self.get_requested_fields()
+        if fields is None:
+            return courses.for_serialization()
+
+        # Only load the columns needed for the sparse fieldset. created_at is used
+        # for the pagination cursor.
+        columns = {'created_at'}
+        for name in fields:
+            if name == 'edx_instance':
+                courses = courses.select_related('instance')
+                columns.add('instance__instance_url')
+            elif name == 'modules':
+                courses = courses.prefetch_related('modules')
+            else:
+                columns.add(name)
+        return courses.only(*columns)
+
+
+class CourseDetailView(AnonymousCatalogCacheMixin, RetrieveAPIView):
     """
     Detail view for a course.
     """
     serializer_class = CourseSerializer
     serializer_class_anonymous = CourseSerializerReduced
     permission_classes = ()
+    # Enforced in tests with portal.views.util.assert_query_budget.
+    query_budget = 7
+
+    @method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified))
+    def get(self, request, *args, **kwargs):
+        """
+        Course detail, or 304 Not Modified if the client's copy is current.
+        """
+        return super(CourseDetailView, self).get(request, *args, **kwargs)
 
     def get_serializer_class(self):
         """
@@ -86,12 +323,21 @@ class CourseDetailView(RetrieveAPIView):
             return self.serializer_class_anonymous
         return self.serializer_class
 
+    def get_queryset(self):
+        """
+        Courses with the relations needed by the serializer. The reduced serializer
+        doesn't use modules or instance so there's nothing to prefetch for it.
+        """
+        if self.request.user.is_anonymous():
+            return Course.objects.all()
+        return Course.objects.for_serialization()
+
     def get_object(self):
         """
         Looks up information for a course from CCXCon and Course model.
         """
         uuid = self.kwargs['uuid']
-        course = AuthorizationHelpers.get_course(uuid, self.request.user)
+        course = AuthorizationHelpers.get_course(uuid, self.request.user, self.get_queryset())
         if course is None:
             raise Http404
 
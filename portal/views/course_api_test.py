@@ -15,7 +15,8 @@ from portal.factories import CourseFactory, ModuleFactory
 from portal.models import Course, Module
 from portal.serializers import CourseSerializer
 from portal.views.base import CourseTests, FAKE_CCXCON_API
-from portal.views.util import as_json
+from portal.views.course_api import CourseDetailView, CourseListView
+from portal.views.util import as_json, assert_query_budget
 
 
 class CourseAPIGETTests(CourseTests):
@@ -89,6 +90,189 @@ class CourseAPIGETTests(CourseTests):
             CourseSerializer().to_representation(self.course)
         )
 
+    def test_course_list_query_budget(self):
+        """
+        The course list should stay within its query budget no matter how many
+        courses and modules there are.
+        """
+        for _ in range(10):
+            course = CourseFactory.create(live=True)
+            ModuleFactory.create_batch(3, course=course)
+
+        with assert_query_budget(CourseListView):
+            resp = self.client.get(reverse("course-list"))
+        assert len(as_json(resp)) == 11
+
+        self.client.logout()
+        with assert_query_budget(CourseListView):
+            resp = self.client.get(reverse("course-list"))
+        assert len(as_json(resp)) == 11
+
+    def test_course_detail_query_budget(self):
+        """
+        Course detail should stay within its query budget no matter how many modules
+        the course has.
+        """
+        ModuleFactory.create_batch(10, course=self.course)
+
+        with assert_query_budget(CourseDetailView):
+            resp = self.client.get(
+                reverse("course-detail", kwargs={"uuid": self.course.uuid})
+            )
+        assert len(as_json(resp)['modules']) == 11
+
+    def test_course_list_etag(self):
+        """
+        The course list returns 304 for a matching ETag until a module changes.
+        """
+        url = reverse("course-list")
+        etag = self.client.get(url)['ETag']
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert resp.status_code == 304
+        assert resp.content == b''
+
+        self.module.title = "new title"
+        self.module.save()
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert resp.status_code == 200
+        assert resp['ETag'] != etag
+
+    def test_course_detail_etag_per_visibility(self):
+        """
+        Anonymous and logged in users get different ETags for course detail
+        since they get different serializers.
+        """
+        url = reverse("course-detail", kwargs={"uuid": self.course.uuid})
+        etag = self.client.get(url)['ETag']
+        self.client.logout()
+        assert self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    def test_course_detail_last_modified(self):
+        """
+        Course detail returns 304 if it hasn't been modified since the client's copy.
+        """
+        url = reverse("course-detail", kwargs={"uuid": self.course.uuid})
+        last_modified = self.client.get(url)['Last-Modified']
+        resp = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        assert resp.status_code == 304
+
+    def test_course_detail_no_etag_if_missing(self):
+        """
+        Courses which aren't visible get a 404 without validators.
+        """
+        self.course.live = False
+        self.course.save()
+        resp = self.client.get(reverse("course-detail", kwargs={"uuid": self.course.uuid}))
+        assert resp.status_code == 404
+        assert not resp.has_header('ETag')
+
+    def test_course_list_unpaginated_by_default(self):
+        """
+        Without page_size the course list is a plain list.
+        """
+        CourseFactory.create_batch(3, live=True)
+        for course in Course.objects.all():
+            ModuleFactory.create(course=course)
+        assert len(as_json(self.client.get(reverse("course-list")))) == 4
+
+    def test_course_list_cursor_pagination(self):
+        """
+        With page_size the course list is paginated by cursor in creation order.
+        """
+        for course in CourseFactory.create_batch(4, live=True):
+            ModuleFactory.create(course=course)
+        expected = [course.uuid for course in Course.objects.order_by('created_at', 'id')]
+
+        uuids = []
+        url = "{}?page_size=2".format(reverse("course-list"))
+        while url is not None:
+            page = as_json(self.client.get(url))
+            assert len(page['results']) <= 2
+            uuids.extend(course['uuid'] for course in page['results'])
+            url = page['next']
+        assert uuids == expected
+
+    def test_course_list_invalid_page_size(self):
+        """
+        page_size must be a positive integer.
+        """
+        for page_size in ('x', '0', '-1'):
+            resp = self.client.get(reverse("course-list"), {"page_size": page_size})
+            assert resp.status_code == 400, resp.content.decode('utf-8')
+
+    def test_course_list_sparse_fields(self):
+        """
+        ?fields= limits the output to those fields, and ?expand=modules adds modules.
+        """
+        url = reverse("course-list")
+        courses = as_json(self.client.get(url, {"fields": "uuid,title,edx_instance"}))
+        assert courses == [{
+            "uuid": self.course.uuid,
+            "title": self.course.title,
+            "edx_instance": self.course.instance.instance_url,
+        }]
+
+        courses = as_json(self.client.get(url, {"fields": "uuid", "expand": "modules"}))
+        assert courses == [{
+            "uuid": self.course.uuid,
+            "modules": CourseSerializer(self.course).data['modules'],
+        }]
+
+    def test_course_list_unknown_fields(self):
+        """
+        Unknown fields and relations which can't be expanded are rejected.
+        """
+        url = reverse("course-list")
+        resp = self.client.get(url, {"fields": "uuid,secret"})
+        assert resp.status_code == 400
+        assert "Unknown fields: secret" in resp.content.decode('utf-8')
+        resp = self.client.get(url, {"fields": "uuid", "expand": "instance"})
+        assert resp.status_code == 400
+        assert "Cannot expand: instance" in resp.content.decode('utf-8')
+
+    def test_anonymous_catalog_cached(self):
+        """
+        Anonymous course list and detail responses are served from the cache
+        until a course or module changes.
+        """
+        self.client.logout()
+        list_url = reverse("course-list")
+        detail_url = reverse("course-detail", kwargs={"uuid": self.course.uuid})
+        first_list = self.client.get(list_url)
+        first_detail = self.client.get(detail_url)
+
+        # The ETag comes from the cache too, so cached responses make no queries
+        with self.assertNumQueries(0):
+            assert self.client.get(list_url).content == first_list.content
+            assert self.client.get(detail_url).content == first_detail.content
+            resp = self.client.get(list_url, HTTP_IF_NONE_MATCH=first_list['ETag'])
+            assert resp.status_code == 304
+
+        self.module.price_without_tax = None
+        self.module.save()
+        resp = self.client.get(list_url, HTTP_IF_NONE_MATCH=first_list['ETag'])
+        assert resp.status_code == 200
+        assert as_json(resp) == []
+        resp = self.client.get(detail_url)
+        assert resp.status_code == 404
+        assert not resp.has_header('ETag')
+
+    def test_logged_in_not_cached(self):
+        """
+        Logged in users don't share the anonymous cache.
+        """
+        self.client.logout()
+        anonymous = as_json(self.client.get(
+            reverse("course-detail", kwargs={"uuid": self.course.uuid})
+        ))
+        assert 'modules' not in anonymous
+
+        self.client.login(username="auser", password="apass")
+        logged_in = as_json(self.client.get(
+            reverse("course-detail", kwargs={"uuid": self.course.uuid})
+        ))
+        assert 'modules' in logged_in
+
     def test_course_not_available(self):
         """
         Test that course detail returns a 404 if the course or module is not available.
@@ -166,7 +350,7 @@ class CourseAPIGETTests(CourseTests):
             reverse("course-detail", kwargs={"uuid": self.course.uuid})
         )
         assert resp.status_code == 200, resp.content.decode('utf-8')
-        assert 'modules' not in resp.data
+        assert 'modules' not in as_json(resp)
 
     def assert_course_visibility(self, visibility_pairs):
         """
@@ -3,11 +3,15 @@ REST API for getting permissions
 """
 
 from __future__ import unicode_literals
+import hashlib
 
 from django.http.response import Http404
+from django.utils.encoding import force_bytes
+from django.views.decorators.http import condition
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
+from portal.views.course_api import get_catalog_summary
 from portal.permissions import (
     AuthorizationHelpers,
     EDIT_OWN_PRICE,
@@ -17,7 +21,33 @@ from portal.permissions import (
 )
 
 
+def course_permissions_etag(request, uuid):
+    """
+    Compute an ETag for a user's permissions on a course. Ownership and group
+    membership changes don't update any timestamp, so this depends on them directly
+    and there is no Last-Modified.
+
+    Args:
+        request (rest_framework.request.Request): The REST request
+        uuid (str): The course UUID
+    Returns:
+        str: The ETag, or None if the course isn't visible
+    """
+    summary = get_catalog_summary(request, uuid)
+    if not summary['course_count']:
+        return None
+
+    user = request.user
+    return hashlib.md5(force_bytes("{course}:{user}:{perms}:{owned}".format(
+        course=summary['courses_modified_at'],
+        user=user.id,
+        perms=",".join(sorted(user.get_all_permissions())),
+        owned=user.courses_owned.filter(uuid=uuid).exists(),
+    ))).hexdigest()
+
+
 @api_view(["GET"])
+@condition(etag_func=course_permissions_etag)
 def course_permissions_view(request, uuid):
     """
     Returns a list of permissions and other information to adjust UI in client.
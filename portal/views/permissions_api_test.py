@@ -87,3 +87,21 @@ class PermissionsAPITests(TestCase):
 
         resp = self.client.get(reverse('course-permissions', kwargs={'uuid': course.uuid}))
         assert resp.status_code == 403, resp.content.decode('utf-8')
+
+    def test_etag(self):
+        """
+        A matching ETag gets a 304 until ownership changes.
+        """
+        user = User.objects.create_user(username="user", password="pass")
+        self.client.login(username="user", password="pass")
+        course = CourseFactory.create(live=True)
+        ModuleFactory.create(price_without_tax=3, course=course)
+        url = reverse('course-permissions', kwargs={'uuid': course.uuid})
+
+        etag = self.client.get(url)['ETag']
+        assert self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+        course.owners.add(user)
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert resp.status_code == 200, resp.content.decode('utf-8')
+        assert json.loads(resp.content.decode('utf-8'))['is_owner'] is True
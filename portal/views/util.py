@@ -3,8 +3,12 @@ Utility functions for tests
 """
 
 from __future__ import unicode_literals
+from contextlib import contextmanager
 import json
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
 
 def as_json(resp):
     """
@@ -17,3 +21,44 @@ def as_json(resp):
     """
     assert resp.status_code == 200
     return json.loads(resp.content.decode('utf-8'))
+
+
+@contextmanager
+def assert_query_budget(view_class):
+    """
+    Fail if the code inside the block runs more queries than the budget
+    declared on the view.
+
+    Args:
+        view_class (type): A view class with a query_budget attribute
+
+    Yields:
+        CaptureQueriesContext: The captured queries
+    """
+    with CaptureQueriesContext(connection) as context:
+        yield context
+    assert len(context) <= view_class.query_budget, (
+        "{view} ran {count} queries but its budget is {budget}:\n{queries}".format(
+            view=view_class.__name__,
+            count=len(context),
+            budget=view_class.query_budget,
+            queries="\n".join(query['sql'] for query in context.captured_queries),
+        )
+    )
+
+
+def assert_index_scan(queryset):
+    """
+    Fail unless Postgres uses an index to run the query. Sequential scans are
+    disabled first so the planner picks an index whenever one applies, even for
+    the tiny tables in tests.
+
+    Args:
+        queryset (django.db.models.query.QuerySet): The query to explain
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute("EXPLAIN " + sql, params)
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+    assert any(scan in plan for scan in ("Index Scan", "Index Only Scan")), plan
@@ -19,7 +19,7 @@ from rest_framework.mixins import (
 from portal.oauth2_auth import OAuth2Authentication
 from portal.permissions import HmacPermission
 from portal.models import Course
-from portal.tasks import module_population
+from portal.tasks import queue_module_population
 from portal.serializers import EdxCourseSerializer
 import portal.webhooks as webhooks
 
@@ -64,22 +64,24 @@ class EdxWebhookView(CreateModelMixin, viewsets.GenericViewSet):
         # underlying mixins. It allows us to overwrite how we get the instance
         # to update without making a complex `get_object` override. Beyond that,
         # it allows us to not mutate the request.data object.
-        if Course.objects.filter(edx_course_id=data['edx_course_id']).exists():
+        # The instance field renders as a primary key so it doesn't need a join. Modules
+        # aren't prefetched since module_population may change them before we render.
+        instance = Course.objects.filter(edx_course_id=data['edx_course_id']).first()
+        if instance is not None:
             # Mostly duped from rest_framework.mixins.UpdateModelMixin
             partial = kwargs.pop('partial', False)
-            instance = Course.objects.get(edx_course_id=data['edx_course_id'])
             serializer = self.get_serializer(
                 instance, data=data, partial=partial)
             serializer.is_valid(raise_exception=True)
             serializer.save()
-            module_population.delay(serializer.instance.edx_course_id)
+            queue_module_population(serializer.instance.edx_course_id)
             return Response(serializer.data)
         else:
             # Duped from rest_framework.mixins.CreateModelMixin for clarity.
             serializer = self.get_serializer(data=data)
             serializer.is_valid(raise_exception=True)
             self.perform_create(serializer)
-            module_population.delay(serializer.instance.edx_course_id)
+            queue_module_population(serializer.instance.edx_course_id)
             headers = self.get_success_headers(serializer.data)
             return Response(
                 serializer.data, status=status.HTTP_201_CREATED, headers=headers)
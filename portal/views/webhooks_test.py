@@ -118,7 +118,7 @@ class WebhookViewTests(TestCase):
         assert 'Message Here' in resp.content.decode('utf-8')
 
 
-@patch('portal.views.webhooks.module_population', autospec=True)
+@patch('portal.views.webhooks.queue_module_population', autospec=True)
 class EdxWebhooksTest(TestCase):
     """Tests for Edx webhook"""
     def setUp(self):
@@ -155,7 +155,7 @@ class EdxWebhooksTest(TestCase):
             "course_id": 'some-course-id',
             "image_url": "/234.jpg",
         })
-        assert mod_pop.delay.call_count == 1
+        assert mod_pop.call_count == 1
         assert resp.status_code == 201
         resp = self.client.post(reverse('webhooks-edx'), {
             "title": "title1",
@@ -166,8 +166,8 @@ class EdxWebhooksTest(TestCase):
             "image_url": "/2345.jpg",  # different
         })
 
-        assert mod_pop.delay.call_count == 2
-        call1, call2 = mod_pop.delay.call_args_list
+        assert mod_pop.call_count == 2
+        call1, call2 = mod_pop.call_args_list
         assert call1[0] == call2[0] == ('some-course-id',)
         assert resp.status_code == 200
 
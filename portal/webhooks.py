@@ -9,7 +9,7 @@ from django.db import transaction
 from rest_framework.exceptions import ValidationError
 
 from portal.models import Course, Module, BackingInstance
-from .tasks import module_population
+from .tasks import queue_module_population
 
 # Note: reflection used for names below so be careful not to rename functions.
 
@@ -83,7 +83,7 @@ def course(action, payload):
                     edx_course_id=edx_course_id,
                 )
             if edx_course_id:
-                module_population.delay(edx_course_id)
+                queue_module_population(edx_course_id)
     elif action == 'delete':
         try:
             uuid = payload['external_pk']
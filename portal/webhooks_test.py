@@ -17,7 +17,7 @@ from .factories import CourseFactory, ModuleFactory
 from .webhooks import course as course_webhook, module as module_webhook
 
 
-@patch('portal.webhooks.module_population', autospec=True)
+@patch('portal.webhooks.queue_module_population', autospec=True)
 class CourseWebhookTests(TestCase):
     """
     Test for the Course incoming webhook
@@ -75,7 +75,7 @@ class CourseWebhookTests(TestCase):
         assert course.edx_course_id == 'course-v1:ColumbiaX+DS101X+3T2015'
         assert not course.live
         assert not course.owners.exists()
-        mod_pop.delay.assert_called_with(course.edx_course_id)
+        mod_pop.assert_called_with(course.edx_course_id)
 
     def test_update_updates_if_exists(self, mod_pop):
         """Update updates if it exists"""
@@ -103,7 +103,7 @@ class CourseWebhookTests(TestCase):
         assert course.owners.count() == 1
         assert course.owners.all()[0].id == user.id
         assert course.live
-        mod_pop.delay.assert_called_with(course.edx_course_id)
+        mod_pop.assert_called_with(course.edx_course_id)
 
     def test_errors_changing_instance(self, mod_pop):
         """Update errors if changing backinginstance"""
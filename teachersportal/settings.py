@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.8/ref/settings/
 
 """
 import ast
+from datetime import timedelta
 import os
 import platform
 
@@ -287,6 +288,25 @@ LOGGING = {
     },
 }
 
+# Cache. Use redis when configured, otherwise a per-process local memory cache.
+CACHE_URL = get_var("PORTAL_CACHE_URL", get_var("REDISCLOUD_URL", None))
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds to keep rendered catalog responses for anonymous users
+CATALOG_CACHE_TIMEOUT = get_var("PORTAL_CATALOG_CACHE_TIMEOUT", 15 * 60)
+
 # Celery
 BROKER_URL = get_var("BROKER_URL", get_var("REDISCLOUD_URL", None))
 USE_CELERY = True
@@ -296,8 +316,26 @@ CELERY_RESULT_BACKEND = get_var(
 CELERY_ALWAYS_EAGER = get_var("CELERY_ALWAYS_EAGER", True)
 CELERY_EAGER_PROPAGATES_EXCEPTIONS = get_var(
     "CELERY_EAGER_PROPAGATES_EXCEPTIONS", True)
+CELERYBEAT_SCHEDULE = {
+    'drain-fulfillments': {
+        'task': 'portal.tasks.drain_fulfillments',
+        'schedule': timedelta(minutes=15),
+    },
+    'refresh-edx-tokens': {
+        'task': 'portal.tasks.refresh_access_tokens',
+        'schedule': timedelta(minutes=30),
+    },
+}
 
 CCXCON_API = get_var('CCXCON_API', None)
+# Number of CCXs created at once when fulfilling an order
+CCXCON_FULFILLMENT_CONCURRENCY = get_var('CCXCON_FULFILLMENT_CONCURRENCY', 4)
+
+# Seconds a price quote from /api/v1/quote/ can be used to check out
+QUOTE_MAX_AGE = get_var('QUOTE_MAX_AGE', 900)
+# Seconds after which a checkout with an idempotency key which never finished is
+# assumed to have crashed, and the key can be used again
+CHECKOUT_IDEMPOTENCY_TIMEOUT = get_var('CHECKOUT_IDEMPOTENCY_TIMEOUT', 10 * 60)
 
 # Secret used with signatures for CCXCon webhooks endpoint
 CCXCON_WEBHOOKS_SECRET = force_bytes(get_var('CCXCON_WEBHOOKS_SECRET', ''))
@@ -305,6 +343,38 @@ CCXCON_WEBHOOKS_SECRET = force_bytes(get_var('CCXCON_WEBHOOKS_SECRET', ''))
 # Oauth settings for CCXCon
 CCXCON_OAUTH_CLIENT_ID = get_var("CCXCON_OAUTH_CLIENT_ID", "")
 CCXCON_OAUTH_CLIENT_SECRET = get_var("CCXCON_OAUTH_CLIENT_SECRET", "")
+# Share CCXCon tokens between processes using the default cache
+CCXCON_TOKEN_CACHE_SHARED = get_var("CCXCON_TOKEN_CACHE_SHARED", False)
+
+# Connection pools for requests to edX and CCXCon
+HTTP_POOL_MAXSIZE = get_var("HTTP_POOL_MAXSIZE", 10)
+HTTP_CONNECT_TIMEOUT = get_var("HTTP_CONNECT_TIMEOUT", 5)
+HTTP_READ_TIMEOUT = get_var("HTTP_READ_TIMEOUT", 30)
+HTTP_MAX_RETRIES = get_var("HTTP_MAX_RETRIES", 3)
+HTTP_RETRY_BACKOFF = get_var("HTTP_RETRY_BACKOFF", 0.1)
+# Seconds between logging each process's connection reuse per host. 0 logs on every request.
+HTTP_POOL_STATS_INTERVAL = get_var("HTTP_POOL_STATS_INTERVAL", 5 * 60)
+# Requests to a host fail fast for HTTP_CIRCUIT_RESET_TIMEOUT seconds after
+# HTTP_CIRCUIT_FAILURE_THRESHOLD consecutive connection errors, timeouts or 5xx responses
+HTTP_CIRCUIT_FAILURE_THRESHOLD = get_var("HTTP_CIRCUIT_FAILURE_THRESHOLD", 5)
+HTTP_CIRCUIT_RESET_TIMEOUT = get_var("HTTP_CIRCUIT_RESET_TIMEOUT", 30)
+# Total seconds allowed for the requests needed to create a CCX or fetch a course from edX
+CCXCON_DEADLINE = get_var("CCXCON_DEADLINE", 20)
+EDX_DEADLINE = get_var("EDX_DEADLINE", 60)
+
+# Seconds before expiring that edX tokens are refreshed by refresh_access_tokens. This needs to be
+# more than the two hours before expiring when BackingInstance.is_expired trips, plus the task's schedule.
+EDX_TOKEN_REFRESH_MARGIN = get_var("EDX_TOKEN_REFRESH_MARGIN", 3 * 60 * 60)
+# Seconds to wait for another process to refresh an edX token. The refresh itself is limited
+# to EDX_DEADLINE, which is also how long the lock around it lasts.
+EDX_TOKEN_LOCK_TIMEOUT = get_var("EDX_TOKEN_LOCK_TIMEOUT", 30)
+
+# Seconds to wait before syncing a course's modules, so bursts of updates are synced once
+MODULE_POPULATION_DELAY = get_var("MODULE_POPULATION_DELAY", 10)
+# Seconds after which a queued or running sync is assumed lost and another can start
+MODULE_POPULATION_LOCK_TIMEOUT = get_var("MODULE_POPULATION_LOCK_TIMEOUT", 10 * 60)
+# Seconds an eager sync, e.g. one run from a webhook request, waits for a running sync of the same course
+MODULE_POPULATION_EAGER_WAIT = get_var("MODULE_POPULATION_EAGER_WAIT", 5)
 
 # Stripe keys
 STRIPE_PUBLISHABLE_KEY = get_var("STRIPE_PUBLISHABLE_KEY", "")